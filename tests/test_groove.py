@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for groove templates."""
+
+import numpy as np
+import pydub
+
+import wubwub as wb
+from wubwub.render import voice_end
+
+def tone(ms=2000, freq=220, rate=44100):
+    t = np.arange(int(rate * ms / 1000)) / rate
+    x = .3 * np.sin(2 * np.pi * freq * t)
+    return pydub.AudioSegment(data=(x * 32767).astype(np.int16).tobytes(),
+                              sample_width=2, frame_rate=rate, channels=1)
+
+def make_sampler(groove, **kwargs):
+    seq = wb.Sequencer(bpm=120, beats=4)
+    track = seq.add_sampler(tone(), name='tone', **kwargs)
+    track.make_notes(np.arange(1, 5, 1/4), lengths=2)
+    track.groove = groove
+    return track
+
+def test_swing_without_overlap():
+    track = make_sampler(wb.Groove(swing=1/3), overlap=False)
+    voices = track._voice_index().items
+    positions = [v.position for v in voices]
+    # swung notes are moved, and each note lasts until the next one
+    assert np.isclose(positions[1], 125 + 125 / 3)
+    for v, following in zip(voices, positions[1:]):
+        assert np.isclose(v.position + v.duration, following)
+
+def test_swing_with_max_voices():
+    track = make_sampler(wb.Groove(swing=1/3), overlap=True)
+    track.max_voices = 2
+    voices = track._voice_index().items
+    assert np.isclose(voices[1].position, 125 + 125 / 3)
+    for v in voices:
+        sounding = [u for u in voices
+                    if u.position <= v.position < voice_end(u)]
+        assert len(sounding) <= 2
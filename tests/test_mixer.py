@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for buses and groups."""
+
+import numpy as np
+import pydub
+
+import wubwub as wb
+
+def tone(ms=300, freq=220, rate=44100):
+    t = np.arange(int(rate * ms / 1000)) / rate
+    x = .3 * np.sin(2 * np.pi * freq * t) * np.exp(-t * 5)
+    return pydub.AudioSegment(data=(x * 32767).astype(np.int16).tobytes(),
+                              sample_width=2, frame_rate=rate, channels=1)
+
+def samples(audio):
+    return np.array(audio.get_array_of_samples())
+
+def test_split_join_with_bus_send():
+    seq = wb.Sequencer(bpm=120, beats=8)
+    a = seq.add_sampler(tone(), name='a')
+    a.make_notes_every(1)
+    hat = seq.add_sampler(tone(100, 3000), name='hat')
+    hat.make_notes_every(1/2)
+    seq.add_bus('verb', effects=wb.Delay(mix=1), volume=-3)
+    a.send('verb', -6)
+    seq.add_group('drums', ['a', 'hat'], volume=-2)
+
+    joined = wb.join(seq.split(5))
+    assert [bus.name for bus in joined.buses()] == ['verb']
+    assert joined.get_group('drums').tracks() == (joined['a'], joined['hat'])
+    assert np.array_equal(samples(joined.build()), samples(seq.build()))
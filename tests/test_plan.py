@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for compiled render plans."""
+
+import numpy as np
+import pydub
+import pytest
+
+import wubwub as wb
+from wubwub.plan import BACKENDS
+
+def tone(ms=300, freq=220, rate=44100, channels=1):
+    t = np.arange(int(rate * ms / 1000)) / rate
+    x = .3 * np.sin(2 * np.pi * freq * t) * np.exp(-t * 5)
+    x = np.repeat(x[:, None], channels, axis=1)
+    return pydub.AudioSegment(data=(x * 32767).astype(np.int16).tobytes(),
+                              sample_width=2, frame_rate=rate,
+                              channels=channels)
+
+def samples(audio):
+    return np.array(audio.get_array_of_samples())
+
+@pytest.fixture(scope='module')
+def sequencer():
+    seq = wb.Sequencer(bpm=120, beats=8)
+    kick = seq.add_sampler(tone(200, 60), name='kick')
+    kick.make_notes_every(1)
+    hat = seq.add_sampler(tone(100, 3000), name='hat')
+    hat.make_notes_every(1/4, pitches=[0, 2], volumes=[0, -3])
+    hat.pan = .5
+    pad = seq.add_sampler(tone(1500, 220, channels=2), name='pad',
+                          overlap=True)
+    pad.make_chord_every(4, pitches=[0, 3, 7], lengths=2)
+    pad.effects = wb.Biquad('lowpass', 800)
+    multi = seq.add_multisampler(name='multi')
+    multi.add_sample('x', tone(300, 500, rate=48000))
+    multi.make_notes_every(2, pitches=['x'])
+    seq.add_bus('delay', effects=wb.Delay(mix=1))
+    pad.send('delay', -6)
+    seq.add_group('drums', ['kick', 'hat'], volume=-2)
+    return seq
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_backends_match_build(sequencer, backend):
+    plan = sequencer.compile(overhang=1)
+    built = sequencer.build(overhang=1)
+    assert np.array_equal(samples(plan.build(backend)), samples(built))
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for limiting the polyphony of Tracks."""
+
+import numpy as np
+import pydub
+import pytest
+
+import wubwub as wb
+
+RATE = 44100
+
+def sine(ms=3000, freq=220):
+    t = np.arange(int(RATE * ms / 1000)) / RATE
+    return (.3 * np.sin(2 * np.pi * freq * t) * 32767).astype(np.int16)
+
+def make_track():
+    seq = wb.Sequencer(bpm=120, beats=4)
+    sample = pydub.AudioSegment(data=sine().tobytes(), sample_width=2,
+                                frame_rate=RATE, channels=1)
+    track = seq.add_sampler(sample, name='sine', overlap=True)
+    track.max_voices = 2
+    return track
+
+def test_limit_voices_oldest():
+    track = make_track()
+    track.make_notes([1, 2, 3], lengths=4, volumes=[0, -10, 0])
+    voices = track.schedule()
+    # the first note is cut off when the third starts
+    assert [(v.position, v.duration) for v in voices] == [
+        (0, 1000), (500, 2000), (1000, 2000)]
+
+def test_limit_voices_quietest():
+    track = make_track()
+    track.make_notes([1, 2, 3], lengths=4, volumes=[0, -10, 0])
+    track.steal = 'quietest'
+    voices = track.schedule()
+    # the quiet second note is cut off when the third starts
+    assert [(v.position, v.duration) for v in voices] == [
+        (0, 2000), (500, 500), (1000, 2000)]
+
+def test_limit_voices_chord():
+    track = make_track()
+    track.make_chord(1, [0, 4, 7], lengths=2)
+    # a voice stolen as it starts is removed; chords are scheduled from
+    # their last note, so that is the oldest
+    voices = track.schedule()
+    assert len(voices) == 2
+    assert sorted(np.log2(v.ratio) * 12 for v in voices) == pytest.approx([0, 4])
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for the render engine, against a plain NumPy mix of the notes."""
+
+import numpy as np
+import pydub
+import pytest
+
+import wubwub as wb
+
+RATE = 44100
+
+def sine(ms=800, freq=220):
+    t = np.arange(int(RATE * ms / 1000)) / RATE
+    return (.3 * np.sin(2 * np.pi * freq * t) * 32767).astype(np.int16)
+
+def segment(data):
+    return pydub.AudioSegment(data=data.tobytes(), sample_width=2,
+                              frame_rate=RATE, channels=1)
+
+def samples(audio):
+    return np.array(audio.get_array_of_samples()).reshape(-1, audio.channels)
+
+def fade(n, start, stop):
+    return np.linspace(start, stop, n, endpoint=False)
+
+def reference(data, notes, total):
+    '''Mix `(start_ms, duration_ms, semitones, volume)` notes of a sample
+    by hand, with the default 10 ms attack and release fades.'''
+    source = data / 32768
+    out = np.zeros(total)
+    for start, duration, semitones, volume in notes:
+        step = 2 ** (semitones / 12)
+        played = np.interp(np.arange(int(len(source) / step)) * step,
+                           np.arange(len(source)), source)
+        n = min(int(duration * RATE / 1000), len(played))
+        sound = played[:n] * 10 ** (volume / 20)
+        sound[:441] *= fade(441, 0, 1)[:n]
+        sound[n - 441:] *= fade(441, 1, 0)
+        first = int(start * RATE / 1000)
+        out[first:first + n] += sound
+    return np.clip(np.rint(out * 32768), -32768, 32767)
+
+@pytest.mark.parametrize('overlap', [True, False])
+def test_build_matches_reference(overlap):
+    data = sine()
+    seq = wb.Sequencer(bpm=120, beats=4)
+    track = seq.add_sampler(segment(data), name='sine', overlap=overlap)
+    track.add(1, wb.Note(0, 2))
+    track.add(2, wb.Note(7, 2, volume=-6))
+    track.add(3, wb.Note(-12, 1, volume=-3))
+    # at 120 BPM, beats are 500 ms; without overlap, notes stop at the next
+    first = 800 if overlap else 500
+    notes = [(0, first, 0, 0), (500, first, 7, -6), (1000, 500, -12, -3)]
+    expected = reference(data, notes, 4 * RATE // 2)
+    built = samples(track.build())
+    for channel in built.T:
+        assert np.abs(channel - expected).max() <= 1
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for splicing note edits into the cached rendering of a Track."""
+
+import numpy as np
+import pydub
+
+import wubwub as wb
+
+def tone(ms=400, freq=220, rate=44100):
+    t = np.arange(int(rate * ms / 1000)) / rate
+    x = .3 * np.sin(2 * np.pi * freq * t) * np.exp(-t * 5)
+    return pydub.AudioSegment(data=(x * 32767).astype(np.int16).tobytes(),
+                              sample_width=2, frame_rate=rate, channels=1)
+
+def samples(audio):
+    return np.array(audio.get_array_of_samples())
+
+def fresh_build(track):
+    track._build_cache = None
+    return samples(track.build())
+
+def make_track():
+    seq = wb.Sequencer(bpm=120, beats=16)
+    track = seq.add_sampler(tone(), name='tone')
+    track.make_notes(range(1, 17))
+    track.build()
+    return track
+
+def test_splice_duplicate_note():
+    track = make_track()
+    track.add(9, wb.Note(0), merge=True)
+    spliced = samples(track.build())
+    assert np.array_equal(spliced, fresh_build(track))
+
+def test_splice_replaced_chord():
+    track = make_track()
+    track.add(5, wb.Chord([wb.Note(0), wb.Note(0)]))
+    spliced = samples(track.build())
+    assert np.array_equal(spliced, fresh_build(track))
+    track.add(5, wb.Note(0))
+    spliced = samples(track.build())
+    assert np.array_equal(spliced, fresh_build(track))
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for streaming Sequencers in blocks."""
+
+import wave
+
+import numpy as np
+import pydub
+import pytest
+
+import wubwub as wb
+
+def tone(ms=300, freq=220, rate=44100):
+    t = np.arange(int(rate * ms / 1000)) / rate
+    x = .3 * np.sin(2 * np.pi * freq * t) * np.exp(-t * 5)
+    return pydub.AudioSegment(data=(x * 32767).astype(np.int16).tobytes(),
+                              sample_width=2, frame_rate=rate, channels=1)
+
+@pytest.fixture
+def sequencer():
+    seq = wb.Sequencer(bpm=120, beats=8)
+    kick = seq.add_sampler(tone(200, 60), name='kick')
+    kick.make_notes_every(1)
+    kick.effects = wb.Distortion(drive=4)
+    hat = seq.add_sampler(tone(100, 3000), name='hat')
+    hat.make_notes_every(1/4, volumes=[0, -3])
+    hat.effects = wb.Biquad('highpass', 2000) + wb.Compressor(threshold=-30)
+    hat.pan = -.5
+    pad = seq.add_sampler(tone(1500, 220), name='pad', overlap=True)
+    pad.make_chord_every(4, pitches=[0, 3, 7], lengths=2)
+    seq.add_bus('delay', effects=wb.Delay(mix=1))
+    pad.send('delay', -6)
+    seq.effects = wb.Limiter(threshold=-6)
+    return seq
+
+def test_blocks_match_render(sequencer):
+    rendered = sequencer.render(overhang=1).to_dense().data
+    blocks = [b.data for b in sequencer.iter_blocks(5000, overhang=1)]
+    assert all(len(b) == 5000 for b in blocks[:-1])
+    streamed = np.concatenate(blocks)
+    assert streamed.shape == rendered.shape
+    assert np.abs(streamed - rendered).max() < 1e-6
+
+def test_export_blocks_matches_build(sequencer, tmp_path):
+    path = tmp_path / 'out.wav'
+    wb.export_blocks(sequencer.iter_blocks(5000, overhang=1), path)
+    built = sequencer.build(overhang=1)
+    with wave.open(str(path)) as f:
+        assert f.getnchannels() == built.channels
+        assert f.getframerate() == built.frame_rate
+        data = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+    expected = np.array(built.get_array_of_samples())
+    assert len(data) == len(expected)
+    assert np.abs(data.astype(np.int64) - expected).max() <= 1
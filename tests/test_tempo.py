@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Tests for tempo maps."""
+
+import numpy as np
+
+import wubwub as wb
+
+def test_ramp_then_step_on_same_beat():
+    tempo = wb.TempoMap(100, [(5, 200, 'linear'), (5, 50)])
+    ramp = wb.TempoMap(100, [(5, 200, 'linear')])
+    # ramps from 100 to 200 over beats 1-5, then jumps to 50
+    assert np.allclose(tempo.bpm_at([1, 3, 4.99, 5, 7]),
+                       [100, 150, 199.75, 50, 50])
+    assert np.isclose(tempo.ms(5), ramp.ms(5))
+    assert np.isclose(tempo.ms(7) - tempo.ms(5), 2 * 60000 / 50)
+    assert np.allclose(tempo.beats(tempo.ms([2, 5, 7])), [2, 5, 7])
+
+def test_same_beat_order_is_kept():
+    points = wb.tempo.tempo_points([(5, 200, 'linear'), (5, 50), (3, 90)])
+    assert points == ((3, 90, 'step'), (5, 200, 'linear'), (5, 50, 'step'))
+
+def test_split_in_ramp():
+    seq = wb.Sequencer(bpm=120, beats=12)
+    seq.set_tempo([(9, 200, 'linear')])
+    a, b = seq.split(5)
+    tempo = seq.tempo_map()
+    assert np.isclose(a.tempo_map().ms(5), tempo.ms(5))
+    assert np.isclose(b.tempo_map().ms(5), tempo.ms(9) - tempo.ms(5))
+    assert np.isclose(b.tempo_map().bpm_at(1), tempo.bpm_at(5))
@@ -7,13 +7,21 @@ __version__ = v
 del v
 
 # imports
+from .arrangement import *
 from .audio import *
+from .effects import *
 from .errors import *
+from .groove import *
+from .intervals import *
+from .mixer import *
 from .notes import *
 from .pattern import *
 from .pitch import *
+from .plan import *
 from .plots import *
+from .render import *
 from .resources import *
 from .seqstring import *
 from .sequencer import *
+from .tempo import *
 from .tracks import *
\ No newline at end of file
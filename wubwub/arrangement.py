@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The Arrangement class, for placing Sequencers on a timeline.
+
+An Arrangement holds *clips*, which are Sequencers (or a section of one)
+placed at a beat of the Arrangement.  This is like `wubwub.sequencer.stitch()`,
+but the clips can be placed anywhere (and may overlap), and the rendering of
+each clip is cached.  The cache is keyed by the content of the clip (the
+notes scheduled by each Track, the samples they use, and the postprocessing
+and automation settings), so when the Arrangement is rebuilt, only clips which have changed
+are rendered again.  Rearranging clips therefore only costs the time needed
+to mix the cached audio.
+"""
+
+from collections import namedtuple
+import os
+
+from wubwub.audio import play, _overhang_to_milli
+from wubwub.errors import WubWubError
+from wubwub.render import SparseAudioBuffer, get_quality, ms_to_frames
+from wubwub.resources import MINUTE
+
+__all__ = ['Arrangement', 'Clip']
+
+Clip = namedtuple('Clip', ['sequencer', 'position', 'start', 'end'])
+Clip.__doc__ = '''
+A Sequencer placed on the timeline of an `Arrangement`.
+
+- `sequencer`: the `wubwub.sequencer.Sequencer`
+- `position`: beat of the Arrangement where the clip starts
+- `start`: beat of the Sequencer where the clip starts
+- `end`: beat of the Sequencer where the clip ends (exclusive), or `None`
+for the end of the Sequencer
+'''
+
+def _sequencer_key(sequencer):
+    '''Return a hashable key describing the content of a Sequencer, and
+    the samples it uses.  Samples are identified by their id, so they are
+    returned to be kept alive as long as the key is in use.'''
+    samples = []
+    tracks = []
+    for track in sequencer.tracks():
+        voices = track._voice_index().items
+        samples.extend(v.sample for v in voices)
+        tracks.append((tuple(v._replace(sample=id(v.sample)) for v in voices),
+                       track.volume, track.pan, id(track.effects),
+                       tuple(track.postprocess_steps),
+                       tuple(sorted(track.automation.items())),
+                       tuple(sorted(track.sends.items()))))
+    buses = tuple((bus.name, id(bus.effects), bus.volume, bus.pan,
+                   tuple(bus.postprocess_steps)) for bus in sequencer.buses())
+    groups = tuple((group.name, tuple(track.name for track in group.tracks()),
+                    id(group.effects), group.volume, group.pan,
+                    tuple(group.postprocess_steps))
+                   for group in sequencer.groups())
+    key = (sequencer.bpm, sequencer.tempo_changes, sequencer.beats,
+           sequencer.volume, sequencer.pan,
+           id(sequencer.effects), tuple(sequencer.postprocess_steps),
+           tuple(sorted(sequencer.automation.items())), buses, groups,
+           tuple(tracks))
+    return key, samples
+
+class Arrangement:
+    '''
+    A timeline of Sequencer clips.  Clips are placed with
+    `Arrangement.add()` or `Arrangement.append()`, and the whole timeline is
+    rendered with `Arrangement.build()`.
+
+    Each clip is rendered with `wubwub.sequencer.Sequencer.render()`, and the
+    result is cached by the content of the clip.  Clips are only rendered
+    again when their notes, samples, tempo, or postprocessing change; the
+    same section used many times is only rendered once.  Note that effects
+    are identified by object, so changes made to an effects chain in place
+    are not detected (use `Arrangement.clear_cache()`).
+
+    Parameters
+    ----------
+    bpm : int or float
+        Tempo of the Arrangement, used for positioning clips (and for
+        the `end_overhang` when it is given in beats).
+
+    Examples
+    --------
+    ```python
+    >>> import wubwub as wb
+
+    >>> intro = wb.Sequencer(bpm=120, beats=8)
+    >>> verse = wb.Sequencer(bpm=120, beats=16)
+
+    >>> arr = wb.Arrangement(bpm=120)
+    >>> intro_clips = arr.append(intro)
+    >>> verse_clips = arr.append(verse, times=2)
+    >>> arr.get_beats()
+    40.0
+
+    # only the first build renders the sections
+    >>> audio = arr.build()
+    ```
+
+    '''
+
+    def __init__(self, bpm):
+        self.bpm = bpm
+        self.clips = []
+        self._cache = {}
+
+    def __repr__(self):
+        return f'Arrangement(bpm={self.bpm}, clips={len(self.clips)})'
+
+    def __len__(self):
+        return len(self.clips)
+
+    def __iter__(self):
+        return iter(self.clips)
+
+    def __getitem__(self, index):
+        return self.clips[index]
+
+    def _beat_ms(self):
+        return (1/self.bpm) * MINUTE
+
+    def _clip_ms(self, clip):
+        '''Return the start and length of a clip, in milliseconds.'''
+        seq = clip.sequencer
+        end = seq.beats + 1 if clip.end is None else clip.end
+        length = seq.tempo_map().duration(clip.start, end - clip.start)
+        return (clip.position - 1) * self._beat_ms(), length
+
+    def add(self, sequencer, position, start=1, end=None):
+        '''
+        Place a Sequencer on the timeline.
+
+        Parameters
+        ----------
+        sequencer : wubwub.sequencer.Sequencer
+            The Sequencer to add.
+        position : int or float
+            Beat of the Arrangement where the clip starts.
+        start : int or float, optional
+            Beat of the Sequencer to start the clip from. The default is 1.
+        end : int, float, or None, optional
+            Beat of the Sequencer to end the clip on (exclusive). The default
+            is None, meaning the end of the Sequencer.
+
+        Returns
+        -------
+        clip : wubwub.arrangement.Clip
+            The new clip.
+
+        '''
+        if position < 1:
+            raise WubWubError('Clip position must be at least 1.')
+        clip = Clip(sequencer, position, start, end)
+        self.clips.append(clip)
+        return clip
+
+    def append(self, sequencer, start=1, end=None, times=1):
+        '''Place a Sequencer after the end of the last clip on the timeline,
+        `times` times in a row.  See `Arrangement.add()` for the other
+        parameters.  Returns the new clips.'''
+        new = []
+        for i in range(times):
+            new.append(self.add(sequencer, self.get_beats() + 1, start, end))
+        return new
+
+    def remove(self, index):
+        '''Remove the clip at `index` from the timeline (and return it).'''
+        return self.clips.pop(index)
+
+    def move(self, index, position):
+        '''Move the clip at `index` to a new beat `position`.  The rendering
+        of the clip is reused.  Returns the moved clip.'''
+        if position < 1:
+            raise WubWubError('Clip position must be at least 1.')
+        self.clips[index] = self.clips[index]._replace(position=position)
+        return self.clips[index]
+
+    def get_beats(self):
+        '''Return the length of the Arrangement in beats, i.e. the end of
+        the last clip.'''
+        b = self._beat_ms()
+        ends = [sum(self._clip_ms(clip)) / b for clip in self.clips]
+        return max(ends, default=0)
+
+    def clear_cache(self):
+        '''Remove all cached renderings.'''
+        self._cache = {}
+
+    def render_rate(self):
+        '''Returns the frame rate used for rendering the Arrangement.'''
+        return max([clip.sequencer.render_rate() for clip in self.clips]
+                   + [11025])
+
+    def render(self, internal_overhang=0, end_overhang=0, overhang_type='beats',
+               quality='full'):
+        '''
+        Render the Arrangement into a `wubwub.render.SparseAudioBuffer`.
+        Clips whose content has not changed since the last rendering are
+        taken from the cache.
+
+        Parameters
+        ----------
+        internal_overhang : int or float, optional
+            Extra time rendered after the end of each clip (in the units
+            of `overhang_type`, relative to the tempo of the clip's
+            Sequencer).  This prevents sounds from being cut off at the end
+            of clips. The default is 0.
+        end_overhang : int or float, optional
+            Extra time added after the end of the Arrangement. The default
+            is 0.
+        overhang_type : str -> 'beats' or 'seconds', optional
+            Units for the overhangs. The default is 'beats'.
+        quality : str, dict, or wubwub.render.RenderQuality, optional
+            Render quality; see `wubwub.render.get_quality()`. The default
+            is 'full'.
+
+        Returns
+        -------
+        wubwub.render.SparseAudioBuffer
+            The rendered audio.
+
+        '''
+        quality = get_quality(quality)
+        rate = quality.frame_rate or self.render_rate()
+        end_ms = self.get_beats() * self._beat_ms()
+        end_ms += _overhang_to_milli(end_overhang, overhang_type,
+                                     self._beat_ms())
+        mix = SparseAudioBuffer(ms_to_frames(end_ms, rate), rate)
+        cache = {}
+        for clip in self.clips:
+            content, samples = _sequencer_key(clip.sequencer)
+            key = (content, clip.start, clip.end, internal_overhang,
+                   overhang_type, rate, quality)
+            if key in cache:
+                rendered, _ = cache[key]
+            elif key in self._cache:
+                rendered, _ = cache[key] = self._cache[key]
+            else:
+                rendered = clip.sequencer.render(internal_overhang,
+                                                 overhang_type,
+                                                 frame_rate=rate,
+                                                 quality=quality,
+                                                 start=clip.start,
+                                                 end=clip.end)
+                cache[key] = (rendered, samples)
+            position, _ = self._clip_ms(clip)
+            mix.mix(rendered, ms_to_frames(position, rate))
+        # only keep the renderings used by the current timeline
+        self._cache = cache
+        return mix
+
+    def build(self, internal_overhang=0, end_overhang=0, overhang_type='beats',
+              quality='full'):
+        '''Render the Arrangement into a pydub AudioSegment.  See
+        `Arrangement.render()` for the parameters.'''
+        return self.render(internal_overhang, end_overhang, overhang_type,
+                           quality=quality).to_audiosegment()
+
+    def play(self, internal_overhang=0, end_overhang=0, overhang_type='beats',
+             quality='full'):
+        '''Play back the Arrangement.  See `Arrangement.render()` for the
+        parameters.'''
+        play(self.build(internal_overhang, end_overhang, overhang_type,
+                        quality=quality))
+
+    def export(self, path, internal_overhang=0, end_overhang=0,
+               overhang_type='beats', fmt=None):
+        '''Save the rendered Arrangement to a file, using the pydub
+        export method.  The format is determined by the extension of `path`,
+        unless `fmt` is given.  See `Arrangement.render()` for the other
+        parameters.'''
+        if fmt is None:
+            _, fmt = os.path.splitext(path)
+            fmt = fmt.lstrip('.')
+        build = self.build(internal_overhang, end_overhang, overhang_type)
+        build.export(path, format=fmt)
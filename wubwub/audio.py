@@ -5,8 +5,10 @@ This module provides some functions for manipulating pydub AudioSegments.
 """
 
 import array
+import wave
 
 import numpy as np
+import pydub
 from pydub.playback import play as _play
 
 from wubwub.errors import WubWubError
@@ -68,9 +70,17 @@ def add_note_to_audio(note, audio, sample, position, duration, basepitch=None,
     return audio
 
 def add_effects(sound, fx):
-    '''Add a pysndfx AudioEffectsChain to a pydub AudioSegment.'''
+    '''Add a pysndfx AudioEffectsChain, or built-in effects (see
+    `wubwub.effects`), to a pydub AudioSegment.'''
     if fx is None:
         return sound
+    if hasattr(fx, 'process'):
+        scale = 2 ** (8 * sound.sample_width - 1)
+        samples = np.array(sound.get_array_of_samples(), dtype=np.float32)
+        frames = samples.reshape(-1, sound.channels) / scale
+        frames = fx.copy().process(frames, sound.frame_rate)
+        samples = np.clip(np.rint(frames.ravel() * scale), -scale, scale - 1)
+        return sound._spawn(array.array(sound.array_type, samples.astype(int)))
     samples = np.array(sound.get_array_of_samples())
     samples = fx(samples)
     samples = array.array(sound.array_type, samples)
@@ -98,6 +108,10 @@ def play(audiosegment, convert=True):
 
     To get around the limitation imposed here, you can instead use
     `pydub.play` on any AudioSegments produced in wubwub.'''
+    _play(_playable(audiosegment, convert))
+
+def _playable(audiosegment, convert=True):
+    '''Apply the conversion used by `play()` to an AudioSegment.'''
     if audiosegment.sample_width != 2:
         if convert:
             audiosegment = audiosegment.set_sample_width(2).set_frame_rate(44100)
@@ -105,4 +119,64 @@ def play(audiosegment, convert=True):
             raise WubWubError('wubwub can only play 16-bit sounds, '
                               'either use the `convert` parameter '
                               'or otherwise convert the sound to be 16-bit.')
-    _play(audiosegment)
+    return audiosegment
+
+def _block_segments(blocks):
+    '''Convert a stream of audio blocks into pydub AudioSegments, all with
+    the number of channels of the first block.'''
+    channels = None
+    for block in blocks:
+        if not isinstance(block, pydub.AudioSegment):
+            block = block.to_audiosegment()
+        if channels is None:
+            channels = block.channels
+        yield block.set_channels(channels)
+
+def play_blocks(blocks, convert=True):
+    '''Playback a stream of audio blocks, such as those yielded by
+    `wubwub.sequencer.Sequencer.iter_blocks()`.  Each block can be a pydub
+    AudioSegment or any object with a `to_audiosegment()` method.
+
+    When [pyaudio](https://people.csail.mit.edu/hubert/pyaudio/) is installed,
+    each block is written to the output stream as soon as it is produced, so
+    playback starts immediately and the audio is never held in full.
+    Otherwise, the blocks are joined into one AudioSegment and played with
+    `play()`.  The `convert` parameter is the same as for `play()`.'''
+    segments = (_playable(s, convert) for s in _block_segments(blocks))
+    try:
+        import pyaudio
+    except ImportError:
+        segments = list(segments)
+        if segments:
+            data = b''.join(s.raw_data for s in segments)
+            _play(segments[0]._spawn(data))
+        return
+
+    p = pyaudio.PyAudio()
+    stream = None
+    try:
+        for segment in segments:
+            if stream is None:
+                stream = p.open(format=p.get_format_from_width(segment.sample_width),
+                                channels=segment.channels,
+                                rate=segment.frame_rate,
+                                output=True)
+            stream.write(segment.raw_data)
+    finally:
+        if stream is not None:
+            stream.stop_stream()
+            stream.close()
+        p.terminate()
+
+def export_blocks(blocks, path, frame_rate=44100):
+    '''Save a stream of audio blocks (see `play_blocks()`) to a WAV file.
+    Each block is written as soon as it is produced, so the audio is never
+    held in full.  The `frame_rate` is only used when there are no blocks.'''
+    with wave.open(str(path), 'wb') as f:
+        f.setparams((1, 2, frame_rate, 0, 'NONE', 'not compressed'))
+        for i, segment in enumerate(_block_segments(blocks)):
+            if i == 0:
+                f.setnchannels(segment.channels)
+                f.setsampwidth(segment.sample_width)
+                f.setframerate(segment.frame_rate)
+            f.writeframes(segment.raw_data)
@@ -0,0 +1,556 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Built-in audio effects for Tracks and Sequencers.
+
+These effects can be set as the `effects` of a `wubwub.tracks.Track` or
+`wubwub.sequencer.Sequencer`, in place of a pysndfx AudioEffectsChain.
+Rather than passing the audio through sox, they work directly on the
+float32 arrays used for rendering (see `wubwub.render`), with NumPy.
+
+Effects are objects with a `process()` method, which takes a block of
+frames and returns the processed block, and a `reset()` method.  Effects
+with memory (filters, delays, etc.) keep their state between calls to
+`process()`, so consecutive blocks of audio give the same result as the
+whole audio at once; this lets Tracks and Sequencers using them be
+streamed (see `wubwub.sequencer.Sequencer.iter_blocks()`).  Each
+rendering uses a fresh copy of the effects (see `Effect.copy()`), so the
+same effect can be used by several Tracks.
+
+Effects can be combined with `+` (or `EffectsChain`):
+
+```python
+>>> import wubwub as wb
+
+>>> seq = wb.Sequencer(bpm=120, beats=8)
+>>> seq.effects = wb.Biquad('highpass', 80) + wb.Compressor(-18, ratio=3)
+```
+"""
+
+from abc import ABCMeta, abstractmethod
+import copy
+from functools import lru_cache
+
+import numpy as np
+import pydub
+
+from wubwub.errors import WubWubError
+from wubwub.render import ms_to_frames, segment_to_array, _resample
+
+__all__ = ['Effect', 'EffectsChain', 'Biquad', 'Compressor', 'Limiter',
+           'Delay', 'Distortion', 'Bitcrush', 'Reverb']
+
+BIQUAD_BLOCK = 4096
+"""Number of frames filtered at once by `Biquad`."""
+
+BIQUAD_TYPES = ['lowpass', 'highpass', 'bandpass', 'notch', 'peak',
+                'lowshelf', 'highshelf']
+"""Options for the `kind` of `Biquad` filters."""
+
+class Effect(metaclass=ABCMeta):
+    '''Base class for the built-in effects.'''
+
+    def __init__(self):
+        self.reset()
+
+    def __repr__(self):
+        params = ', '.join(f'{k}={v!r}' for k, v in vars(self).items()
+                           if not k.startswith('_'))
+        return f'{type(self).__name__}({params})'
+
+    def __add__(self, other):
+        '''Chain this effect with another (see `EffectsChain`).'''
+        return EffectsChain(self, other)
+
+    @abstractmethod
+    def process(self, frames, frame_rate):
+        '''
+        Apply the effect to a block of audio, continuing from the previous
+        block (if any).
+
+        Parameters
+        ----------
+        frames : numpy.ndarray
+            Float32 audio frames, with shape `(frames, channels)` (see
+            `wubwub.render.segment_to_array()`).
+        frame_rate : int
+            Frame rate of the audio.
+
+        Returns
+        -------
+        numpy.ndarray
+            The processed frames (the same shape as `frames`).
+
+        '''
+
+    def reset(self):
+        '''Clear the state of the effect, so the next block processed is
+        treated as the start of the audio.'''
+
+    def copy(self):
+        '''Return a copy of the effect (with the same parameters), with its
+        state cleared.'''
+        new = copy.copy(self)
+        new.reset()
+        return new
+
+class EffectsChain(Effect):
+    '''
+    A series of effects, applied in order.
+
+    Parameters
+    ----------
+    *effects : wubwub.effects.Effect
+        The effects.  Chains are flattened into the new chain.
+
+    '''
+
+    def __init__(self, *effects):
+        self.effects = []
+        for effect in effects:
+            if isinstance(effect, EffectsChain):
+                self.effects.extend(effect.effects)
+            else:
+                self.effects.append(effect)
+        super().__init__()
+
+    def process(self, frames, frame_rate):
+        for effect in self.effects:
+            frames = effect.process(frames, frame_rate)
+        return frames
+
+    def reset(self):
+        for effect in self.effects:
+            effect.reset()
+
+    def copy(self):
+        return EffectsChain(*[effect.copy() for effect in self.effects])
+
+@lru_cache(maxsize=64)
+def _biquad_coefficients(kind, freq, q, gain, frame_rate):
+    '''Return the normalized `(b, a)` coefficients of a biquad filter, from
+    the Audio EQ Cookbook (R. Bristow-Johnson).'''
+    w0 = 2 * np.pi * freq / frame_rate
+    cos = np.cos(w0)
+    alpha = np.sin(w0) / (2 * q)
+    A = 10 ** (gain / 40)
+    sq = 2 * np.sqrt(A) * alpha
+    if kind == 'lowpass':
+        b = ((1 - cos) / 2, 1 - cos, (1 - cos) / 2)
+        a = (1 + alpha, -2 * cos, 1 - alpha)
+    elif kind == 'highpass':
+        b = ((1 + cos) / 2, -(1 + cos), (1 + cos) / 2)
+        a = (1 + alpha, -2 * cos, 1 - alpha)
+    elif kind == 'bandpass':
+        b = (alpha, 0, -alpha)
+        a = (1 + alpha, -2 * cos, 1 - alpha)
+    elif kind == 'notch':
+        b = (1, -2 * cos, 1)
+        a = (1 + alpha, -2 * cos, 1 - alpha)
+    elif kind == 'peak':
+        b = (1 + alpha * A, -2 * cos, 1 - alpha * A)
+        a = (1 + alpha / A, -2 * cos, 1 - alpha / A)
+    elif kind == 'lowshelf':
+        b = (A * ((A + 1) - (A - 1) * cos + sq),
+             2 * A * ((A - 1) - (A + 1) * cos),
+             A * ((A + 1) - (A - 1) * cos - sq))
+        a = ((A + 1) + (A - 1) * cos + sq,
+             -2 * ((A - 1) + (A + 1) * cos),
+             (A + 1) + (A - 1) * cos - sq)
+    elif kind == 'highshelf':
+        b = (A * ((A + 1) + (A - 1) * cos + sq),
+             -2 * A * ((A - 1) + (A + 1) * cos),
+             A * ((A + 1) + (A - 1) * cos - sq))
+        a = ((A + 1) - (A - 1) * cos + sq,
+             2 * ((A - 1) - (A + 1) * cos),
+             (A + 1) - (A - 1) * cos - sq)
+    else:
+        raise WubWubError(f'kind must be one of {BIQUAD_TYPES}, not "{kind}"')
+    b = tuple(float(x / a[0]) for x in b)
+    a = (1.0, float(a[1] / a[0]), float(a[2] / a[0]))
+    return b, a
+
+@lru_cache(maxsize=64)
+def _biquad_kernels(b, a):
+    '''
+    Return the responses of a biquad filter over `BIQUAD_BLOCK` frames:
+    the impulse response, and the response to each of its four state values
+    (the last two inputs and outputs of the previous block) with no input.
+    With these, a block is filtered exactly by a convolution and a
+    matrix product (see `Biquad.process()`).
+    '''
+    n = BIQUAD_BLOCK
+    responses = np.zeros((5, n))
+    # inputs: impulse; states: x[-1], x[-2], y[-1], y[-2]
+    starts = [((0, 0), (0, 0)), ((1, 0), (0, 0)), ((0, 1), (0, 0)),
+              ((0, 0), (1, 0)), ((0, 0), (0, 1))]
+    for row, ((x1, x2), (y1, y2)) in enumerate(starts):
+        x0 = 1.0 if row == 0 else 0.0
+        for i in range(n):
+            y0 = b[0] * x0 + b[1] * x1 + b[2] * x2 - a[1] * y1 - a[2] * y2
+            responses[row, i] = y0
+            x0, x1, x2 = 0.0, x0, x1
+            y1, y2 = y0, y1
+    return responses[0], responses[1:]
+
+@lru_cache(maxsize=64)
+def _biquad_spectrum(b, a, nfft):
+    '''Spectrum of the impulse response of a biquad, for blocks of up to
+    `nfft // 2` frames.'''
+    impulse, _ = _biquad_kernels(b, a)
+    return np.fft.rfft(impulse[:nfft // 2], nfft)[:, np.newaxis]
+
+class Biquad(Effect):
+    '''
+    A second order (biquad) filter, for EQ.  Audio is filtered in blocks:
+    each block is convolved with the impulse response of the filter (using
+    the FFT), and the ringing of the previous block is added from the state
+    of the filter.  This gives the same output as running the filter frame
+    by frame.
+
+    Parameters
+    ----------
+    kind : str
+        Type of filter: one of `'lowpass'`, `'highpass'`, `'bandpass'`,
+        `'notch'`, `'peak'`, `'lowshelf'`, or `'highshelf'`.
+    freq : int or float
+        Cutoff or center frequency, in Hz.
+    q : float, optional
+        Quality factor (resonance / bandwidth). The default is 0.707.
+    gain : int or float, optional
+        Gain (in dB) of `'peak'` and shelf filters. The default is 0.
+
+    '''
+
+    def __init__(self, kind, freq, q=0.707, gain=0):
+        if kind not in BIQUAD_TYPES:
+            raise WubWubError(f'kind must be one of {BIQUAD_TYPES}, '
+                              f'not "{kind}"')
+        self.kind = kind
+        self.freq = freq
+        self.q = q
+        self.gain = gain
+        super().__init__()
+
+    def reset(self):
+        self._state = None
+
+    def process(self, frames, frame_rate):
+        b, a = _biquad_coefficients(self.kind, self.freq, self.q, self.gain,
+                                    frame_rate)
+        _, states = _biquad_kernels(b, a)
+        x = frames.astype(np.float64)
+        channels = x.shape[1]
+        if self._state is None or len(self._state) != channels:
+            self._state = np.zeros((channels, 4))
+        out = np.empty_like(x)
+        for pos in range(0, len(x), BIQUAD_BLOCK):
+            block = x[pos:pos + BIQUAD_BLOCK]
+            n = len(block)
+            nfft = 1 << (2 * n - 1).bit_length()
+            spectrum = _biquad_spectrum(b, a, nfft)
+            y = np.fft.irfft(np.fft.rfft(block, nfft, axis=0) * spectrum,
+                             nfft, axis=0)[:n]
+            y += (self._state @ states[:, :n]).T
+            prev = self._state
+            self._state = np.stack([block[-1],
+                                    block[-2] if n > 1 else prev[:, 0],
+                                    y[-1],
+                                    y[-2] if n > 1 else prev[:, 2]], axis=1)
+            out[pos:pos + n] = y
+        return out.astype(np.float32)
+
+class Compressor(Effect):
+    '''
+    A dynamic range compressor.  The gain reduction follows the peak level
+    of the audio (over all channels): it rises over the `attack`, and
+    recovers at a rate of 10 dB per `release`.
+
+    Parameters
+    ----------
+    threshold : int or float, optional
+        Level (in dBFS) above which the audio is compressed.
+        The default is -20.
+    ratio : int or float, optional
+        Compression ratio; `float('inf')` for limiting. The default is 4.
+    attack : int or float, optional
+        Time (in milliseconds) for the gain reduction to take effect.
+        The default is 5.
+    release : int or float, optional
+        Time (in milliseconds) to recover 10 dB of gain reduction.
+        The default is 100.
+    makeup : int or float, optional
+        Gain (in dB) applied after compression. The default is 0.
+
+    '''
+
+    def __init__(self, threshold=-20, ratio=4, attack=5, release=100,
+                 makeup=0):
+        self.threshold = threshold
+        self.ratio = ratio
+        self.attack = attack
+        self.release = release
+        self.makeup = makeup
+        super().__init__()
+
+    def reset(self):
+        self._reduction = 0.0
+        self._history = None
+
+    def process(self, frames, frame_rate):
+        n = len(frames)
+        if not n:
+            return frames
+        peak = np.abs(frames).max(axis=1).astype(np.float64)
+        level = 20 * np.log10(np.maximum(peak, 1e-12))
+        target = np.maximum(level - self.threshold, 0) * (1 - 1 / self.ratio)
+
+        # hold peaks, then recover linearly (in dB) at the release rate
+        rate = 10 / max(ms_to_frames(self.release, frame_rate), 1)
+        ramp = rate * np.arange(n)
+        reduction = np.maximum.accumulate(target + ramp) - ramp
+        reduction = np.maximum(reduction, self._reduction - rate - ramp)
+        self._reduction = reduction[-1]
+
+        # smooth the onset with a moving average over the attack
+        width = ms_to_frames(self.attack, frame_rate)
+        if width > 1:
+            if self._history is None or len(self._history) != width - 1:
+                self._history = np.zeros(width - 1)
+            padded = np.concatenate([self._history, reduction])
+            total = np.concatenate([[0], np.cumsum(padded)])
+            self._history = padded[len(padded) - (width - 1):]
+            reduction = (total[width:] - total[:-width]) / width
+
+        gain = 10 ** ((self.makeup - reduction) / 20)
+        return frames * gain.astype(np.float32)[:, np.newaxis]
+
+class Limiter(Compressor):
+    '''
+    A peak limiter: a `Compressor` with an infinite ratio and no attack, so
+    the audio never exceeds the `threshold`.
+
+    Parameters
+    ----------
+    threshold : int or float, optional
+        Maximum level (in dBFS). The default is -1.
+    release : int or float, optional
+        Time (in milliseconds) to recover 10 dB of gain reduction.
+        The default is 50.
+
+    '''
+
+    def __init__(self, threshold=-1, release=50):
+        super().__init__(threshold, ratio=float('inf'), attack=0,
+                         release=release)
+
+class Delay(Effect):
+    '''
+    A feedback delay (echo).
+
+    Parameters
+    ----------
+    time : int or float, optional
+        Delay time, in milliseconds. The default is 250.
+    feedback : float, optional
+        Amount of each echo fed back into the delay (below 1).
+        The default is 0.4.
+    mix : float, optional
+        Proportion of delayed signal in the output (0 is only the dry
+        signal, 1 is only the echoes). The default is 0.3.
+
+    '''
+
+    def __init__(self, time=250, feedback=0.4, mix=0.3):
+        self.time = time
+        self.feedback = feedback
+        self.mix = mix
+        super().__init__()
+
+    def reset(self):
+        self._line = None
+
+    def process(self, frames, frame_rate):
+        d = max(ms_to_frames(self.time, frame_rate), 1)
+        x = frames.astype(np.float64)
+        n, channels = x.shape
+        if self._line is None or self._line.shape != (d, channels):
+            self._line = np.zeros((d, channels))
+        # buf[d + i] is the delay line output y[i] = x[i] + fb * y[i - d];
+        # the echoes are computed d frames at a time
+        buf = np.concatenate([self._line, np.zeros_like(x)])
+        for start in range(0, n, d):
+            stop = min(start + d, n)
+            buf[d + start:d + stop] = (x[start:stop] +
+                                       self.feedback * buf[start:stop])
+        self._line = buf[n:]
+        out = (1 - self.mix) * x + self.mix * buf[:n]
+        return out.astype(np.float32)
+
+class Distortion(Effect):
+    '''
+    Soft clipping (tanh) distortion.
+
+    Parameters
+    ----------
+    drive : int or float, optional
+        Gain (in dB) applied before clipping. The default is 12.
+    level : int or float, optional
+        Gain (in dB) applied after clipping. The default is 0.
+
+    '''
+
+    def __init__(self, drive=12, level=0):
+        self.drive = drive
+        self.level = level
+        super().__init__()
+
+    def process(self, frames, frame_rate):
+        drive = np.float32(10 ** (self.drive / 20))
+        level = np.float32(10 ** (self.level / 20))
+        return np.tanh(frames * drive) * level
+
+class Bitcrush(Effect):
+    '''
+    Reduces the bit depth and sample rate of the audio.
+
+    Parameters
+    ----------
+    bits : int, optional
+        Bit depth of the output. The default is 8.
+    downsample : int, optional
+        Each frame kept is held for this many frames. The default is 1
+        (no downsampling).
+
+    '''
+
+    def __init__(self, bits=8, downsample=1):
+        self.bits = bits
+        self.downsample = downsample
+        super().__init__()
+
+    def reset(self):
+        self._phase = 0
+        self._held = None
+
+    def process(self, frames, frame_rate):
+        n, channels = frames.shape
+        if self._held is None or len(self._held) != channels:
+            self._held = np.zeros(channels, dtype=np.float32)
+        if self.downsample > 1 and n:
+            # index of the last kept frame, for each frame
+            index = np.arange(n)
+            kept = np.where((self._phase + index) % self.downsample == 0,
+                            index, -1)
+            kept = np.maximum.accumulate(kept)
+            frames = np.where(kept[:, np.newaxis] >= 0,
+                              frames[np.maximum(kept, 0)], self._held)
+            self._phase = (self._phase + n) % self.downsample
+            self._held = frames[-1]
+        steps = np.float32(2 ** (self.bits - 1))
+        return np.round(frames * steps) / steps
+
+class Reverb(Effect):
+    '''
+    Convolution reverb, using a recorded impulse response (IR).
+
+    The convolution uses uniformly partitioned overlap-add: the IR is split
+    into partitions of `partition` frames, whose spectra are computed once
+    (and cached for each frame rate), and each block of audio is convolved
+    with all the partitions in the frequency domain.  The cost is
+    O(N log N) in the length of the audio, however long the IR.  Audio can
+    be processed in blocks of any size, with no added latency.
+
+    Parameters
+    ----------
+    impulse : pydub.AudioSegment or str
+        The impulse response, or a path to an audio file of it (e.g. from
+        the sample library, see `wubwub.sounds.load()`).  Stereo IRs make
+        mono audio stereo.
+    mix : float, optional
+        Proportion of reverberated signal in the output (0 is only the dry
+        signal, 1 is only the reverb). The default is 0.25.
+    partition : int, optional
+        Length (in frames) of the partitions of the IR; smaller partitions
+        are faster for short blocks of audio. The default is 1024.
+
+    '''
+
+    def __init__(self, impulse, mix=0.25, partition=1024):
+        if isinstance(impulse, str):
+            impulse = pydub.AudioSegment.from_file(impulse)
+        self.impulse = impulse
+        self.mix = mix
+        self.partition = partition
+        self._spectra = {}
+        super().__init__()
+
+    def __repr__(self):
+        return (f'Reverb(impulse={len(self.impulse)}ms, mix={self.mix}, '
+                f'partition={self.partition})')
+
+    def reset(self):
+        self._pending = None
+        self._tail = None
+        self._history = None
+        self._overlap = None
+
+    def _ir_spectra(self, frame_rate):
+        '''Return the spectra of the IR partitions, with shape
+        `(partitions, partition + 1, channels)`.'''
+        key = (frame_rate, self.partition, id(self.impulse))
+        if key not in self._spectra:
+            ir = segment_to_array(self.impulse).astype(np.float64)
+            if self.impulse.frame_rate != frame_rate:
+                ir = _resample(ir, self.impulse.frame_rate / frame_rate)
+            b = self.partition
+            count = max(-(-len(ir) // b), 1)
+            parts = np.zeros((count * b, ir.shape[1]))
+            parts[:len(ir)] = ir
+            parts = parts.reshape(count, b, ir.shape[1])
+            self._spectra[key] = np.fft.rfft(parts, 2 * b, axis=1)
+        return self._spectra[key]
+
+    def process(self, frames, frame_rate):
+        spectra = self._ir_spectra(frame_rate)
+        count, bins, ir_channels = spectra.shape
+        b = self.partition
+        channels = max(frames.shape[1], ir_channels)
+        x = frames.astype(np.float64)
+        if x.shape[1] < channels:
+            x = np.repeat(x, channels, axis=1)
+        if self._overlap is None or self._overlap.shape[1] != channels:
+            self._pending = np.zeros((0, channels))
+            # input spectra of past blocks (newest first), and their sum
+            # convolved with the later partitions of the IR
+            self._history = np.zeros((count, bins, channels), dtype=complex)
+            self._tail = np.zeros((bins, channels), dtype=complex)
+            self._overlap = np.zeros((b, channels))
+
+        # the last (partial) block is processed again once it is complete;
+        # its outputs so far only depended on the input already seen
+        done = len(self._pending)
+        x = np.concatenate([self._pending, x])
+        wet = []
+        for pos in range(0, len(x), b):
+            block = x[pos:pos + b]
+            spectrum = np.fft.rfft(block, 2 * b, axis=0)
+            y = np.fft.irfft(spectrum * spectra[0] + self._tail,
+                             2 * b, axis=0)
+            out = y[:b] + self._overlap
+            wet.append(out[done:len(block)])
+            done = 0
+            if len(block) < b:
+                self._pending = block
+                break
+            self._pending = block[:0]
+            self._overlap = y[b:]
+            self._history = np.roll(self._history, 1, axis=0)
+            self._history[0] = spectrum
+            self._tail = (self._history[:count - 1] *
+                          spectra[1:]).sum(axis=0)
+        wet = np.concatenate(wet) if wet else np.zeros((0, channels))
+        dry = frames
+        if dry.shape[1] < channels:
+            dry = np.repeat(dry, channels, axis=1)
+        return ((1 - self.mix) * dry + self.mix * wet).astype(np.float32)
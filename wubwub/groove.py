@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Groove templates, for swinging and humanizing Tracks when they are rendered.
+
+A `Groove` moves the notes sitting on a rhythmic grid (16th notes by
+default) later or earlier, and makes them louder or quieter, according to
+their position in the grid.  It is set as the `groove` of a Track or of a
+Sequencer (applying to all its Tracks without their own), and is applied to
+the scheduled notes each time they are rendered: the notes of the Track
+are not changed, so grooves can be swapped or tweaked freely.
+
+```python
+>>> import wubwub as wb
+
+>>> seq = wb.Sequencer(bpm=100, beats=8)
+>>> hat = seq.add_sampler('hat.wav', name='hat')
+>>> hat.make_notes_every(1/4)
+
+# delay the off-beat 16ths by a third of a step, and accent the beats
+>>> hat.groove = wb.Groove(swing=1/3, velocity=[2, -3, 0, -3])
+
+# grooves are immutable; tweak them by replacing
+>>> hat.groove = hat.groove._replace(swing=.2)
+```
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+from wubwub.errors import WubWubError
+
+__all__ = ['Groove']
+
+_GrooveBase = namedtuple('Groove', ['swing', 'timing', 'velocity',
+                                    'resolution'],
+                         defaults=[0, (), (), 1/4])
+
+class Groove(_GrooveBase):
+    '''
+    A groove template, applied to the notes of a Track when rendering.
+
+    Parameters
+    ----------
+    swing : float, optional
+        Delay of every other step of the grid (the off-beats), as a
+        fraction of a step.  The default is 0 (straight); 1/3 gives a
+        triplet shuffle.
+    timing : list-like of float, optional
+        Timing offset of each step (as a fraction of a step; negative is
+        earlier), cycled over the grid.  The default is no offsets.
+    velocity : list-like of float, optional
+        Volume offset (in dB) of each step, cycled over the grid.  The
+        default is no offsets.
+    resolution : float, optional
+        Length of a step of the grid, in beats. The default is 1/4
+        (16th notes).
+
+    Notes
+    -----
+    Only notes on the grid (counting from beat 1) are moved; notes off the
+    grid, including those moved by `skew`, are left as they are.  The
+    length of the notes is kept, except that Tracks with `overlap=False`
+    or `max_voices` cut notes off where they meet the moved notes.
+
+    '''
+
+    __slots__ = ()
+
+    def __new__(cls, swing=0, timing=(), velocity=(), resolution=1/4):
+        if resolution <= 0:
+            raise WubWubError('Groove resolution must be positive.')
+        return super().__new__(cls, float(swing),
+                               tuple(float(t) for t in timing),
+                               tuple(float(v) for v in velocity),
+                               resolution)
+
+    def apply(self, voices, tempo):
+        '''
+        Apply the groove to a list of `wubwub.render.Voice`, returning the
+        moved Voices (in the same order).  The offsets of all Voices are
+        computed at once, and `tempo` (a `wubwub.tempo.TempoMap`) is used
+        to convert between beats and time.
+        '''
+        if not voices:
+            return voices
+        positions = np.array([v.position for v in voices], dtype=np.float64)
+        beats = tempo.beats(positions) - 1
+        steps = np.rint(beats / self.resolution)
+        on_grid = np.abs(beats - steps * self.resolution) < 1e-6
+        steps = steps.astype(np.int64)
+        shift = np.where(steps % 2 == 1, self.swing, 0.0)
+        if self.timing:
+            shift += np.array(self.timing)[steps % len(self.timing)]
+        volume = np.zeros(len(voices))
+        if self.velocity:
+            volume += np.array(self.velocity)[steps % len(self.velocity)]
+        moved = on_grid & (shift != 0)
+        positions[moved] = tempo.ms(beats[moved] + 1 +
+                                    shift[moved] * self.resolution)
+        gains = np.where(on_grid, 10 ** (volume / 20), 1.0)
+        return [v._replace(position=p, gain=v.gain * g) if m or g != 1 else v
+                for v, p, g, m in zip(voices, positions.tolist(),
+                                      gains.tolist(), moved)]
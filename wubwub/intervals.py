@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+An interval index, for finding what is sounding at a given time.
+
+Each Track keeps an `IntervalIndex` over its scheduled Voices (see
+`wubwub.tracks.Track.sounding()`), which is used to select the notes
+sounding within a rendered window, and for plotting.
+
+```python
+>>> from wubwub.intervals import IntervalIndex
+
+>>> index = IntervalIndex([0, 2, 5], [4, 3, 6], items=['a', 'b', 'c'])
+>>> index.at(2.5)
+['a', 'b']
+>>> index.overlapping(3, 6)
+['a', 'c']
+```
+"""
+
+import numpy as np
+
+from wubwub.errors import WubWubError
+
+__all__ = ['IntervalIndex']
+
+class IntervalIndex:
+    '''
+    A static index over half-open intervals `[start, end)`, each with an
+    item attached.  Intervals are stored in a centered interval tree, so
+    finding the `k` intervals containing a point (`IntervalIndex.at()`)
+    or overlapping a range (`IntervalIndex.overlapping()`) takes
+    O(log n + k) time, rather than a scan of all intervals.  Results are
+    returned in the order the intervals were given.
+
+    Parameters
+    ----------
+    starts : list-like of numbers
+        Start of each interval.
+    ends : list-like of numbers
+        End of each interval (exclusive).
+    items : list-like, optional
+        Item for each interval. The default is None, in which case the
+        items are the indices of the intervals.
+
+    '''
+
+    def __init__(self, starts, ends, items=None):
+        self.starts = np.asarray(starts, dtype=float).reshape(-1)
+        self.ends = np.asarray(ends, dtype=float).reshape(-1)
+        if len(self.starts) != len(self.ends):
+            raise WubWubError('starts and ends must have the same length.')
+        self.items = list(range(len(self.starts)) if items is None else items)
+        self._order = np.argsort(self.starts, kind='stable')
+        self._sorted = self.starts[self._order]
+        # empty intervals contain no point, so they are only found by
+        # the range query on their start
+        self._root = self._build(np.flatnonzero(self.ends > self.starts))
+
+    def __len__(self):
+        return len(self.items)
+
+    def __repr__(self):
+        return f'IntervalIndex(intervals={len(self)})'
+
+    def _build(self, idx):
+        '''Build the tree node for the intervals `idx`.  Nodes are tuples
+        of the center, the intervals containing it (sorted by start and by
+        end), and the subtrees of those entirely before and after it.'''
+        if not len(idx):
+            return None
+        starts = self.starts[idx]
+        ends = self.ends[idx]
+        center = np.sort(starts)[len(idx) // 2]
+        before = ends <= center
+        after = starts > center
+        here = idx[~(before | after)]
+        by_start = here[np.argsort(self.starts[here], kind='stable')]
+        by_end = here[np.argsort(self.ends[here], kind='stable')]
+        return (center, by_start, self.starts[by_start], by_end,
+                self.ends[by_end], self._build(idx[before]),
+                self._build(idx[after]))
+
+    def _stab(self, point):
+        '''Return the indices of the intervals containing `point`.'''
+        found = []
+        node = self._root
+        while node is not None:
+            center, by_start, starts, by_end, ends, before, after = node
+            if point < center:
+                found.append(by_start[:np.searchsorted(starts, point, 'right')])
+                node = before
+            else:
+                found.append(by_end[np.searchsorted(ends, point, 'right'):])
+                node = after
+        return np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+
+    def _select(self, idx):
+        return [self.items[i] for i in np.sort(idx)]
+
+    def at(self, point):
+        '''Return the items of the intervals containing `point`
+        (i.e. `start <= point < end`).'''
+        return self._select(self._stab(point))
+
+    def overlapping(self, start, stop):
+        '''Return the items of the intervals overlapping the range from
+        `start` to `stop`, i.e. those starting before `stop` and ending
+        after `start`.'''
+        # intervals starting up to `start` must contain it, and the rest
+        # overlap when they start before `stop`
+        idx = self._stab(start)
+        idx = idx[self.starts[idx] < stop]
+        lo = np.searchsorted(self._sorted, start, 'right')
+        hi = max(np.searchsorted(self._sorted, stop, 'left'), lo)
+        return self._select(np.concatenate([idx, self._order[lo:hi]]))
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Buses and groups, for sharing effects between the Tracks of a Sequencer.
+
+A `Bus` is added to a Sequencer with
+`wubwub.sequencer.Sequencer.add_bus()`, and Tracks send part of their
+(postprocessed) audio to it with `wubwub.tracks.Track.send()`.  When the
+Sequencer is rendered, the audio sent to each bus is summed, the
+postprocessing of the bus (`effects`, `volume`, and `pan`) is applied once
+to the sum, and the result is added to the mix (before the postprocessing
+of the Sequencer).  So however many Tracks use a reverb on a bus, it only
+runs once.
+
+```python
+>>> import wubwub as wb
+
+>>> seq = wb.Sequencer(bpm=120, beats=8)
+>>> kick = seq.add_sampler('kick.wav', name='kick')
+>>> snare = seq.add_sampler('snare.wav', name='snare')
+
+# the bus returns only the reverberated signal
+>>> verb = seq.add_bus('verb', effects=wb.Reverb('hall.wav', mix=1))
+>>> kick.send('verb', -12)
+>>> snare.send('verb', -6)
+```
+
+A `Group` instead takes the whole output of its Tracks: they are mixed into
+a submix, which is postprocessed (with the `effects`, `volume`, and `pan`
+of the group) and added to the mix in place of the Tracks.  Groups are
+added with `wubwub.sequencer.Sequencer.add_group()`.  The postprocessed
+submix is cached, and only rendered again when one of its Tracks or the
+settings of the group change; so when only a Track outside the group is
+edited, rendering the Sequencer again only renders that Track and sums
+the mix.
+
+```python
+>>> hat = seq.add_sampler('hat.wav', name='hat')
+>>> bass = seq.add_sampler('bass.wav', name='bass')
+
+# the drums are compressed together
+>>> drums = seq.add_group('drums', ['kick', 'snare', 'hat'],
+...                       effects=wb.Compressor(threshold=-18), volume=-3)
+>>> drums
+Group(name="drums", tracks=['kick', 'snare', 'hat'], effects=Compressor(...), volume=-3, pan=0)
+```
+"""
+
+from wubwub.errors import WubWubError
+
+__all__ = ['Bus', 'Group']
+
+class Bus:
+    '''
+    A mix bus of a Sequencer.  Create these with
+    `wubwub.sequencer.Sequencer.add_bus()`.
+
+    Attributes
+    ----------
+    name : str
+        Name of the bus, used by `wubwub.tracks.Track.send()`.
+    effects : optional
+        Effects applied to the summed input (see `wubwub.effects`, or a
+        pysndfx AudioEffectsChain).  These should usually output only the
+        processed signal (e.g. `mix=1`), as the dry signal of each Track
+        is already in the mix.
+    volume : int or float
+        Volume (in dB) of the output of the bus.
+    pan : float
+        Panning (from -1 to 1) of the output of the bus.
+    postprocess_steps : list
+        Order of the postprocessing steps, as for Tracks.
+
+    '''
+
+    def __init__(self, name, effects=None, volume=0, pan=0):
+        self.name = name
+        self.effects = effects
+        self.volume = volume
+        self.pan = pan
+        self.postprocess_steps = ['effects', 'volume', 'pan']
+
+    def __repr__(self):
+        return (f'Bus(name="{self.name}", effects={self.effects}, '
+                f'volume={self.volume}, pan={self.pan})')
+
+def send_gains(sequencer, track):
+    '''Return the sends of a Track as `(index, gain)` pairs, where the index
+    is that of the bus in `sequencer.buses()` and the gain is linear.'''
+    names = [bus.name for bus in sequencer.buses()]
+    gains = []
+    for name, level in track.sends.items():
+        if name not in names:
+            raise WubWubError(f'Track "{track.name}" sends to "{name}", which '
+                              'is not a bus of the Sequencer.')
+        gains.append((names.index(name), 10 ** (level / 20)))
+    return gains
+
+class Group(Bus):
+    '''
+    A group of Tracks of a Sequencer, which are mixed and postprocessed
+    together.  Create these with `wubwub.sequencer.Sequencer.add_group()`.
+    Each Track is in at most one group.  The sends of the Tracks
+    (see `wubwub.tracks.Track.send()`) are not affected by the group.
+
+    The postprocessed submix of the group is cached, and reused until one
+    of its Tracks changes (see `wubwub.tracks.Track.version`), or
+    `effects`, `volume`, `pan`, or `postprocess_steps` are set to new
+    values.  As for Tracks, effects changed in place are not detected.
+
+    Attributes
+    ----------
+    name : str
+        Name of the group.
+    sequencer : wubwub.sequencer.Sequencer
+        The Sequencer of the group.
+    effects : optional
+        Effects applied to the submix (see `wubwub.effects`, or a
+        pysndfx AudioEffectsChain).
+    volume : int or float
+        Volume (in dB) of the submix.
+    pan : float
+        Panning (from -1 to 1) of the submix.
+    postprocess_steps : list
+        Order of the postprocessing steps, as for Tracks.
+
+    '''
+
+    def __init__(self, name, sequencer, effects=None, volume=0, pan=0):
+        super().__init__(name, effects=effects, volume=volume, pan=pan)
+        self.sequencer = sequencer
+        self._tracks = []
+        self._cache = None
+
+    def __repr__(self):
+        names = [track.name for track in self._tracks]
+        return (f'Group(name="{self.name}", tracks={names}, '
+                f'effects={self.effects}, volume={self.volume}, '
+                f'pan={self.pan})')
+
+    def tracks(self):
+        """Returns a tuple of the Tracks in the group."""
+        return tuple(self._tracks)
+
+    def add(self, *tracks):
+        '''
+        Add Tracks of the Sequencer to the group.  Tracks already in
+        another group are moved to this one.
+
+        Parameters
+        ----------
+        *tracks : str or wubwub.tracks.Track
+            The Tracks, or their names.
+
+        '''
+        for track in tracks:
+            track = self.sequencer.get_track(track)
+            for group in self.sequencer.groups():
+                if track in group._tracks:
+                    group._tracks.remove(track)
+            self._tracks.append(track)
+
+    def remove(self, *tracks):
+        """Remove Tracks from the group, so they are mixed directly."""
+        for track in tracks:
+            track = self.sequencer.get_track(track)
+            if track in self._tracks:
+                self._tracks.remove(track)
+
+    def _cached(self, params):
+        '''Return the cached submix rendered with `params`, or None when
+        the group changed since.'''
+        if self._cache is not None and self._cache[0] == self._key(params):
+            return self._cache[1]
+        return None
+
+    def _store(self, params, audio):
+        self._cache = (self._key(params), audio)
+
+    def _key(self, params):
+        return (params, tuple((id(t), t.version) for t in self._tracks),
+                id(self.effects), self.volume, self.pan,
+                tuple(self.postprocess_steps))
+
+def group_routes(sequencer):
+    '''Return, for each Track of `sequencer`, the index of its group in
+    `sequencer.groups()`, or None when it is not in a group.'''
+    routes = {}
+    for i, group in enumerate(sequencer.groups()):
+        for track in group.tracks():
+            routes[id(track)] = i
+    return [routes.get(id(track)) for track in sequencer.tracks()]
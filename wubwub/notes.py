@@ -31,12 +31,13 @@ import random
 
 class Note(object):
     '''Class to represent an atomic MIDI-like note in wubwub.'''
-    __slots__ = ('pitch', 'length', 'volume', 'attack', 'decay', 'skew')
+    __slots__ = ('pitch', 'length', 'volume', 'attack', 'decay', 'sustain',
+                 'skew')
 
     def __init__(self, pitch=0, length=1,
                  volume=0, volume_range=None,
                  attack=None, attack_range=None,
-                 decay=None,
+                 decay=None, sustain=None,
                  skew=None, skew_range=None, skew_dir=None):
         '''
         Initialize the note.
@@ -53,6 +54,21 @@ class Note(object):
         volume : number, optional
             Relative amount of decibels to change the volume of the
             sample. The default is 0.
+        attack : number, optional
+            Length (in milliseconds) of the fade in at the start of the
+            note. The default is None, for a 10 millisecond fade.
+        attack_range : int, optional
+            Random variation (in milliseconds) of the attack. The default
+            is None, for no variation.
+        decay : number, optional
+            Length (in milliseconds) of the fall from full volume to the
+            `sustain` level, after the attack. The default is None, for no
+            decay.
+        sustain : number, optional
+            Level (in decibels, relative to the note volume) held after
+            the decay.  The default is None, which is silence when a
+            `decay` is given (so the note fades out over the decay), and
+            full volume otherwise.
 
         Returns
         -------
@@ -62,6 +78,7 @@ class Note(object):
         object.__setattr__(self, "pitch", pitch)
         object.__setattr__(self, "length", length)
         object.__setattr__(self, "decay", decay)
+        object.__setattr__(self, "sustain", sustain)
 
         skew_amount = 0
         if skew:
@@ -74,12 +91,12 @@ class Note(object):
 
         attack_val = attack
         volume_val = volume
-        if attack != None:
+        if attack != None and attack_range:
             attack_min = attack - attack_range
             if attack_min < 0:
                 attack_min = 0
 
-            attack_min = attack + random.randint(attack_min, attack + attack_range)
+            attack_val = random.randint(attack_min, attack + attack_range)
 
         if volume_range != None:
             volume_val = volume + random.randint(-1 * volume_range, volume_range) / 10
@@ -100,7 +117,8 @@ class Note(object):
 
     def __repr__(self):
         '''The string representation of the Note.'''
-        attribs = ('pitch', 'length', 'volume', 'attack', 'skew')
+        attribs = ('pitch', 'length', 'volume', 'attack', 'decay', 'sustain',
+                   'skew')
         output = ', '.join([a + '=' + str(getattr(self, a)) for a in attribs])
         return f'Note({output})'
 
@@ -132,7 +150,8 @@ class Note(object):
     def alter(self, pitch=False, length=False, volume=False):
         '''
         Create a new note which has the same attributes as self,
-        except where specified.
+        except where specified.  The envelope (attack, decay, and
+        sustain) is kept.
 
         Parameters
         ----------
@@ -152,7 +171,8 @@ class Note(object):
         pitch = self.pitch if pitch is False else pitch
         length = self.length if length is False else length
         volume = self.volume if volume is False else volume
-        return Note(pitch, length, volume)
+        return Note(pitch, length, volume, attack=self.attack,
+                    decay=self.decay, sustain=self.sustain)
 
 class Chord(object):
     '''Class to represent an atomic MIDI-like chord in wubwub.'''
@@ -450,8 +470,7 @@ def arpeggiate(chord, beat, length=None, freq=0.5, method='up', auto_chord_lengt
         notelength = freq if current + freq <= end else end-current
         pos = current.numerator / current.denominator
         notelength = notelength.numerator / notelength.denominator
-        arpeggiated[pos] = Note(pitch=note.pitch, length=notelength,
-                                volume=note.volume)
+        arpeggiated[pos] = note.alter(length=notelength)
         current += freq
 
     return arpeggiated
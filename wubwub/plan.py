@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compiled render plans for Sequencers.
+
+A `RenderPlan` is a flat, frame-indexed description of everything needed
+to render a Sequencer: one row per sounding note (its start frame, sample,
+pitch ratio, gain, duration, fades, and Track), the decoded samples, and
+the postprocessing settings of each Track and of the Sequencer.  Plans are
+created with `wubwub.sequencer.Sequencer.compile()` (or `compile_plan()`),
+after which they no longer depend on the Sequencer: they can be inspected,
+cached, pickled, and rendered by different backends (see
+`RenderPlan.render()` and `RenderPlan.iter_blocks()`).
+"""
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from wubwub.errors import WubWubError
+from wubwub.mixer import group_routes, send_gains
+from wubwub.render import (BLOCK_FRAMES, EVENT_FIELDS, AudioBuffer,
+                           SparseAudioBuffer, automation_curves, get_quality,
+                           iter_buffer_blocks, iter_event_blocks, ms_to_frames,
+                           optimize_events, postprocess_buffer, render_bounds,
+                           render_events, streamable, upmix_frames,
+                           uses_effects, voice_events,
+                           with_fresh_effects, _decode_samples)
+
+__all__ = ['RenderPlan', 'compile_plan']
+
+TrackPlan = namedtuple('TrackPlan', ['name', 'start', 'frames', 'channels',
+                                     'sample_width', 'effects', 'volume',
+                                     'pan', 'postprocess_steps',
+                                     'automation', 'sends', 'group'])
+TrackPlan.__doc__ = '''
+The part of a `RenderPlan` for one Track: the section it renders (`start`
+frame and number of `frames`, relative to the plan), the `channels` and
+`sample_width` of its audio, its postprocessing settings (with the
+`automation` as curves in frames of the plan; see
+`wubwub.render.automation_curves()`), its `sends`, as pairs of bus
+index and linear gain, and the index of its `group` (None when it is
+mixed directly).
+'''
+
+BusPlan = namedtuple('BusPlan', ['name', 'effects', 'volume', 'pan',
+                                 'postprocess_steps'])
+BusPlan.__doc__ = '''
+The postprocessing settings of a bus or group (see `wubwub.mixer`) in a
+`RenderPlan`.
+'''
+
+MixPlan = namedtuple('MixPlan', ['effects', 'volume', 'pan',
+                                 'postprocess_steps', 'upmix', 'automation',
+                                 'buses', 'groups'])
+MixPlan.__doc__ = '''
+The part of a `RenderPlan` for the final mix: the postprocessing settings
+(and automation) of the Sequencer, whether the mix is converted to stereo
+(`upmix`), the `buses` (`BusPlan`) which Tracks send to, and the
+`groups` (also `BusPlan`) which Tracks are mixed into.
+'''
+
+BACKENDS = ['serial', 'thread', 'process', 'stream']
+"""Options for the `backend` of `RenderPlan.render()`."""
+
+def _render_plan_track(plan, i):
+    '''Render the `i`-th Track of a plan into a `SparseAudioBuffer`, with
+    its postprocessing applied.  Module level, so process pools can
+    use it.'''
+    track = plan.tracks[i]
+    select = plan.events['track'] == i
+    events = {field: plan.events[field][select] for field in EVENT_FIELDS}
+    events['start'] = events['start'] - track.start
+    rendered = render_events(events, plan.samples, plan.sample_rates, 0,
+                             track.frames, plan.frame_rate,
+                             channels=track.channels,
+                             sample_width=track.sample_width, sparse=True,
+                             resample=plan.quality.resample)
+    return postprocess_buffer(track, rendered, upmix=False,
+                              quality=plan.quality, start=track.start,
+                              automation=track.automation)
+
+class RenderPlan:
+    '''
+    A compiled, frame-indexed render plan for a Sequencer.  Create these
+    with `wubwub.sequencer.Sequencer.compile()`.
+
+    Attributes
+    ----------
+    events : dict of numpy.ndarray
+        One entry per note to be mixed, with the fields in
+        `wubwub.render.EVENT_FIELDS` (frames are relative to the start of
+        the plan) plus `track`, the index of the Track in `tracks`.
+    samples : list of numpy.ndarray
+        The decoded samples (see `wubwub.render.segment_to_array()`),
+        indexed by `events['sample']`.
+    sample_rates : list of int
+        The frame rate of each sample.
+    tracks : list of TrackPlan
+        The section and postprocessing of each Track.
+    mix : MixPlan
+        The postprocessing of the Sequencer.
+    frames : int
+        Length of the rendering, in frames.
+    frame_rate : int
+        Frame rate of the rendering.
+    quality : wubwub.render.RenderQuality
+        Quality of the rendering.
+    removed : int
+        Number of events removed when the plan was optimized
+        (see `compile_plan()`).
+
+    '''
+
+    def __init__(self, events, samples, sample_rates, tracks, mix, frames,
+                 frame_rate, quality, removed=0):
+        self.events = events
+        self.samples = samples
+        self.sample_rates = sample_rates
+        self.tracks = tracks
+        self.mix = mix
+        self.frames = frames
+        self.frame_rate = frame_rate
+        self.quality = quality
+        self.removed = removed
+
+    def __repr__(self):
+        return (f'RenderPlan(events={len(self)}, tracks={len(self.tracks)}, '
+                f'frames={self.frames}, frame_rate={self.frame_rate}, '
+                f'removed={self.removed})')
+
+    def __len__(self):
+        return len(self.events['start'])
+
+    def _mix_tracks(self, rendered):
+        '''Mix rendered Tracks and apply the postprocessing of the mix.'''
+        mix = SparseAudioBuffer(self.frames, self.frame_rate)
+        sends = [None] * len(self.mix.buses)
+        submixes = [None] * len(self.mix.groups)
+        for track, audio in zip(self.tracks, rendered):
+            if track.group is None:
+                mix.mix(audio, track.start)
+            else:
+                if submixes[track.group] is None:
+                    submixes[track.group] = SparseAudioBuffer(self.frames,
+                                                              self.frame_rate)
+                submixes[track.group].mix(audio, track.start)
+            for i, gain in track.sends:
+                if sends[i] is None:
+                    sends[i] = SparseAudioBuffer(self.frames, self.frame_rate)
+                sends[i].mix(audio, track.start, gain=gain)
+        for group, audio in zip(self.mix.groups, submixes):
+            if audio is not None:
+                mix.mix(postprocess_buffer(group, audio, upmix=False,
+                                           quality=self.quality))
+        for bus, audio in zip(self.mix.buses, sends):
+            if audio is not None:
+                mix.mix(postprocess_buffer(bus, audio, upmix=False,
+                                           quality=self.quality))
+        mix = postprocess_buffer(self.mix, mix, quality=self.quality,
+                                 automation=self.mix.automation)
+        if self.mix.upmix:
+            mix.map(upmix_frames)
+        return mix
+
+    def render(self, backend='serial', workers=None):
+        '''
+        Render the plan into a `wubwub.render.SparseAudioBuffer`.  The
+        output is the same as `wubwub.sequencer.Sequencer.render()` for the
+        compiled Sequencer.
+
+        Parameters
+        ----------
+        backend : str, optional
+            How the Tracks are rendered:
+
+            - `'serial'`: one after the other (the default)
+            - `'thread'`: in parallel, with a thread pool
+            - `'process'`: in parallel, with a process pool (the plan,
+            including any effects, must be picklable)
+            - `'stream'`: block by block (see `RenderPlan.iter_blocks()`),
+            only keeping the non-silent blocks
+        workers : int, optional
+            Number of workers for the `'thread'` and `'process'` backends.
+            The default is None, using the default of
+            `concurrent.futures`.
+
+        Returns
+        -------
+        wubwub.render.SparseAudioBuffer
+            The rendered audio.
+
+        '''
+        if backend not in BACKENDS:
+            raise WubWubError(f'backend must be one of {BACKENDS}, '
+                              f'not "{backend}"')
+        if backend == 'stream':
+            out = None
+            pos = 0
+            for block in self.iter_blocks():
+                if out is None:
+                    out = SparseAudioBuffer(self.frames, self.frame_rate,
+                                            channels=block.channels)
+                out.mix(block, pos)
+                pos += len(block)
+            return out or SparseAudioBuffer(self.frames, self.frame_rate)
+        indices = range(len(self.tracks))
+        if backend == 'serial':
+            rendered = [_render_plan_track(self, i) for i in indices]
+        else:
+            pool = ThreadPoolExecutor if backend == 'thread' else ProcessPoolExecutor
+            with pool(max_workers=workers) as executor:
+                rendered = list(executor.map(_render_plan_track,
+                                             [self] * len(indices), indices))
+        return self._mix_tracks(rendered)
+
+    def iter_blocks(self, block_frames=BLOCK_FRAMES):
+        '''Render the plan as a stream of `wubwub.render.AudioBuffer`
+        blocks, like `wubwub.sequencer.Sequencer.iter_blocks()`.  Only the
+        events sounding within each block are mixed; Tracks with external
+        effects (or all Tracks, if the mix has them) are rendered whole
+        first.'''
+        used = sorted({i for track in self.tracks for i, _ in track.sends})
+        grouped = sorted({track.group for track in self.tracks
+                          if track.group is not None})
+        if not all(streamable(owner, self.quality) for owner in
+                   [self.mix] + [self.mix.buses[i] for i in used] +
+                   [self.mix.groups[g] for g in grouped]):
+            rendered = self.render()
+            yield from iter_buffer_blocks(rendered, 0, self.frames,
+                                          block_frames)
+            return
+        streams = [self._iter_track(i, block_frames)
+                   for i in range(len(self.tracks))]
+        owner = with_fresh_effects(self.mix)
+        bus_owners = {i: with_fresh_effects(self.mix.buses[i]) for i in used}
+        group_owners = {g: with_fresh_effects(self.mix.groups[g])
+                        for g in grouped}
+        for pos in range(0, self.frames, block_frames):
+            n = min(block_frames, self.frames - pos)
+            mix = AudioBuffer(n, self.frame_rate)
+            sends = {i: AudioBuffer(n, self.frame_rate) for i in used}
+            submixes = {g: AudioBuffer(n, self.frame_rate) for g in grouped}
+            for track, stream in zip(self.tracks, streams):
+                block = next(stream)
+                out = mix if track.group is None else submixes[track.group]
+                out.mix(block)
+                for i, gain in track.sends:
+                    sends[i].mix(block, gain=gain)
+            for g in grouped:
+                mix.mix(postprocess_buffer(group_owners[g], submixes[g],
+                                           upmix=False, quality=self.quality,
+                                           stream=True))
+            for i in used:
+                mix.mix(postprocess_buffer(bus_owners[i], sends[i],
+                                           upmix=False, quality=self.quality,
+                                           stream=True))
+            mix = postprocess_buffer(owner, mix, quality=self.quality,
+                                     start=pos, automation=self.mix.automation,
+                                     stream=True)
+            if self.mix.upmix:
+                mix.map(upmix_frames)
+            yield mix
+
+    def _iter_track(self, i, block_frames):
+        '''Stream one Track over the whole plan.'''
+        track = self.tracks[i]
+        if not streamable(track, self.quality):
+            yield from iter_buffer_blocks(_render_plan_track(self, i),
+                                          track.start, self.frames,
+                                          block_frames)
+            return
+        select = self.events['track'] == i
+        events = {field: self.events[field][select] for field in EVENT_FIELDS}
+        owner = with_fresh_effects(track)
+        pos = 0
+        for block in iter_event_blocks(events, self.samples, self.sample_rates,
+                                       0, self.frames, self.frame_rate,
+                                       channels=track.channels,
+                                       sample_width=track.sample_width,
+                                       block_frames=block_frames,
+                                       resample=self.quality.resample):
+            yield postprocess_buffer(owner, block, upmix=False,
+                                     quality=self.quality, start=pos,
+                                     automation=track.automation, stream=True)
+            pos += len(block)
+
+    def build(self, backend='serial', workers=None):
+        '''Render the plan into a pydub AudioSegment; see
+        `RenderPlan.render()`.'''
+        return self.render(backend, workers).to_audiosegment()
+
+def compile_plan(sequencer, overhang=0, overhang_type='beats', frame_rate=None,
+                 quality='full', start=1, end=None, optimize=True):
+    '''
+    Compile a Sequencer into a `RenderPlan`.  The parameters are the same
+    as for `wubwub.sequencer.Sequencer.render()`; the plan renders the
+    same audio.  When `optimize` is True (default), silent events are
+    dropped and identical events are merged (see
+    `wubwub.render.optimize_events()`); the number of events removed is
+    stored as `RenderPlan.removed`.
+
+    Returns
+    -------
+    plan : wubwub.plan.RenderPlan
+        The compiled plan.
+
+    '''
+    quality = get_quality(quality)
+    rate = frame_rate or quality.frame_rate or sequencer.render_rate()
+    lo, hi = sequencer._window(overhang, overhang_type, start, end)
+    origin = ms_to_frames(lo, rate)
+
+    segments = []
+    columns = {field: [] for field in EVENT_FIELDS + ('track',)}
+    tracks = []
+    outputs = group_routes(sequencer)
+    for i, track in enumerate(sequencer.tracks()):
+        voices = track._voice_index().overlapping(lo, hi)
+        first, last = render_bounds(voices) or (lo, lo)
+        if uses_effects(track, quality):
+            last = hi
+        first = max(first, lo)
+        last = max(min(last, hi), first)
+        track_start = ms_to_frames(first, rate)
+        frames = ms_to_frames(first + (last - first), rate) - track_start
+        events, segments = voice_events(voices, rate, segments)
+        events['start'] -= origin
+        events['track'] = np.full(len(voices), i, dtype=np.int32)
+        for field, values in events.items():
+            columns[field].append(values)
+        channels = (1 if quality.mono else
+                    max([v.sample.channels for v in voices], default=1))
+        width = max([v.sample.sample_width for v in voices] + [2])
+        curves = automation_curves(track.automation, sequencer.tempo_map(),
+                                   rate, origin)
+        tracks.append(TrackPlan(track.name, track_start - origin, frames,
+                                channels, width, track.effects, track.volume,
+                                track.pan, tuple(track.postprocess_steps),
+                                curves, tuple(send_gains(sequencer, track)),
+                                outputs[i]))
+
+    events = {field: (np.concatenate(values) if values else
+                      np.empty(0, dtype=np.int64))
+              for field, values in columns.items()}
+    samples, rates = _decode_samples(segments)
+    removed = 0
+    if optimize:
+        events, removed = optimize_events(events, samples, rates, rate)
+    buses = tuple(BusPlan(bus.name, bus.effects, bus.volume, bus.pan,
+                          tuple(bus.postprocess_steps))
+                  for bus in sequencer.buses())
+    groups = tuple(BusPlan(group.name, group.effects, group.volume, group.pan,
+                           tuple(group.postprocess_steps))
+                   for group in sequencer.groups())
+    used = {i for track in tracks for i, _ in track.sends}
+    grouped = {g for g in outputs if g is not None}
+    upmix = (not quality.mono and
+             any('pan' in owner.postprocess_steps for owner in
+                 list(sequencer.tracks()) + [buses[i] for i in used] +
+                 [groups[g] for g in grouped]))
+    mix = MixPlan(sequencer.effects, sequencer.volume, sequencer.pan,
+                  tuple(sequencer.postprocess_steps), upmix,
+                  automation_curves(sequencer.automation,
+                                    sequencer.tempo_map(), rate, origin),
+                  buses, groups)
+    return RenderPlan(events, samples, rates, tracks, mix,
+                      ms_to_frames(hi, rate) - origin, rate, quality,
+                      removed=removed)
@@ -14,21 +14,30 @@ from matplotlib.ticker import AutoMinorLocator
 
 from wubwub.errors import WubWubError
 from wubwub.pitch import pitch_from_semitones, relative_pitch_to_int
-from wubwub.resources import MINUTE
+from wubwub.render import voice_end
 
 # get the color cycle from mpl
 prop_cycle = plt.rcParams['axes.prop_cycle']
 colors = prop_cycle.by_key()['color']
 
-def _actual_soundlength(track, element):
-    '''Return how long a Note/Chord is based on the sample.'''
-    mpb = 1 / track.get_bpm() * MINUTE
+def _actual_soundlength(track, element, beat):
+    '''Return how long a Note/Chord on `beat` sounds, based on the Voices
+    scheduled for it (found with `wubwub.tracks.Track.sounding()`), or
+    else on the sample.'''
+    tempo = track.get_tempo()
+    mpb = tempo.ms_per_beat(beat)
     clss = element.__class__.__name__
 
     if clss == 'ArpChord':
         return element.length
 
-    elif hasattr(element, 'length'):
+    position = tempo.ms(beat)
+    ends = [voice_end(v) for v in track.sounding(beat)
+            if v.position == position]
+    if ends:
+        return tempo.beats(max(ends)) - beat
+
+    if hasattr(element, 'length'):
         l = element.length
     else:
         l = max(n.length for n in element.notes)
@@ -117,7 +126,7 @@ def sequencerplot(sequencer, timesig=4, grid=True, ax=None, scatter_kwds=None,
         ylabs.append(track.name)
 
         for b, n in zip(beats, notes):
-            l = _actual_soundlength(track, n)
+            l = _actual_soundlength(track, n, b)
             ax.plot([b, b+l], [-y, -y], color=color, **plot_kwds)
 
     max_beats = sequencer.beats + 1
@@ -257,13 +266,13 @@ def trackplot(track, yaxis='semitones', timesig=4, grid=True, ax=None,
         if clss == "Note":
             beats.append(beat)
             notes.append(element)
-            lengths.append(_actual_soundlength(track, element))
+            lengths.append(_actual_soundlength(track, element, beat))
 
         else:
             for note in element.notes:
                 beats.append(beat)
                 notes.append(note)
-                lengths.append(_actual_soundlength(track, element))
+                lengths.append(_actual_soundlength(track, element, beat))
 
     if yaxis in ['pitch', 'semitones']:
         for b, n, l in zip(beats, notes, lengths):
@@ -379,13 +388,13 @@ def pianoroll(track, timesig=4, grid=True,):
         if clss == "Note":
             beats.append(beat)
             notes.append(_convert_semitones_str_yaxis('pitch', element, track))
-            lengths.append(_actual_soundlength(track, element))
+            lengths.append(_actual_soundlength(track, element, beat))
 
         else:
             for note in element.notes:
                 beats.append(beat)
                 notes.append(_convert_semitones_str_yaxis('pitch', note, track))
-                lengths.append(_actual_soundlength(track, element))
+                lengths.append(_actual_soundlength(track, element, beat))
 
     semitones = [relative_pitch_to_int('C1', n) for n in notes]
     lo = notes[semitones.index(min(semitones))]
@@ -0,0 +1,1198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The render engine used by wubwub Tracks.
+
+Rather than overlaying each note onto a pydub AudioSegment (which copies
+the whole track for every note), Tracks first *schedule* their notes as
+`Voice` events.  Each Voice is then mixed in place into a single float32
+`AudioBuffer`, which is converted back to a pydub AudioSegment only once
+rendering is complete.  This makes the cost of rendering proportional to
+the amount of sample audio being mixed, rather than to the number of notes
+times the length of the track.
+
+Sequencers mix the rendered sections of each Track directly into a
+single shared `AudioBuffer`, applying each Track's postprocessing (see
+`postprocess_frames()`) only to the audio the Track actually produces.
+The section rendered for each Track is bounded by where its Voices
+start and stop sounding (see `render_bounds()`).  Tracks and Sequencers
+render into a `SparseAudioBuffer`, which only allocates memory for the
+stretches of time containing sound.  Tracks using only mono samples with
+no panning are mixed in a single channel, and only converted to stereo
+once, for the final mix.
+
+Internally, Voices are converted to frame-indexed *events*, flat NumPy
+arrays with one entry per Voice (see `voice_events()`), which are what is
+actually mixed (see `render_events()`).  The same representation is used
+by the compiled render plans of `wubwub.plan`.
+
+Audio can also be streamed in fixed-size blocks (see
+`iter_voice_blocks()`), in which case only the Voices sounding within
+the current block are mixed, and memory use does not grow with the
+length of the rendering.
+"""
+
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+import pydub
+
+from wubwub.audio import add_effects
+from wubwub.errors import WubWubError
+from wubwub.pitch import relative_pitch_to_int
+from wubwub.tempo import TempoMap
+
+__all__ = ['Voice', 'SampleLoop', 'AudioBuffer', 'SparseAudioBuffer',
+           'RenderQuality', 'render_voices', 'iter_voice_blocks',
+           'voice_events', 'envelope', 'limit_voices',
+           'optimize_events', 'render_events', 'iter_event_blocks']
+
+__pdoc__ = {'voice_from_note': False,
+            'segment_to_array': False,
+            'array_to_segment': False,
+            'ms_to_frames': False,
+            'sample_loop': False,
+            'voice_end': False,
+            'cut_overlaps': False,
+            'render_bounds': False,
+            'uses_effects': False,
+            'streamable': False,
+            'with_fresh_effects': False,
+            'iter_buffer_blocks': False,
+            'postprocess_frames': False,
+            'automation_curves': False,
+            'postprocess_buffer': False,
+            'upmix_frames': False}
+
+SHIFT_RATE = 44100
+"""Frame rate of repitched samples (see `wubwub.pitch.shift_pitch`)."""
+
+BLOCK_FRAMES = 2 ** 15
+"""Default number of frames in each block of a `SparseAudioBuffer`."""
+
+INT_TYPES = {1: np.int8, 2: np.int16, 4: np.int32}
+
+SILENT_GAIN = 10 ** (-144 / 20)
+"""Gain (-144 dB) below which notes are dropped as inaudible; this is
+under the resolution of 24-bit audio."""
+
+RenderQuality = namedtuple('RenderQuality', ['frame_rate', 'mono',
+                                             'resample', 'effects'])
+RenderQuality.__doc__ = '''
+Settings controlling the quality (and speed) of rendering.
+
+- `frame_rate`: frame rate of the rendering, or `None` to use the rate
+of the samples
+- `mono`: whether to mix everything in a single channel
+- `resample`: method for repitching samples, `'linear'` or `'nearest'`
+- `effects`: whether to apply the `effects` of Tracks and Sequencers
+'''
+
+QUALITIES = {'full': RenderQuality(frame_rate=None, mono=False,
+                                   resample='linear', effects=True),
+             'draft': RenderQuality(frame_rate=22050, mono=True,
+                                    resample='nearest', effects=False),
+             'draft-stereo': RenderQuality(frame_rate=22050, mono=False,
+                                           resample='nearest', effects=False)}
+"""Named presets for the `quality` argument of rendering methods."""
+
+def get_quality(quality):
+    '''
+    Return the `RenderQuality` for a `quality` argument.
+
+    Parameters
+    ----------
+    quality : str, dict, or RenderQuality
+        Either the name of a preset in `QUALITIES` (`'full'`, `'draft'`, or
+        `'draft-stereo'`), a dictionary of settings which override the
+        `'full'` preset, or a `RenderQuality`.
+
+    Raises
+    ------
+    WubWubError
+        `quality` is not recognized.
+
+    Returns
+    -------
+    RenderQuality
+        The quality settings.
+
+    '''
+    if isinstance(quality, RenderQuality):
+        return quality
+    if isinstance(quality, dict):
+        return QUALITIES['full']._replace(**quality)
+    try:
+        return QUALITIES[quality]
+    except (KeyError, TypeError):
+        raise WubWubError(f'quality must be one of {list(QUALITIES)}, '
+                          'a dict, or a RenderQuality.')
+
+SampleLoop = namedtuple('SampleLoop', ['start', 'end', 'crossfade'],
+                        defaults=[0])
+SampleLoop.__doc__ = '''
+Loop points of a sample, for playing notes longer than the sample.  Once
+a note reaches `end`, playback jumps back to `start`, repeating the region
+between them for as long as the note lasts.
+
+- `start`: start of the loop, in milliseconds of the sample
+- `end`: end of the loop (exclusive), in milliseconds of the sample
+- `crossfade`: length (in milliseconds) of the end of the loop which is
+faded into the audio leading up to `start`, smoothing the jump back
+(default 0)
+'''
+
+Voice = namedtuple('Voice', ['position', 'duration', 'sample', 'ratio',
+                             'gain', 'attack', 'release', 'decay', 'sustain',
+                             'loop'],
+                   defaults=[0, 1.0, None])
+Voice.__doc__ = '''
+A single scheduled sound in a rendering.  Voices are created by
+Tracks from their Notes, and contain everything needed to mix the
+sound, with no reference back to the Note.
+
+- `position`: start of the sound, in milliseconds
+- `duration`: maximum length of the sound, in milliseconds
+- `sample`: the pydub AudioSegment to play
+- `ratio`: playback speed of the sample (1 is the original pitch)
+- `gain`: linear amplitude multiplier
+- `attack`: length of the fade in, in milliseconds
+- `release`: length of the fade out, in milliseconds
+- `decay`: length of the fall to the `sustain` level after the attack, in
+milliseconds (default 0)
+- `sustain`: linear gain held after the decay (default 1)
+- `loop`: a `SampleLoop` for the sample, or None to stop at the end of the
+sample (default)
+'''
+
+def ms_to_frames(ms, frame_rate):
+    '''Convert milliseconds to a number of frames (rounding down).'''
+    return int(ms * frame_rate / 1000)
+
+def sample_loop(sample, start, end=None, crossfade=0):
+    '''Validate loop points (in milliseconds) for a pydub AudioSegment,
+    returning a `SampleLoop`.  When `end` is None, the loop runs to the
+    end of the sample.'''
+    length = sample.frame_count() * 1000 / sample.frame_rate
+    end = length if end is None else end
+    if not 0 <= start < end <= length:
+        raise WubWubError('Loop points must satisfy 0 <= start < end <= '
+                          f'the length of the sample ({length} ms).')
+    if crossfade < 0 or crossfade > min(start, end - start):
+        raise WubWubError('Loop crossfade must not be negative, or longer '
+                          'than the loop or the audio before its start.')
+    return SampleLoop(start, end, crossfade)
+
+def segment_to_array(segment):
+    '''Convert a pydub AudioSegment into a float32 array of frames,
+    with shape `(frames, channels)` and values in [-1, 1].'''
+    if segment.sample_width == 3:
+        segment = segment.set_sample_width(4)
+    samples = np.array(segment.get_array_of_samples(), dtype=np.float32)
+    samples /= 2 ** (8 * segment.sample_width - 1)
+    return samples.reshape(-1, segment.channels)
+
+def _to_int(frames, sample_width):
+    '''Convert float frames to clipped integer samples.'''
+    scale = 2 ** (8 * sample_width - 1)
+    if sample_width > 2:
+        frames = frames.astype(np.float64)
+    return np.clip(np.rint(frames * scale), -scale, scale - 1)
+
+def _int_segment(data, frame_rate, sample_width):
+    '''Create a pydub AudioSegment from an integer array of frames.'''
+    return pydub.AudioSegment(data=data.tobytes(),
+                              sample_width=sample_width,
+                              frame_rate=frame_rate,
+                              channels=data.shape[1])
+
+def array_to_segment(frames, frame_rate, sample_width=2, start=0, total=None):
+    '''Convert a float array of frames (see `segment_to_array()`) into a
+    pydub AudioSegment.  Values are clipped to the range of `sample_width`.
+    The frames can be placed at frame `start` of a silent segment which is
+    `total` frames long.'''
+    if total is None:
+        total = start + len(frames)
+    data = np.zeros((total, frames.shape[1]), dtype=INT_TYPES[sample_width])
+    frames = frames[:max(total - start, 0)]
+    data[start:start + len(frames)] = _to_int(frames, sample_width)
+    return _int_segment(data, frame_rate, sample_width)
+
+def voice_from_note(note, sample, position, duration, basepitch=None,
+                    shift=True, fade=10, loop=None):
+    '''
+    Create a `Voice` for playing a `wubwub.notes.Note` with a sample.
+    This takes the place of `wubwub.audio.add_note_to_audio()`.
+
+    Parameters
+    ----------
+    note : wubwub.notes.Note
+        Note to play.
+    sample : pydub.AudioSegment
+        Sample to play.
+    position : int or float
+        Position (in milliseconds) to start the sample.
+    duration : int or float
+        Maximum duration (in milliseconds) of the sample.
+    basepitch : str or number, optional
+        Basepitch for the sample; used for shifting the pitch.
+        The default is None.
+    shift : bool, optional
+        Whether to shift the pitch of the sample or not. The default is True.
+    fade : int, optional
+        Fade (in milliseconds) for the end of the sample. The default is 10.
+    loop : SampleLoop, optional
+        Loop points of the sample. The default is None (no loop).
+
+    Returns
+    -------
+    Voice or None
+        The Voice, or None if the note should not be played.
+
+    '''
+    ratio = 1
+    if shift:
+        pitch = note.pitch
+        if pitch is None:
+            return None
+        if isinstance(pitch, str):
+            pitch = relative_pitch_to_int(basepitch, pitch)
+        ratio = 2.0 ** (pitch / 12)
+    attack = 10 if note.attack is None else note.attack
+    gain = 10 ** (note.volume / 20)
+    decay = note.decay or 0
+    if note.sustain is not None:
+        sustain = 10 ** (note.sustain / 20)
+    else:
+        sustain = 0.0 if decay else 1.0
+    return Voice(position=position, duration=max(duration, 0), sample=sample,
+                 ratio=ratio, gain=gain, attack=attack, release=fade,
+                 decay=decay, sustain=sustain, loop=loop)
+
+def voice_end(voice):
+    '''Return the time (in milliseconds) at which a Voice stops sounding,
+    based on its duration and the length of its (repitched) sample.
+    Looped Voices sound for their whole duration.'''
+    if voice.loop is not None:
+        return voice.position + voice.duration
+    sample = voice.sample
+    length = sample.frame_count() * 1000 / sample.frame_rate / voice.ratio
+    return voice.position + min(voice.duration, length)
+
+def cut_overlaps(voices):
+    '''Cut each Voice off where the next Voice starts, for Tracks with
+    `overlap=False`.  Voices starting together (e.g. in a chord) do not
+    cut each other.'''
+    if not voices:
+        return voices
+    positions = np.array([v.position for v in voices], dtype=np.float64)
+    starts = np.append(np.unique(positions), np.inf)
+    following = starts[np.searchsorted(starts, positions, 'right')]
+    return [v._replace(duration=max(nxt - v.position, 0))
+            if v.position + v.duration > nxt else v
+            for v, nxt in zip(voices, following.tolist())]
+
+STEAL_POLICIES = ['oldest', 'quietest']
+"""Options for the voice stealing of `limit_voices()`."""
+
+def limit_voices(voices, max_voices=None, steal='oldest'):
+    '''
+    Limit the number of Voices sounding at the same time.  When a Voice
+    starts while `max_voices` are already sounding, one of them is stolen:
+    it is cut off where the new Voice starts (with its release fade), so
+    no more than `max_voices` Voices are ever mixed at once.  Voices
+    starting together (e.g. in a chord) count as sounding.
+
+    Parameters
+    ----------
+    voices : list of Voice
+        The scheduled Voices.
+    max_voices : int or None, optional
+        Largest number of Voices sounding at once. The default is None,
+        meaning no limit.
+    steal : str, optional
+        Which sounding Voice is stolen: the one that started first
+        (`'oldest'`, the default), or the one with the lowest gain
+        (`'quietest'`, ties going to the oldest).
+
+    Returns
+    -------
+    list of Voice
+        The Voices (in the same order), with stolen ones shortened and
+        those left silent removed.
+
+    '''
+    if steal not in STEAL_POLICIES:
+        raise WubWubError(f'steal must be one of {STEAL_POLICIES}, '
+                          f'not "{steal}"')
+    if max_voices is None:
+        return list(voices)
+    if max_voices < 1:
+        raise WubWubError('max_voices must be at least 1.')
+    voices = list(voices)
+    order = sorted(range(len(voices)), key=lambda i: voices[i].position)
+    # indices of the sounding Voices, in the order they started
+    active = []
+    for i in order:
+        position = voices[i].position
+        active = [j for j in active if voice_end(voices[j]) > position]
+        if len(active) >= max_voices:
+            if steal == 'oldest':
+                j = active[0]
+            else:
+                j = min(active, key=lambda j: voices[j].gain)
+            active.remove(j)
+            voices[j] = voices[j]._replace(duration=position -
+                                           voices[j].position)
+        active.append(i)
+    return [v for v in voices if v.duration > 0]
+
+def render_bounds(voices):
+    '''Return the span (start and stop, in milliseconds) where a list of
+    Voices produces sound, or `None` if they are silent.'''
+    audible = [v for v in voices if voice_end(v) > v.position]
+    if not audible:
+        return None
+    return (min(v.position for v in audible),
+            max(voice_end(v) for v in audible))
+
+class AudioBuffer:
+    '''
+    A preallocated float32 buffer of audio frames.  Audio is mixed into
+    the buffer in place, and it is converted to a pydub AudioSegment once
+    with `AudioBuffer.to_audiosegment()`.
+
+    Parameters
+    ----------
+    frames : int
+        Length of the buffer, in frames.
+    frame_rate : int
+        Frame rate of the buffer.
+    channels : int, optional
+        Number of channels. The default is 1.
+    sample_width : int, optional
+        Sample width (in bytes) used when exporting. The default is 2.
+
+    '''
+
+    def __init__(self, frames, frame_rate, channels=1, sample_width=2):
+        self.data = np.zeros((max(frames, 0), channels), dtype=np.float32)
+        self.frame_rate = frame_rate
+        self.sample_width = sample_width
+
+    def __repr__(self):
+        return (f'AudioBuffer(frames={len(self)}, frame_rate={self.frame_rate}, '
+                f'channels={self.channels})')
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def channels(self):
+        return self.data.shape[1]
+
+    def add(self, frames, start=0):
+        '''Mix an array of `frames` into the buffer, starting at frame
+        `start`.  Audio outside of the buffer is discarded.'''
+        stop = min(start + len(frames), len(self.data))
+        if start < 0:
+            frames = frames[-start:]
+            start = 0
+        if frames.shape[1] > self.channels:
+            self.data = np.repeat(self.data, frames.shape[1], axis=1)
+        if stop > start:
+            self.data[start:stop] += frames[:stop - start]
+
+    def write(self, frames, start=0):
+        '''Replace the audio of the buffer with `frames`, starting at frame
+        `start`.  Audio outside of the buffer is discarded.'''
+        stop = min(start + len(frames), len(self.data))
+        if start < 0:
+            frames = frames[-start:]
+            start = 0
+        if frames.shape[1] > self.channels:
+            self.data = np.repeat(self.data, frames.shape[1], axis=1)
+        if stop > start:
+            self.data[start:stop] = frames[:stop - start]
+
+    def chunks(self):
+        '''Iterate over `(start, frames)` pairs covering the audio.'''
+        yield 0, self.data
+
+    def map(self, func, offsets=False):
+        '''Replace the audio with the output of `func`, a function which takes
+        and returns an array of frames with the same length.  When `offsets`
+        is True, `func` is also passed the frame where the array starts.'''
+        self.data = func(self.data, 0) if offsets else func(self.data)
+
+    def mix(self, other, start=0, gain=1):
+        '''Mix another AudioBuffer or SparseAudioBuffer (with the same frame
+        rate) into this one, starting at frame `start`, with a linear
+        `gain`.'''
+        self.sample_width = max(self.sample_width, other.sample_width)
+        for offset, frames in other.chunks():
+            if gain != 1:
+                frames = frames * np.float32(gain)
+            self.add(frames, start + offset)
+
+    def to_dense(self):
+        '''Return self (the buffer is already dense).'''
+        return self
+
+    def to_audiosegment(self, start=0, total=None):
+        '''Return the buffer as a pydub AudioSegment.  The buffer can be
+        placed at frame `start` of a silent segment `total` frames long.'''
+        return array_to_segment(self.data, self.frame_rate, self.sample_width,
+                                start=start, total=total)
+
+class SparseAudioBuffer:
+    '''
+    A float32 audio buffer which is stored as fixed-size blocks of frames.
+    Blocks are only allocated where sound is added, so long renderings
+    which are mostly silent use little memory.  The buffer has the same
+    interface as `AudioBuffer`; it only becomes dense when converted with
+    `SparseAudioBuffer.to_dense()` or
+    `SparseAudioBuffer.to_audiosegment()`.
+
+    Parameters
+    ----------
+    frames : int
+        Length of the buffer, in frames.
+    frame_rate : int
+        Frame rate of the buffer.
+    channels : int, optional
+        Number of channels. The default is 1.
+    sample_width : int, optional
+        Sample width (in bytes) used when exporting. The default is 2.
+    block_frames : int, optional
+        Number of frames in each block. The default is `BLOCK_FRAMES`.
+
+    '''
+
+    def __init__(self, frames, frame_rate, channels=1, sample_width=2,
+                 block_frames=BLOCK_FRAMES):
+        self.length = max(frames, 0)
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.block_frames = block_frames
+        self.blocks = {}
+
+    def __repr__(self):
+        return (f'SparseAudioBuffer(frames={len(self)}, '
+                f'frame_rate={self.frame_rate}, channels={self.channels}, '
+                f'blocks={len(self.blocks)})')
+
+    def __len__(self):
+        return self.length
+
+    def add(self, frames, start=0):
+        '''Mix an array of `frames` into the buffer, starting at frame
+        `start`.  Audio outside of the buffer is discarded, and no blocks
+        are allocated for silent audio.'''
+        self._blit(frames, start, replace=False)
+
+    def write(self, frames, start=0):
+        '''Replace the audio of the buffer with `frames`, starting at frame
+        `start`.  Audio outside of the buffer is discarded, and no blocks
+        are allocated for silent audio.'''
+        self._blit(frames, start, replace=True)
+
+    def _blit(self, frames, start, replace):
+        if frames.shape[1] > self.channels:
+            self.map(lambda block: np.repeat(block, frames.shape[1], axis=1))
+            self.channels = frames.shape[1]
+        stop = min(start + len(frames), self.length)
+        if start < 0:
+            frames = frames[-start:]
+            start = 0
+        size = self.block_frames
+        pos = start
+        while pos < stop:
+            idx, offset = divmod(pos, size)
+            n = min(size - offset, stop - pos)
+            chunk = frames[pos - start:pos - start + n]
+            block = self.blocks.get(idx)
+            if block is None and chunk.any():
+                block = np.zeros((size, self.channels), dtype=np.float32)
+                self.blocks[idx] = block
+            if block is not None and replace:
+                block[offset:offset + n] = chunk
+            elif block is not None:
+                block[offset:offset + n] += chunk
+            pos += n
+
+    def chunks(self):
+        '''Iterate over `(start, frames)` pairs for each allocated block,
+        in time order.'''
+        for idx in sorted(self.blocks):
+            start = idx * self.block_frames
+            yield start, self.blocks[idx][:self.length - start]
+
+    def map(self, func, offsets=False):
+        '''Replace each block with the output of `func`, a function which
+        takes and returns an array of frames with the same length.  When
+        `offsets` is True, `func` is also passed the frame where the block
+        starts.'''
+        call = func if offsets else lambda frames, start: func(frames)
+        for idx, block in self.blocks.items():
+            self.blocks[idx] = call(block, idx * self.block_frames)
+            self.channels = self.blocks[idx].shape[1]
+        if not self.blocks:
+            self.channels = call(np.zeros((0, self.channels),
+                                          dtype=np.float32), 0).shape[1]
+
+    def mix(self, other, start=0, gain=1):
+        '''Mix another AudioBuffer or SparseAudioBuffer (with the same frame
+        rate) into this one, starting at frame `start`, with a linear
+        `gain`.'''
+        self.sample_width = max(self.sample_width, other.sample_width)
+        for offset, frames in other.chunks():
+            if gain != 1:
+                frames = frames * np.float32(gain)
+            self.add(frames, start + offset)
+
+    def to_dense(self):
+        '''Return the audio as a dense `AudioBuffer`.'''
+        dense = AudioBuffer(self.length, self.frame_rate, self.channels,
+                            self.sample_width)
+        dense.mix(self)
+        return dense
+
+    def to_audiosegment(self, start=0, total=None):
+        '''Return the buffer as a pydub AudioSegment.  The buffer can be
+        placed at frame `start` of a silent segment `total` frames long.
+        Only the output samples are allocated in full.'''
+        if total is None:
+            total = start + self.length
+        data = np.zeros((total, self.channels),
+                        dtype=INT_TYPES[self.sample_width])
+        for offset, frames in self.chunks():
+            lo = start + offset
+            frames = frames[:max(total - lo, 0)]
+            data[lo:lo + len(frames)] = _to_int(frames, self.sample_width)
+        return _int_segment(data, self.frame_rate, self.sample_width)
+
+@lru_cache(maxsize=256)
+def _ramp(n, start, stop):
+    '''Linear gain ramp of length `n`, with shape `(n, 1)`.  Ramps are
+    cached (read-only), as the same fades are usually played many times.'''
+    ramp = np.linspace(start, stop, n, endpoint=False,
+                       dtype=np.float32)[:, np.newaxis]
+    ramp.setflags(write=False)
+    return ramp
+
+def envelope(frames, attack=0, decay=0, sustain=1.0, release=0, lo=0,
+             hi=None):
+    '''
+    Return the gain envelope of a note `frames` long, with shape
+    `(frames, 1)`.  The gain rises from 0 to 1 over the `attack`, falls to
+    the `sustain` level over the `decay`, and is held there until the
+    `release`, over which it fades to 0.  Stages are cut short when the
+    note is too short for them, and the release is applied on top of the
+    other stages.  Only the ramps of the stages are cached; the rest is
+    filled in on each call, and only for the frames from `lo` to `hi`.
+
+    Parameters
+    ----------
+    frames : int
+        Length of the note, in frames.
+    attack, decay, release : int, optional
+        Length of each stage, in frames. The defaults are 0.
+    sustain : float, optional
+        Linear gain of the sustain stage. The default is 1.0.
+    lo, hi : int, optional
+        Range of frames of the envelope to return. The defaults are the
+        whole note.
+
+    Returns
+    -------
+    numpy.ndarray
+        The float32 gain of each frame.
+
+    '''
+    hi = frames if hi is None else hi
+    env = np.full((hi - lo, 1), sustain, dtype=np.float32)
+
+    def stage(start, ramp):
+        # the part of a ramp starting at frame `start` within lo to hi
+        a = max(start, lo)
+        z = max(min(start + len(ramp), hi), a)
+        return slice(a - lo, z - lo), ramp[a - start:z - start]
+
+    attack = min(attack, frames)
+    where, ramp = stage(0, _ramp(attack, 0, 1))
+    env[where] = ramp
+    decay = min(decay, frames - attack)
+    if decay > 0:
+        where, ramp = stage(attack, _ramp(decay, 1, sustain))
+        env[where] = ramp
+    release = min(release, frames)
+    if release:
+        where, ramp = stage(frames - release, _ramp(release, 1, 0))
+        env[where] *= ramp
+    return env
+
+def _resample(samples, step, method='linear'):
+    '''Resample an array of frames, reading `step` source frames for every
+    output frame.  The `method` is either `'linear'` (interpolation) or
+    `'nearest'` (the cheapest, taking the nearest earlier frame).'''
+    if step == 1:
+        return samples
+    n = int(len(samples) / step)
+    positions = np.arange(n) * step
+    if method == 'nearest':
+        return samples[positions.astype(np.int64)]
+    src = np.arange(len(samples))
+    out = np.empty((n, samples.shape[1]), dtype=np.float32)
+    for c in range(samples.shape[1]):
+        out[:, c] = np.interp(positions, src, samples[:, c])
+    return out
+
+EVENT_FIELDS = ('start', 'sample', 'ratio', 'gain', 'duration', 'attack',
+                'release', 'decay', 'sustain', 'loop_start', 'loop_end',
+                'crossfade')
+"""Names of the arrays describing frame-indexed events (see `voice_events()`)."""
+
+def voice_events(voices, frame_rate, samples=None):
+    '''
+    Convert Voices into frame-indexed events: a dict of NumPy arrays (one
+    entry per Voice) with the fields in `EVENT_FIELDS`.  The `start`,
+    `duration`, `attack`, `decay` and `release` are in frames, and the
+    `sample` is
+    an index into the list `samples` (pydub AudioSegments).  New samples
+    are appended to `samples`, which is returned with the events.  The
+    `loop_start`, `loop_end` and `crossfade` of looped Voices are in frames
+    of the repitched sample; for other Voices they are 0.
+    '''
+    samples = [] if samples is None else samples
+    index = {id(s): i for i, s in enumerate(samples)}
+    columns = {field: [] for field in EVENT_FIELDS}
+    for v in voices:
+        if id(v.sample) not in index:
+            index[id(v.sample)] = len(samples)
+            samples.append(v.sample)
+        columns['start'].append(ms_to_frames(v.position, frame_rate))
+        columns['sample'].append(index[id(v.sample)])
+        columns['ratio'].append(v.ratio)
+        columns['gain'].append(v.gain)
+        columns['duration'].append(ms_to_frames(v.duration, frame_rate))
+        columns['attack'].append(ms_to_frames(v.attack, frame_rate))
+        columns['release'].append(ms_to_frames(v.release, frame_rate))
+        columns['decay'].append(ms_to_frames(v.decay, frame_rate))
+        columns['sustain'].append(v.sustain)
+        loop = v.loop or SampleLoop(0, 0)
+        columns['loop_start'].append(ms_to_frames(loop.start / v.ratio,
+                                                  frame_rate))
+        columns['loop_end'].append(ms_to_frames(loop.end / v.ratio,
+                                                frame_rate))
+        columns['crossfade'].append(ms_to_frames(loop.crossfade / v.ratio,
+                                                 frame_rate))
+    types = {'start': np.int64, 'sample': np.int32, 'ratio': np.float64,
+             'gain': np.float64, 'duration': np.int64, 'attack': np.int64,
+             'release': np.int64, 'decay': np.int64, 'sustain': np.float64,
+             'loop_start': np.int64, 'loop_end': np.int64,
+             'crossfade': np.int64}
+    events = {field: np.array(columns[field], dtype=types[field])
+              for field in EVENT_FIELDS}
+    return events, samples
+
+def _decode_samples(samples):
+    '''Decode pydub samples for `render_events()`; returns the frames
+    (see `segment_to_array()`) and the frame rate of each.'''
+    return ([segment_to_array(s) for s in samples],
+            [s.frame_rate for s in samples])
+
+def _event_source(idx, ratio, samples, rates, buffer, cache, resample):
+    '''Return the frames of sample `idx` (mixed down to the channels of the
+    buffer), repitched by `ratio` for the rate of the buffer.'''
+    step = rates[idx] * ratio / buffer.frame_rate
+    key = (idx, step)
+    if key not in cache:
+        if idx not in cache:
+            decoded = samples[idx]
+            if decoded.shape[1] > buffer.channels:
+                decoded = decoded.mean(axis=1, keepdims=True)
+            cache[idx] = decoded
+        cache[key] = _resample(cache[idx], step, resample)
+    return cache[key]
+
+def _loop_frames(source, lo, hi, loop_start, loop_end, crossfade):
+    '''Return frames `lo` to `hi` of a looped `source`.  Frames past
+    `loop_end` are mapped back into the loop by index arithmetic, so the
+    loop is never copied out, and the last `crossfade` frames of the loop
+    are blended with the frames before `loop_start`.'''
+    period = loop_end - loop_start
+    idx = np.arange(lo, hi)
+    idx = np.where(idx < loop_end, idx,
+                   loop_start + (idx - loop_start) % period)
+    frames = source[idx]
+    if crossfade:
+        fading = idx >= loop_end - crossfade
+        m = idx[fading]
+        w = ((m - (loop_end - crossfade) + 1) / (crossfade + 1))[:, None]
+        frames[fading] = (frames[fading] * (1 - w).astype(np.float32) +
+                          source[m - period] * w.astype(np.float32))
+    return frames
+
+def _mix_event(source, buffer, start, duration, gain, attack, release,
+               decay=0, sustain=1.0, loop_start=0, loop_end=0, crossfade=0):
+    '''Mix one event (with a repitched `source`) into an AudioBuffer, where
+    `start` is relative to the buffer.'''
+    loop_end = min(loop_end, len(source))
+    looped = loop_end > loop_start
+    n = duration if looped else min(duration, len(source))
+    # only the part of the event inside the buffer is computed
+    lo = max(0, -start)
+    hi = min(n, len(buffer) - start)
+    if hi <= lo:
+        return
+    if looped:
+        crossfade = min(crossfade, loop_start, loop_end - loop_start)
+        sound = _loop_frames(source, lo, hi, loop_start, loop_end, crossfade)
+        sound *= np.float32(gain)
+    else:
+        sound = source[lo:hi] * np.float32(gain)
+    if attack or release or decay or sustain != 1:
+        sound *= envelope(n, attack, decay, sustain, release, lo, hi)
+    buffer.add(sound, start + lo)
+
+def _mix_events(events, samples, rates, buffer, origin, cache,
+                resample='linear', select=None):
+    '''Mix events into a buffer whose first frame is `origin`.  The events
+    can be restricted to the indices in `select`.'''
+    columns = [events[field] if select is None else events[field][select]
+               for field in EVENT_FIELDS]
+    for start, idx, ratio, gain, duration, *shape in zip(
+            *[c.tolist() for c in columns]):
+        source = _event_source(idx, ratio, samples, rates, buffer, cache,
+                               resample)
+        _mix_event(source, buffer, start - origin, duration, gain, *shape)
+
+def render_events(events, samples, rates, start, frames, frame_rate,
+                  channels=1, sample_width=2, sparse=False, resample='linear'):
+    '''
+    Mix frame-indexed events (see `voice_events()`) into a new
+    `AudioBuffer` or `SparseAudioBuffer`, covering `frames` frames from
+    frame `start`.  The `samples` are arrays of frames
+    (see `segment_to_array()`), with frame rates `rates`.
+    '''
+    kind = SparseAudioBuffer if sparse else AudioBuffer
+    buffer = kind(frames, frame_rate, channels=channels,
+                  sample_width=sample_width)
+    _mix_events(events, samples, rates, buffer, start, {}, resample)
+    return buffer
+
+def iter_event_blocks(events, samples, rates, start, frames, frame_rate,
+                      channels=1, sample_width=2, block_frames=BLOCK_FRAMES,
+                      resample='linear'):
+    '''
+    Streaming version of `render_events()`, yielding consecutive
+    `AudioBuffer` blocks of `block_frames` frames (the last may be
+    shorter).  Only the events sounding within each block are mixed.
+    '''
+    lengths = np.array([len(s) for s in samples] + [0])[events['sample']]
+    steps = (np.array(rates + [1], dtype=np.float64)[events['sample']]
+             * events['ratio'] / frame_rate)
+    # frame spans are rounded outward; _mix_event clips exactly
+    ends = events['start'] + np.where(
+        events['loop_end'] > events['loop_start'], events['duration'],
+        np.minimum(events['duration'], lengths / steps)) + 2
+    order = np.argsort(events['start'], kind='stable')
+    starts = events['start'][order]
+    cache = {}
+    active = np.empty(0, dtype=np.int64)
+    i = 0
+    for pos in range(start, start + frames, block_frames):
+        n = min(block_frames, start + frames - pos)
+        j = np.searchsorted(starts, pos + n, side='left')
+        active = np.concatenate([active, order[i:j]])
+        i = j
+        active = active[ends[active] > pos]
+        block = AudioBuffer(n, frame_rate, channels=channels,
+                            sample_width=sample_width)
+        _mix_events(events, samples, rates, block, pos, cache, resample,
+                    select=active)
+        yield block
+
+def optimize_events(events, samples, rates, frame_rate, min_gain=SILENT_GAIN):
+    '''
+    Optimize events (see `voice_events()`) before mixing.  Events which
+    make no sound are dropped: those with no frames to play (e.g. notes
+    cut off entirely with `overlap=False`, or empty samples), and those
+    with a gain at or below `min_gain`.  Identical events (same sample,
+    pitch, start, duration, and fades, e.g. from merged Chords) are mixed
+    as one event with their gains summed.
+
+    Parameters
+    ----------
+    events : dict of numpy.ndarray
+        The events.  Any extra fields (such as the `track` of a
+        `wubwub.plan.RenderPlan`) must also match for events to be merged.
+    samples : list of numpy.ndarray
+        Decoded samples, indexed by `events['sample']`.
+    rates : list of int
+        Frame rate of each sample.
+    frame_rate : int
+        Frame rate of the rendering.
+    min_gain : float, optional
+        Linear gain at or below which events are dropped.  The default is
+        `SILENT_GAIN`.
+
+    Returns
+    -------
+    events : dict of numpy.ndarray
+        The optimized events.
+    removed : int
+        The number of events removed.
+
+    '''
+    total = len(events['start'])
+    lengths = np.array([len(x) for x in samples] + [0])[events['sample']]
+    steps = (np.array(list(rates) + [1], dtype=np.float64)[events['sample']]
+             * events['ratio'] / frame_rate)
+    frames = np.where(events['loop_end'] > events['loop_start'],
+                      events['duration'],
+                      np.minimum(events['duration'],
+                                 (lengths / steps).astype(np.int64)))
+    keep = (frames > 0) & (events['gain'] > min_gain)
+    events = {field: values[keep] for field, values in events.items()}
+
+    fields = [field for field in events if field != 'gain']
+    keys = np.rec.fromarrays([events[field] for field in fields], names=fields)
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    if len(first) < len(keys):
+        gains = np.bincount(inverse.ravel(), weights=events['gain'])
+        order = np.argsort(first)
+        events = {field: values[first[order]] for field, values in events.items()}
+        events['gain'] = gains[order]
+    return events, total - len(events['start'])
+
+def _voice_setup(voices, frame_rate, mono=False):
+    '''Return the (optimized) events, decoded samples, channels and sample
+    width for rendering Voices.'''
+    events, segments = voice_events(voices, frame_rate)
+    samples, rates = _decode_samples(segments)
+    events, _ = optimize_events(events, samples, rates, frame_rate)
+    channels = 1 if mono else max([s.channels for s in segments], default=1)
+    width = max([s.sample_width for s in segments] + [2])
+    return events, samples, rates, channels, width
+
+def render_voices(voices, length, frame_rate=SHIFT_RATE, origin=0,
+                  sparse=False, mono=False, resample='linear'):
+    '''
+    Mix Voices into a new `AudioBuffer` or `SparseAudioBuffer`.
+
+    Parameters
+    ----------
+    voices : list of wubwub.render.Voice
+        Voices to render.
+    length : int or float
+        Length of the rendering, in milliseconds.
+    frame_rate : int, optional
+        Frame rate of the rendering. The default is 44100.
+    origin : int or float, optional
+        Time (in milliseconds) corresponding to the start of the buffer.
+        The default is 0.
+    sparse : bool, optional
+        Render into a `SparseAudioBuffer`. The default is False.
+    mono : bool, optional
+        Mix all Voices down to one channel. The default is False.
+    resample : 'linear' or 'nearest', optional
+        Method used for repitching samples. The default is 'linear'.
+
+    Returns
+    -------
+    buffer : wubwub.render.AudioBuffer or wubwub.render.SparseAudioBuffer
+        The rendered audio.
+
+    '''
+    events, samples, rates, channels, width = _voice_setup(voices, frame_rate,
+                                                           mono)
+    first = ms_to_frames(origin, frame_rate)
+    last = ms_to_frames(origin + length, frame_rate)
+    return render_events(events, samples, rates, first, last - first,
+                         frame_rate, channels=channels, sample_width=width,
+                         sparse=sparse, resample=resample)
+
+def iter_voice_blocks(voices, start, frames, frame_rate=SHIFT_RATE, channels=1,
+                      block_frames=BLOCK_FRAMES, resample='linear'):
+    '''
+    Render Voices as a stream of consecutive `AudioBuffer` blocks.  Only
+    the Voices sounding within each block are mixed into it, so the memory
+    used is independent of the total length.  The output is identical to
+    the corresponding frames of `render_voices()`.
+
+    Parameters
+    ----------
+    voices : list of wubwub.render.Voice
+        Voices to render.
+    start : int
+        Frame at which the first block starts.
+    frames : int
+        Total number of frames to render.
+    frame_rate : int, optional
+        Frame rate of the rendering. The default is 44100.
+    channels : int, optional
+        Number of channels in each block; samples with more channels are
+        mixed down. The default is 1.
+    block_frames : int, optional
+        Number of frames in each block (the last block may be shorter).
+        The default is `BLOCK_FRAMES`.
+    resample : 'linear' or 'nearest', optional
+        Method used for repitching samples. The default is 'linear'.
+
+    Yields
+    ------
+    block : wubwub.render.AudioBuffer
+        The rendered audio, block by block.
+
+    '''
+    events, samples, rates, _, width = _voice_setup(voices, frame_rate)
+    yield from iter_event_blocks(events, samples, rates, start, frames,
+                                 frame_rate, channels=channels,
+                                 sample_width=width,
+                                 block_frames=block_frames,
+                                 resample=resample)
+
+def iter_buffer_blocks(buffer, offset, frames, block_frames=BLOCK_FRAMES):
+    '''Yield an already rendered buffer as consecutive `AudioBuffer` blocks
+    (see `iter_voice_blocks()`), with the buffer placed at frame `offset`
+    of a stream which is `frames` long.'''
+    data = buffer.to_dense().data
+    for pos in range(0, frames, block_frames):
+        n = min(block_frames, frames - pos)
+        block = AudioBuffer(n, buffer.frame_rate, channels=data.shape[1],
+                            sample_width=buffer.sample_width)
+        lo = max(pos - offset, 0)
+        hi = pos + n - offset
+        if hi > lo:
+            block.add(data[lo:hi], max(offset - pos, 0))
+        yield block
+
+class _BlockReader:
+    '''Reads arbitrary numbers of frames from a stream of `AudioBuffer`
+    blocks (see `iter_voice_blocks()`), so that streams which are not
+    aligned with each other can be mixed.'''
+
+    def __init__(self, blocks):
+        self.blocks = iter(blocks)
+        self.current = None
+        self.pos = 0
+
+    def mix_into(self, buffer, frames, start=0):
+        '''Mix the next `frames` frames of the stream into `buffer`, starting
+        at frame `start`.  Returns False once the stream is exhausted.'''
+        while frames > 0:
+            if self.current is None or self.pos >= len(self.current):
+                self.current = next(self.blocks, None)
+                self.pos = 0
+                if self.current is None:
+                    return False
+            chunk = self.current.data[self.pos:self.pos + frames]
+            buffer.sample_width = max(buffer.sample_width,
+                                      self.current.sample_width)
+            buffer.add(chunk, start)
+            self.pos += len(chunk)
+            start += len(chunk)
+            frames -= len(chunk)
+        return True
+
+def _pan_frames(frames, pan, upmix=True):
+    '''Pan frames, following the gains used by `pydub.AudioSegment.pan`.
+    Mono audio is converted to stereo, unless it is centered and `upmix`
+    is False.'''
+    if not -1.0 <= pan <= 1.0:
+        raise ValueError("pan_amount should be between -1.0 (100% left) "
+                         "and +1.0 (100% right)")
+    boost_factor = 2.0 ** abs(pan)
+    boost = np.sqrt(boost_factor)
+    reduce = 2.0 - boost_factor
+    gains = (boost, reduce) if pan < 0 else (reduce, boost)
+    if pan == 0 and not upmix:
+        return frames
+    if frames.shape[1] == 1:
+        frames = np.repeat(frames, 2, axis=1)
+    if pan != 0:
+        frames = frames * np.array(gains, dtype=np.float32)
+    return frames
+
+AUTOMATABLE = ('volume', 'pan')
+"""Parameters of Tracks and Sequencers which can be automated (see
+`wubwub.tracks.Track.automate()`)."""
+
+def update_automation(automation, parameter, points):
+    '''Return a copy of an `automation` dict (parameter -> breakpoints) with
+    the breakpoints of `parameter` replaced by `points` (a dict or pairs of
+    beat and value), or removed when `points` is None.'''
+    if parameter not in AUTOMATABLE:
+        raise WubWubError(f'parameter must be one of {list(AUTOMATABLE)}, '
+                          f'not "{parameter}"')
+    automation = dict(automation)
+    if points is None:
+        automation.pop(parameter, None)
+        return automation
+    if isinstance(points, dict):
+        points = points.items()
+    points = tuple(sorted((float(b), float(v)) for b, v in points))
+    if not points:
+        raise WubWubError('Automation needs at least one breakpoint.')
+    automation[parameter] = points
+    return automation
+
+def automation_curves(automation, tempo, frame_rate, origin=0):
+    '''Convert an `automation` dict (parameter -> breakpoints in beats) into
+    curves for `postprocess_frames()`: parameter -> `(positions, values)`,
+    where the positions are in frames, relative to frame `origin`.  The
+    `tempo` is a `wubwub.tempo.TempoMap`, or a BPM.'''
+    if not isinstance(tempo, TempoMap):
+        tempo = TempoMap(tempo)
+    curves = {}
+    for parameter, points in automation.items():
+        beats, values = np.array(points, dtype=np.float64).T
+        positions = tempo.ms(beats) * frame_rate / 1000 - origin
+        curves[parameter] = (positions, values)
+    return curves
+
+def _curve(curve, start, n):
+    '''Evaluate an automation curve for `n` frames from frame `start`.'''
+    positions, values = curve
+    return np.interp(np.arange(start, start + n), positions, values)
+
+def _pan_curve(frames, pan):
+    '''Pan frames with a different amount for each frame (see
+    `_pan_frames()`).  The output is always stereo.'''
+    boost_factor = 2.0 ** np.abs(pan)
+    boost = np.sqrt(boost_factor)
+    reduce = 2.0 - boost_factor
+    gains = np.empty((len(frames), 2), dtype=np.float32)
+    gains[:, 0] = np.where(pan < 0, boost, reduce)
+    gains[:, 1] = np.where(pan < 0, reduce, boost)
+    if frames.shape[1] == 1:
+        frames = np.repeat(frames, 2, axis=1)
+    return frames * gains
+
+def postprocess_frames(owner, frames, frame_rate, sample_width=2, upmix=True,
+                       quality='full', start=0, automation=None):
+    '''
+    Apply the postprocessing steps of a Track or Sequencer to an array of
+    frames.  This mirrors `wubwub.sequencer.Sequencer.postprocess()`, but
+    works on the arrays used for rendering.
+
+    Parameters
+    ----------
+    owner : wubwub.tracks.Track or wubwub.sequencer.Sequencer
+        Object defining the `postprocess_steps`, `effects`, `volume`, and
+        `pan`.
+    frames : numpy.ndarray
+        Audio frames, see `segment_to_array()`.
+    frame_rate : int
+        Frame rate of the audio.
+    sample_width : int, optional
+        Sample width used when passing audio to external effects.
+        The default is 2.
+    upmix : bool, optional
+        When False, centered mono audio is left as mono by the `'pan'`
+        step, so it can be mixed in one channel and converted to stereo
+        later (see `upmix_frames()`). The default is True.
+    quality : str, dict, or RenderQuality, optional
+        Render quality (see `get_quality()`).  Effects are skipped when the
+        quality disables them, and mono renderings are not panned.
+        The default is 'full'.
+    start : int, optional
+        Frame where `frames` starts, in the positions of the `automation`.
+        The default is 0.
+    automation : dict, optional
+        Automation curves (see `automation_curves()`).  Automated volume
+        (in dB) and pan are added to the `volume` and `pan` of the owner,
+        and evaluated for every frame.  The default is None.
+
+    Returns
+    -------
+    frames : numpy.ndarray
+        The processed audio.
+
+    '''
+    quality = get_quality(quality)
+    automation = automation or {}
+    for step in owner.postprocess_steps:
+        if step == 'effects' and owner.effects is not None and quality.effects:
+            if hasattr(owner.effects, 'process'):
+                # built-in effects (see wubwub.effects)
+                frames = owner.effects.process(frames, frame_rate)
+            else:
+                sound = array_to_segment(frames, frame_rate, sample_width)
+                frames = segment_to_array(add_effects(sound, owner.effects))
+        if step == 'volume' and 'volume' in automation:
+            db = owner.volume + _curve(automation['volume'], start, len(frames))
+            frames = frames * (10 ** (db / 20)).astype(np.float32)[:, np.newaxis]
+        elif step == 'volume' and owner.volume != 0:
+            frames = frames * np.float32(10 ** (owner.volume / 20))
+        if step == 'pan' and not quality.mono:
+            if 'pan' in automation:
+                pan = owner.pan + _curve(automation['pan'], start, len(frames))
+                frames = _pan_curve(frames, np.clip(pan, -1, 1))
+            else:
+                frames = _pan_frames(frames, owner.pan, upmix=upmix)
+    return frames
+
+def uses_effects(owner, quality='full'):
+    '''Return True if rendering a Track or Sequencer at a given `quality`
+    applies its (external) effects.'''
+    return (owner.effects is not None and 'effects' in owner.postprocess_steps
+            and get_quality(quality).effects)
+
+def streamable(owner, quality='full'):
+    '''Return True if the postprocessing of a Track or Sequencer can be
+    applied block by block: it has no effects, or only built-in effects
+    (see `wubwub.effects`), which keep their state between blocks.'''
+    return not uses_effects(owner, quality) or hasattr(owner.effects, 'process')
+
+class _FreshEffects:
+    '''Stands in for a Track or Sequencer during one rendering, with a fresh
+    copy of its built-in effects, so that the state of the effects is not
+    shared with other renderings.'''
+
+    def __init__(self, owner):
+        self._owner = owner
+        self.effects = owner.effects
+        if hasattr(owner.effects, 'process'):
+            self.effects = owner.effects.copy()
+
+    def __getattr__(self, name):
+        return getattr(self._owner, name)
+
+def with_fresh_effects(owner):
+    '''Return a stand-in for a Track or Sequencer with fresh built-in effects,
+    to be passed to `postprocess_buffer()` for each block of a stream.'''
+    return _FreshEffects(owner)
+
+def postprocess_buffer(owner, buffer, upmix=True, quality='full', start=0,
+                       automation=None, stream=False):
+    '''Apply the postprocessing of a Track or Sequencer to an `AudioBuffer`
+    or `SparseAudioBuffer` (see `postprocess_frames()`), which starts at
+    frame `start` of the `automation` curves.  Volume and pan are applied
+    block by block, but effects need contiguous audio, so sparse buffers
+    are made dense when the owner has effects.  Unless `stream` is True
+    (the buffer continues a stream, see `with_fresh_effects()`), built-in
+    effects start from a clear state.  Returns the processed buffer.'''
+    quality = get_quality(quality)
+    if uses_effects(owner, quality) and not stream:
+        buffer = buffer.to_dense()
+        owner = with_fresh_effects(owner)
+    buffer.map(lambda frames, offset: postprocess_frames(owner, frames,
+                                                         buffer.frame_rate,
+                                                         buffer.sample_width,
+                                                         upmix=upmix,
+                                                         quality=quality,
+                                                         start=start + offset,
+                                                         automation=automation),
+               offsets=True)
+    return buffer
+
+def upmix_frames(frames):
+    '''Convert mono frames to stereo; other audio is returned unchanged.'''
+    if frames.shape[1] == 1:
+        frames = np.repeat(frames, 2, axis=1)
+    return frames
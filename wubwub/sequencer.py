@@ -5,16 +5,24 @@ This module contains the Sequencer class, and associated functions for
 working with Sequencers in wubwub.
 """
 
+from collections import Counter
 import os
 import time
 
-import pydub
-
-from wubwub.audio import add_effects, play, _overhang_to_milli
+from wubwub.audio import (add_effects, export_blocks, play, play_blocks,
+                          _overhang_to_milli)
 from wubwub.errors import WubWubError
+from wubwub.mixer import Bus, Group, group_routes, send_gains
+from wubwub.plan import compile_plan
 from wubwub.plots import sequencerplot
-from wubwub.resources import MINUTE, unique_name
+from wubwub.render import (BLOCK_FRAMES, AudioBuffer, SparseAudioBuffer,
+                           automation_curves, get_quality, iter_buffer_blocks,
+                           ms_to_frames, postprocess_buffer, streamable,
+                           update_automation, upmix_frames,
+                           with_fresh_effects, _BlockReader)
+from wubwub.resources import unique_name
 from wubwub.seqstring import seqstring
+from wubwub.tempo import TempoMap, tempo_points
 from wubwub.tracks import Sampler, Arpeggiator, MultiSampler
 
 __all__ = ['Sequencer', 'stitch', 'join', 'loop']
@@ -28,7 +36,8 @@ class Sequencer:
 
     Both parameters for initialization (BPM and length) can be tweaked
     after creation by setting the value of the <code>bpm</code> or
-    <code>beats</code> attributes.
+    <code>beats</code> attributes.  Changes of tempo within the Sequencer
+    can be added with `Sequencer.set_tempo()`.
 
     Parameters
     ----------
@@ -57,13 +66,26 @@ class Sequencer:
 
         self.bpm = bpm
         self.beats = beats
+        self.tempo_changes = ()
 
         self.effects = None
         self.volume = 0
         self.pan = 0
         self.postprocess_steps = ['effects', 'volume', 'pan']
+        self.automation = {}
+        self.groove = None
 
         self._tracks = []
+        self._buses = []
+        self._groups = []
+
+    def __setattr__(self, name, value):
+        """Set attributes; changing the tempo, length, or groove marks all
+        Tracks as changed, so they are rendered again."""
+        object.__setattr__(self, name, value)
+        if name in ('bpm', 'beats', 'tempo_changes', 'groove'):
+            for track in getattr(self, '_tracks', []):
+                track._touch()
 
     def __repr__(self):
         """String representation of self."""
@@ -173,6 +195,103 @@ class Sequencer:
         """Returns a list of the names of each Track currenlty part of this Sequencer."""
         return [t.name for t in self._tracks]
 
+    def add_bus(self, name, effects=None, volume=0, pan=0):
+        '''
+        Add a bus to the Sequencer, which Tracks can send audio to (see
+        `wubwub.tracks.Track.send()` and `wubwub.mixer`).  The audio sent
+        to the bus is summed and postprocessed once, and added to the mix.
+
+        Parameters
+        ----------
+        name : str
+            Name of the bus.
+        effects : optional
+            Effects of the bus (see `wubwub.effects`). The default is None.
+        volume : int or float, optional
+            Volume (in dB) of the bus output. The default is 0.
+        pan : float, optional
+            Panning of the bus output. The default is 0.
+
+        Returns
+        -------
+        bus : wubwub.mixer.Bus
+            The new bus.
+
+        '''
+        if name in [bus.name for bus in self._buses]:
+            raise WubWubError(f'Bus name "{name}" already in use.')
+        bus = Bus(name, effects=effects, volume=volume, pan=pan)
+        self._buses.append(bus)
+        return bus
+
+    def get_bus(self, name):
+        """Return the bus with a given name."""
+        try:
+            return next(bus for bus in self._buses if bus.name == name)
+        except StopIteration:
+            raise ValueError(f'no bus with name {name}')
+
+    def buses(self):
+        """Returns a tuple of the buses of this Sequencer."""
+        return tuple(self._buses)
+
+    def delete_bus(self, name):
+        """Delete a bus from the Sequencer, along with all sends to it."""
+        self._buses.remove(self.get_bus(name))
+        for track in self.tracks():
+            track.send(name, None)
+
+    def add_group(self, name, tracks=(), effects=None, volume=0, pan=0):
+        '''
+        Add a group of Tracks to the Sequencer (see `wubwub.mixer.Group`).
+        The Tracks of the group are mixed into a submix, which is
+        postprocessed once and added to the mix.  The submix is cached
+        separately, so it is not rendered again when only other Tracks
+        change.
+
+        Parameters
+        ----------
+        name : str
+            Name of the group.
+        tracks : list-like, optional
+            Tracks (or their names) to put in the group. The default is
+            none; more can be added with `wubwub.mixer.Group.add()`.
+        effects : optional
+            Effects of the group (see `wubwub.effects`). The default is None.
+        volume : int or float, optional
+            Volume (in dB) of the group. The default is 0.
+        pan : float, optional
+            Panning of the group. The default is 0.
+
+        Returns
+        -------
+        group : wubwub.mixer.Group
+            The new group.
+
+        '''
+        if name in [group.name for group in self._groups]:
+            raise WubWubError(f'Group name "{name}" already in use.')
+        group = Group(name, self, effects=effects, volume=volume, pan=pan)
+        self._groups.append(group)
+        group.add(*tracks)
+        return group
+
+    def get_group(self, name):
+        """Return the group with a given name."""
+        try:
+            return next(group for group in self._groups if group.name == name)
+        except StopIteration:
+            raise ValueError(f'no group with name {name}')
+
+    def groups(self):
+        """Returns a tuple of the groups of this Sequencer."""
+        return tuple(self._groups)
+
+    def delete_group(self, name):
+        """Delete a group from the Sequencer; its Tracks are then mixed
+        directly."""
+        self._groups.remove(self.get_group(name))
+
     def add_sampler(self, sample, skew=None, skew_dir=None, name=None, overlap=False, basepitch='C4'):
         """
         Create a new `wubwub.tracks.Sampler` Track and add to the Sequencer.
@@ -407,8 +526,15 @@ class Sequencer:
 
         '''
         new = Sequencer(beats=self.beats, bpm=self.bpm)
+        new.tempo_changes = self.tempo_changes
+        new.groove = self.groove
+        for bus in self.buses():
+            new.add_bus(bus.name, bus.effects, bus.volume, bus.pan)
         for track in self.tracks():
             track.copy(with_notes=with_notes, newseq=new)
+        for group in self.groups():
+            new.add_group(group.name, [t.name for t in group.tracks()],
+                          group.effects, group.volume, group.pan)
         return new
 
     def split(self, beat):
@@ -473,8 +599,19 @@ class Sequencer:
 
         a = self.copy(with_notes=False)
         a.beats = a2 - a1
+        a.tempo_changes = tuple(p for p in self.tempo_changes if p[0] < beat)
+        # a ramp running past the split is closed on the split in a
+        ramp = next((p for p in self.tempo_changes if p[0] >= beat), None)
+        if ramp is not None and ramp[2] == 'linear':
+            bpm = ramp[1] if ramp[0] == beat else self.tempo_map().bpm_at(beat)
+            a.tempo_changes += ((beat, bpm, 'linear'),)
         b = self.copy(with_notes=False)
         b.beats = b2 - b1
+        # b starts at the tempo on the split, and keeps the later changes
+        if self.tempo_changes:
+            b.bpm = self.tempo_map().bpm_at(beat)
+        b.tempo_changes = tuple((p[0] - beat + 1,) + p[1:]
+                                for p in self.tempo_changes if p[0] > beat)
 
         for selftrack, atrack, btrack in zip(self.tracks(), a.tracks(), b.tracks()):
             anotes = selftrack.slice[a1:a2]
@@ -499,14 +636,18 @@ class Sequencer:
 
         """
         t = self.get_track(track)
+        for group in self.groups():
+            group.remove(t)
         t.sequencer = None
         self._tracks.remove(t)
 
-    def build(self, overhang=0, overhang_type='beats'):
+    def build(self, overhang=0, overhang_type='beats', quality='full',
+              start=1, end=None):
         '''
         Render all the contained Tracks into one output, namely a pydub
-        AudioSegment.  Calls the "build" method of each Track, and overlays
-        them.
+        AudioSegment.  This is the output of `Sequencer.render()`,
+        converted to an AudioSegment.  Use `start` and `end` to render
+        only a section of the Sequencer.
 
         Parameters
         ----------
@@ -519,6 +660,16 @@ class Sequencer:
             Sequencer.
         overhang_type : str -> "beats" or "seconds", optional
             Unit for the overhang. The default is 'beats'.
+        quality : str, dict, or wubwub.render.RenderQuality, optional
+            Render quality; see `wubwub.render.get_quality()`.  Use `'draft'`
+            for a fast, lower quality preview (22050 Hz, mono, with the
+            cheapest resampling and no effects). The default is 'full'.
+        start : int or float, optional
+            Beat to start rendering on. The default is 1.
+        end : int, float, or None, optional
+            Beat to end rendering on (exclusive). The default is None,
+            meaning the end of the Sequencer.  The overhang is added
+            after this beat.
 
         Returns
         -------
@@ -548,13 +699,337 @@ class Sequencer:
         ```
 
         '''
-        b = (1/self.bpm) * MINUTE
-        seq_oh = _overhang_to_milli(overhang, overhang_type, b)
-        tracklength = self.beats * b + seq_oh
-        audio = pydub.AudioSegment.silent(duration=tracklength)
-        for track in self.tracks():
-            audio = audio.overlay(track.build(overhang, overhang_type))
-        return self.postprocess(audio)
+        return self.render(overhang, overhang_type, quality=quality,
+                           start=start, end=end).to_audiosegment()
+
+    def render_rate(self):
+        """Returns the frame rate used for rendering the Sequencer."""
+        return max([t._render_rate() for t in self.tracks()] + [11025])
+
+    def render(self, overhang=0, overhang_type='beats', frame_rate=None,
+               quality='full', start=1, end=None):
+        '''
+        Render all the contained Tracks into a
+        `wubwub.render.SparseAudioBuffer`.  Each Track renders only the
+        section of the Sequencer where it produces sound, and these are mixed
+        into one shared buffer; no full-length audio is created for individual
+        Tracks, and no memory is used for silence.  Track postprocessing is
+        applied to each rendered section, and Sequencer postprocessing is
+        applied to the final mix.  The Tracks of each group (see
+        `Sequencer.add_group()`) are mixed into a submix, which is
+        postprocessed and added to the mix.  Audio sent to buses (see
+        `Sequencer.add_bus()`) is summed, and each bus is postprocessed once
+        and added to the mix.  Tracks which only use mono samples and
+        are not panned are mixed in mono, and converted to stereo once at
+        the end.  The rendering of each Track is cached, and only redone
+        for Tracks which have changed since the last call (see
+        `wubwub.tracks.Track.version`).  Likewise, the submix of each group
+        is only rendered again when one of its Tracks has changed.
+
+        When `start` or `end` are given, only that window of the Sequencer
+        is rendered: the notes which sound within it (including the tails
+        of notes started before it) are rendered, and all others are skipped.
+        Effects are only applied to the audio within the window.
+
+        Parameters
+        ----------
+        overhang : int or number, optional
+            How much extra time to render beyond the length
+            (i.e., the `beats`) of the Sequencer. The default is 0.
+        overhang_type : str -> "beats" or "seconds", optional
+            Unit for the overhang. The default is 'beats'.
+        frame_rate : int, optional
+            Frame rate of the rendering.  The default is None, in which case
+            it is determined by the `quality`, or else by the samples being
+            used (see `Sequencer.render_rate()`).
+        quality : str, dict, or wubwub.render.RenderQuality, optional
+            Render quality; see `wubwub.render.get_quality()`.  Use `'draft'`
+            for a fast, lower quality preview (22050 Hz, mono, with the
+            cheapest resampling and no effects). The default is 'full'.
+        start : int or float, optional
+            Beat to start rendering on. The default is 1.
+        end : int, float, or None, optional
+            Beat to end rendering on (exclusive). The default is None,
+            meaning the end of the Sequencer.  The overhang is added
+            after this beat.
+
+        Returns
+        -------
+        wubwub.render.SparseAudioBuffer
+            The rendered audio.
+
+        '''
+        lo, hi = self._window(overhang, overhang_type, start, end)
+        quality = get_quality(quality)
+        rate = frame_rate or quality.frame_rate or self.render_rate()
+        origin = ms_to_frames(lo, rate)
+        mix = SparseAudioBuffer(ms_to_frames(hi, rate) - origin, rate)
+        buses = self.buses()
+        sends = [None] * len(buses)
+        groups = self.groups()
+        params = (lo, hi, rate, quality)
+        submixes = [group._cached(params) for group in groups]
+        inputs = [None] * len(groups)
+        upmix = False
+        for track, g in zip(self.tracks(), group_routes(self)):
+            gains = send_gains(self, track)
+            upmix = upmix or 'pan' in track.postprocess_steps
+            if g is not None and submixes[g] is not None and not gains:
+                # already in the cached submix of its group
+                continue
+            # mono, centered tracks stay mono until the final mix
+            rendered, first = track._render_region(hi, rate, upmix=False,
+                                                   quality=quality, start=lo)
+            offset = ms_to_frames(first, rate) - origin
+            if g is None:
+                mix.mix(rendered, offset)
+            elif submixes[g] is None:
+                if inputs[g] is None:
+                    inputs[g] = SparseAudioBuffer(len(mix), rate)
+                inputs[g].mix(rendered, offset)
+            for i, gain in gains:
+                if sends[i] is None:
+                    sends[i] = SparseAudioBuffer(len(mix), rate)
+                sends[i].mix(rendered, offset, gain=gain)
+        for i, group in enumerate(groups):
+            if not group.tracks():
+                continue
+            if submixes[i] is None:
+                submixes[i] = postprocess_buffer(group, inputs[i], upmix=False,
+                                                 quality=quality)
+                group._store(params, submixes[i])
+            mix.mix(submixes[i])
+            upmix = upmix or 'pan' in group.postprocess_steps
+        # each bus is postprocessed once, for all the Tracks sending to it
+        for bus, audio in zip(buses, sends):
+            if audio is not None:
+                mix.mix(postprocess_buffer(bus, audio, upmix=False,
+                                           quality=quality))
+                upmix = upmix or 'pan' in bus.postprocess_steps
+        mix = postprocess_buffer(self, mix, quality=quality, start=origin,
+                                 automation=self._automation_curves(rate))
+        if upmix and not quality.mono:
+            mix.map(upmix_frames)
+        return mix
+
+    def iter_blocks(self, block_frames=BLOCK_FRAMES, overhang=0,
+                    overhang_type='beats', frame_rate=None, quality='full',
+                    start=1, end=None):
+        '''
+        Render the Sequencer as a stream of fixed-size blocks of audio, in
+        time order.  Each Track only keeps the notes sounding in the current
+        block in memory, so the memory used stays constant regardless of
+        the length of the Sequencer.  Joined together, the blocks are the
+        same as the output of `Sequencer.render()`.
+
+        The built-in effects of `wubwub.effects` are applied block by block,
+        but external effects (see `Sequencer.postprocess()`) need the whole
+        audio at once.  Tracks with external effects are therefore rendered
+        in full before streaming, and when the Sequencer itself (or one of
+        its buses or groups) has them, the whole Sequencer is rendered
+        first (use a `quality` without effects to avoid this).
+
+        Parameters
+        ----------
+        block_frames : int, optional
+            Number of frames in each block; the last block may be shorter.
+            The default is `wubwub.render.BLOCK_FRAMES`.
+        overhang : int or number, optional
+            How much extra time to render beyond the length
+            (i.e., the `beats`) of the Sequencer. The default is 0.
+        overhang_type : str -> "beats" or "seconds", optional
+            Unit for the overhang. The default is 'beats'.
+        frame_rate : int, optional
+            Frame rate of the rendering.  The default is None, in which case
+            it is determined by the `quality`, or else by the samples being
+            used (see `Sequencer.render_rate()`).
+        quality : str, dict, or wubwub.render.RenderQuality, optional
+            Render quality; see `wubwub.render.get_quality()`. The default
+            is 'full'.
+        start : int or float, optional
+            Beat to start rendering on. The default is 1.
+        end : int, float, or None, optional
+            Beat to end rendering on (exclusive). The default is None,
+            meaning the end of the Sequencer.
+
+        Yields
+        ------
+        block : wubwub.render.AudioBuffer
+            The rendered audio, block by block.  Use
+            `AudioBuffer.to_audiosegment()` to get a pydub AudioSegment.
+
+        Examples
+        --------
+        ```python
+        >>> import wubwub as wb
+
+        # 60 BPM == 1 second per beat
+        >>> seq = wb.Sequencer(beats=4, bpm=60)
+        >>> blocks = list(seq.iter_blocks(block_frames=11025, frame_rate=44100))
+        >>> len(blocks), len(blocks[0])
+        (16, 11025)
+        ```
+
+        '''
+        quality = get_quality(quality)
+        rate = frame_rate or quality.frame_rate or self.render_rate()
+        buses = self.buses()
+        routes = [send_gains(self, track) for track in self.tracks()]
+        used = sorted({i for route in routes for i, _ in route})
+        groups = self.groups()
+        outputs = group_routes(self)
+        grouped = sorted({g for g in outputs if g is not None})
+        if not all(streamable(owner, quality)
+                   for owner in [self] + [buses[i] for i in used] +
+                   [groups[g] for g in grouped]):
+            rendered = self.render(overhang, overhang_type, frame_rate=rate,
+                                   quality=quality, start=start, end=end)
+            yield from iter_buffer_blocks(rendered, 0, len(rendered),
+                                          block_frames)
+            return
+        lo, hi = self._window(overhang, overhang_type, start, end)
+        origin = ms_to_frames(lo, rate)
+        frames = ms_to_frames(hi, rate) - origin
+        curves = self._automation_curves(rate)
+        owner = with_fresh_effects(self)
+        streams = [track._iter_region(hi, rate, block_frames, upmix=False,
+                                      quality=quality, start=lo)
+                   for track in self.tracks()]
+        bus_owners = {i: with_fresh_effects(buses[i]) for i in used}
+        group_owners = {g: with_fresh_effects(groups[g]) for g in grouped}
+        upmix = (not quality.mono and
+                 any('pan' in owner.postprocess_steps for owner in
+                     list(self.tracks()) + [buses[i] for i in used] +
+                     [groups[g] for g in grouped]))
+        for pos in range(0, frames, block_frames):
+            n = min(block_frames, frames - pos)
+            mix = AudioBuffer(n, rate)
+            sends = {i: AudioBuffer(n, rate) for i in used}
+            submixes = {g: AudioBuffer(n, rate) for g in grouped}
+            for stream, route, g in zip(streams, routes, outputs):
+                block = next(stream)
+                (mix if g is None else submixes[g]).mix(block)
+                for i, gain in route:
+                    sends[i].mix(block, gain=gain)
+            for g in grouped:
+                mix.mix(postprocess_buffer(group_owners[g], submixes[g],
+                                           upmix=False, quality=quality,
+                                           stream=True))
+            for i in used:
+                mix.mix(postprocess_buffer(bus_owners[i], sends[i],
+                                           upmix=False, quality=quality,
+                                           stream=True))
+            mix = postprocess_buffer(owner, mix, quality=quality,
+                                     start=origin + pos, automation=curves,
+                                     stream=True)
+            if upmix:
+                mix.map(upmix_frames)
+            yield mix
+
+    def compile(self, overhang=0, overhang_type='beats', frame_rate=None,
+                quality='full', start=1, end=None, optimize=True):
+        '''
+        Compile the Sequencer into a `wubwub.plan.RenderPlan`: flat arrays
+        describing each note to be mixed (start frame, sample, pitch ratio,
+        gain, duration, fades, and Track), along with the samples and the
+        postprocessing settings.  The plan can be inspected, pickled, or
+        cached, and rendered later with different backends (serial,
+        threaded, process pool, or streaming); see
+        `wubwub.plan.RenderPlan.render()`.
+
+        The parameters are the same as for `Sequencer.render()`.  When
+        `optimize` is True (default), silent notes are dropped and identical
+        notes are merged; the number removed is reported by the
+        `removed` attribute of the plan.
+
+        Returns
+        -------
+        plan : wubwub.plan.RenderPlan
+            The compiled plan.
+
+        Examples
+        --------
+        ```python
+        >>> import wubwub as wb
+
+        >>> seq = wb.Sequencer(beats=4, bpm=60)
+        >>> plan = seq.compile(frame_rate=44100)
+        >>> plan
+        RenderPlan(events=0, tracks=0, frames=176400, frame_rate=44100, removed=0)
+
+        >>> audio = plan.render(backend='thread').to_audiosegment()
+        ```
+
+        '''
+        return compile_plan(self, overhang, overhang_type, frame_rate=frame_rate,
+                            quality=quality, start=start, end=end,
+                            optimize=optimize)
+
+    def _window(self, overhang=0, overhang_type='beats', start=1, end=None):
+        '''Return the span (in milliseconds) from beat `start` to beat `end`
+        plus the overhang.'''
+        end = self.beats + 1 if end is None else end
+        return self.tempo_map().window(start, end, overhang, overhang_type)
+
+    def set_tempo(self, points=None):
+        '''
+        Change the tempo of the Sequencer over time.  The tempo starts at
+        `bpm`, and changes at each breakpoint; all Tracks follow the tempo
+        changes, and the Sequencer is still rendered in one pass.  See
+        `wubwub.tempo`.
+
+        Parameters
+        ----------
+        points : dict or list-like, optional
+            Tempo breakpoints, as a dict mapping beats to tempos, or a list
+            of `(beat, bpm)` or `(beat, bpm, curve)`, where `curve` is
+            `'step'` (jump to the tempo on the beat, the default) or
+            `'linear'` (ramp to it from the previous breakpoint).  The
+            default is None, which removes all tempo changes.
+
+        Examples
+        --------
+        ```python
+        >>> import wubwub as wb
+
+        >>> seq = wb.Sequencer(bpm=100, beats=16)
+
+        # double time from beat 9, then slow down to 90 BPM by the end
+        >>> seq.set_tempo([(9, 200), (17, 90, 'linear')])
+        ```
+
+        '''
+        self.tempo_changes = () if points is None else tempo_points(points)
+
+    def tempo_map(self):
+        '''Return the `wubwub.tempo.TempoMap` of the Sequencer, which
+        converts its beats to time.'''
+        key = (self.bpm, self.tempo_changes)
+        cache = getattr(self, '_tempo_cache', None)
+        if cache is None or cache[0] != key:
+            cache = (key, TempoMap(self.bpm, self.tempo_changes))
+            self._tempo_cache = cache
+        return cache[1]
+
+    def automate(self, parameter, points=None):
+        '''
+        Automate the volume or pan of the Sequencer over time.  See
+        `wubwub.tracks.Track.automate()`.
+
+        Parameters
+        ----------
+        parameter : str -> 'volume' or 'pan'
+            Parameter to automate.
+        points : dict or list of pairs, optional
+            Breakpoints, mapping beats to values.  The default is None,
+            which removes the automation of `parameter`.
+
+        '''
+        self.automation = update_automation(self.automation, parameter, points)
+
+    def _automation_curves(self, frame_rate):
+        return automation_curves(self.automation, self.tempo_map(),
+                                 frame_rate)
 
     def postprocess(self, build):
         '''
@@ -603,7 +1078,8 @@ class Sequencer:
                 build = build.pan(self.pan)
         return build
 
-    def play(self, start=1, end=None, overhang=0, overhang_type='beats'):
+    def play(self, start=1, end=None, overhang=0, overhang_type='beats',
+             quality='full', stream=False):
         '''
         Audio playback of the Sequencer.
 
@@ -622,20 +1098,33 @@ class Sequencer:
             Sequencer.
         overhang_type : str -> "beats" or "seconds", optional
             Unit for the overhang. The default is 'beats'.
+        quality : str, dict, or wubwub.render.RenderQuality, optional
+            Render quality; see `wubwub.render.get_quality()`.  Use `'draft'`
+            for a fast, lower quality preview (22050 Hz, mono, with the
+            cheapest resampling and no effects). The default is 'full'.
+        stream : bool, optional
+            When True, the audio is rendered block by block while it plays
+            (see `Sequencer.iter_blocks()` and `wubwub.audio.play_blocks()`).
+            The default is False.
 
         Returns
         -------
         None.
 
         '''
-        b = (1/self.bpm) * MINUTE
-        start = (start-1) * b
         if end is not None:
-            end = (end-1) * b
-        build = self.build(overhang, overhang_type)
-        play(build[start:end])
-
-    def loop(self, times=4, internal_overhang=0, end_overhang=0, overhang_type='beats'):
+            overhang = 0
+        if stream:
+            play_blocks(self.iter_blocks(overhang=overhang,
+                                         overhang_type=overhang_type,
+                                         quality=quality, start=start, end=end))
+            return
+        build = self.build(overhang, overhang_type, quality=quality,
+                           start=start, end=end)
+        play(build)
+
+    def loop(self, times=4, internal_overhang=0, end_overhang=0, overhang_type='beats',
+             quality='full', start=1, end=None):
         '''
         Return a looped rendering of the Sequencer.  This is akin to
         `Sequencer.build()`, but the content of the Sequencer is repeated
@@ -655,6 +1144,15 @@ class Sequencer:
             i.e. after all loops are complete. The default is 0.
         overhang_type : str -> 'beats' or 'seconds', optional
             Units for the overhang. The default is 'beats'.
+        quality : str, dict, or wubwub.render.RenderQuality, optional
+            Render quality; see `wubwub.render.get_quality()`.  Use `'draft'`
+            for a fast, lower quality preview (22050 Hz, mono, with the
+            cheapest resampling and no effects). The default is 'full'.
+        start : int or float, optional
+            Beat to start each loop on. The default is 1.
+        end : int, float, or None, optional
+            Beat to end each loop on (exclusive). The default is None,
+            meaning the end of the Sequencer.
 
         Returns
         -------
@@ -663,14 +1161,27 @@ class Sequencer:
 
         '''
         looped = loop(self, times=times, internal_overhang=internal_overhang,
-                      end_overhang=end_overhang, overhang_type=overhang_type)
+                      end_overhang=end_overhang, overhang_type=overhang_type,
+                      quality=quality, start=start, end=end)
         return looped
 
-    def loopplay(self, times=4, internal_overhang=0, end_overhang=0, overhang_type='beats'):
+    def loopplay(self, times=4, internal_overhang=0, end_overhang=0, overhang_type='beats',
+                 quality='full', start=1, end=None, stream=False):
         '''Calls `Sequencer.play()` on `Sequencer.loop()`; i.e.
-        immediately plays back looped audio.'''
+        immediately plays back looped audio.  Only the window from
+        `start` to `end` is rendered and looped.  When `stream` is True,
+        each loop is rendered block by block while it plays, so any
+        number of loops can be played without holding them in memory.'''
+        if stream:
+            play_blocks(_iter_stitch([(self, start, end)] * times,
+                                     internal_overhang=internal_overhang,
+                                     end_overhang=end_overhang,
+                                     overhang_type=overhang_type,
+                                     quality=quality))
+            return
         looped = loop(self, times=times, internal_overhang=internal_overhang,
-                      end_overhang=end_overhang, overhang_type=overhang_type)
+                      end_overhang=end_overhang, overhang_type=overhang_type,
+                      quality=quality, start=start, end=end)
         play(looped)
 
     def soundtest(self, selection=None, postprocess=True, gap=.5):
@@ -690,7 +1201,10 @@ class Sequencer:
         '''
         Saves the rendered audio to a file.  The Sequencer creates
         a pydub AudioSegment which contains all Tracks overlaid,
-        and then uses its export method to save.
+        and then uses its export method to save.  WAV files are instead
+        written block by block as they are rendered
+        (see `Sequencer.iter_blocks()`), so long Sequencers can be exported
+        without holding all the audio in memory.
 
         See the pydub documentation for more information on exporting.
 
@@ -716,6 +1230,11 @@ class Sequencer:
         if fmt is None:
             _, fmt = os.path.splitext(path)
             fmt = fmt.lstrip('.')
+        if fmt == 'wav':
+            export_blocks(self.iter_blocks(overhang=overhang,
+                                           overhang_type=overhang_type),
+                          path, frame_rate=self.render_rate())
+            return
         build = self.build(overhang, overhang_type)
         build.export(path, format=fmt)
 
@@ -796,11 +1315,16 @@ class Sequencer:
                              plot_kwds=plot_kwds)
 
 
-def stitch(sequencers, internal_overhang=0, end_overhang=0, overhang_type='beats'):
+def stitch(sequencers, internal_overhang=0, end_overhang=0, overhang_type='beats',
+           quality='full'):
     """
     Take a list of Sequencers, and concatenate the audio produced by each one.
     A pydub `AudioSegment` is returned, which is the concatenation of
-    the outputs of each Sequencer's `build()` method.
+    the outputs of each Sequencer's `build()` method.  The sections are
+    mixed sparsely (see `Sequencer.render()`), and only converted into
+    one full AudioSegment at the end.  Sequencers which are repeated in
+    `sequencers` are only rendered once, and their audio is copied to each
+    position.
 
     Parameters
     ----------
@@ -816,6 +1340,9 @@ def stitch(sequencers, internal_overhang=0, end_overhang=0, overhang_type='beats
         i.e. after all loops are complete. The default is 0.
     overhang_type : str -> 'beats' or 'seconds', optional
         Units for the overhang. The default is 'beats'.
+    quality : str, dict, or wubwub.render.RenderQuality, optional
+        Render quality; see `wubwub.render.get_quality()`. The default
+        is 'full'.
 
     Returns
     -------
@@ -842,23 +1369,99 @@ def stitch(sequencers, internal_overhang=0, end_overhang=0, overhang_type='beats
     ```
 
     """
+    sections = [(seq, 1, None) for seq in sequencers]
+    return _stitch(sections, internal_overhang=internal_overhang,
+                   end_overhang=end_overhang, overhang_type=overhang_type,
+                   quality=quality)
+
+def _stitch(sections, internal_overhang=0, end_overhang=0, overhang_type='beats',
+            quality='full'):
+    '''Helper for `stitch()`; concatenates `(sequencer, start, end)`
+    sections, where each section is the window of the Sequencer from
+    beat `start` to beat `end` (None for the end of the Sequencer).'''
+    sectionstarts, total_length = _stitch_layout(sections, end_overhang,
+                                                 overhang_type)
+    quality = get_quality(quality)
+    rate = quality.frame_rate or max([seq.render_rate() for seq, _, _ in sections]
+                                     + [11025])
+    stitched = SparseAudioBuffer(ms_to_frames(total_length, rate), rate)
+    # repeated sections are rendered once, and tiled
+    renders = {}
+    for sectionstart, (seq, start, end) in zip(sectionstarts, sections):
+        key = (id(seq), start, end)
+        if key not in renders:
+            renders[key] = seq.render(internal_overhang, overhang_type,
+                                      frame_rate=rate, quality=quality,
+                                      start=start, end=end)
+        stitched.mix(renders[key], ms_to_frames(sectionstart, rate))
+
+    return stitched.to_audiosegment()
+
+def _stitch_layout(sections, end_overhang=0, overhang_type='beats'):
+    '''Helper for stitching; returns the start of each section, and the
+    total length (in milliseconds).'''
     total_length = 0
     current = 0
     sectionstarts = []
-    for seq in sequencers:
-        b = (1/seq.bpm) * MINUTE
-        seq_length = b * seq.beats
+    for seq, start, end in sections:
+        end = seq.beats + 1 if end is None else end
+        b = seq.tempo_map().ms_per_beat(end)
+        seq_length = seq.tempo_map().duration(start, end - start)
         total_length += seq_length
         sectionstarts.append(current)
         current += seq_length
     total_length += _overhang_to_milli(end_overhang, overhang_type, b)
-
-    stitched = pydub.AudioSegment.silent(duration=total_length)
-    for start, seq in zip(sectionstarts, sequencers):
-        build = seq.build(internal_overhang, overhang_type)
-        stitched = stitched.overlay(build, start)
-
-    return stitched
+    return sectionstarts, total_length
+
+def _iter_stitch(sections, internal_overhang=0, end_overhang=0, overhang_type='beats',
+                 quality='full', block_frames=BLOCK_FRAMES):
+    '''Streaming version of `_stitch()`, yielding the stitched audio as
+    `wubwub.render.AudioBuffer` blocks.  Each section is rendered with
+    `Sequencer.iter_blocks()`, and only while it is sounding.  Sections
+    which repeat are instead rendered once (see `Sequencer.render()`), and
+    kept until their last repetition starts.'''
+    sectionstarts, total_length = _stitch_layout(sections, end_overhang,
+                                                 overhang_type)
+    quality = get_quality(quality)
+    rate = quality.frame_rate or max([seq.render_rate() for seq, _, _ in sections]
+                                     + [11025])
+    total = ms_to_frames(total_length, rate)
+    pending = [(ms_to_frames(sectionstart, rate), section)
+               for sectionstart, section in zip(sectionstarts, sections)]
+    remaining = Counter((id(seq), start, end) for seq, start, end in sections)
+    renders = {}
+    active = []
+    channels = 1
+    i = 0
+    for pos in range(0, total, block_frames):
+        n = min(block_frames, total - pos)
+        while i < len(pending) and pending[i][0] < pos + n:
+            offset, (seq, start, end) = pending[i]
+            key = (id(seq), start, end)
+            if key not in renders and remaining[key] == 1:
+                blocks = seq.iter_blocks(block_frames, internal_overhang,
+                                         overhang_type, frame_rate=rate,
+                                         quality=quality, start=start, end=end)
+            else:
+                if key not in renders:
+                    renders[key] = seq.render(internal_overhang, overhang_type,
+                                              frame_rate=rate, quality=quality,
+                                              start=start, end=end).to_dense()
+                rendered = renders[key]
+                blocks = iter_buffer_blocks(rendered, 0, len(rendered),
+                                            block_frames)
+            remaining[key] -= 1
+            if not remaining[key]:
+                renders.pop(key, None)
+            active.append((offset, _BlockReader(blocks)))
+            i += 1
+        # blocks keep the most channels seen so far, e.g. for silent gaps
+        mix = AudioBuffer(n, rate, channels=channels)
+        active = [(offset, reader) for offset, reader in active
+                  if reader.mix_into(mix, pos + n - max(pos, offset),
+                                     max(offset - pos, 0))]
+        channels = mix.channels
+        yield mix
 
 def _matchesforjoin(oldtracks, newtrack, on='name'):
     '''Helper method for joining two Sequencers.  Given a list of tracks
@@ -905,11 +1508,18 @@ def join(sequencers, on='name'):
     '''
     beats = sum(seq.beats for seq in sequencers)
     out = Sequencer(bpm=sequencers[0].bpm, beats=beats)
+    # buses and groups are merged by name, like Tracks
+    groups = {}
     offset = 0
     for i, seq in enumerate(sequencers):
         oldtracks = out.tracks()
         available = list(oldtracks)
 
+        for bus in seq.buses():
+            if bus.name not in [b.name for b in out.buses()]:
+                out.add_bus(bus.name, bus.effects, bus.volume, bus.pan)
+
+        joined = {}
         for track in seq.tracks():
             match = None
             matches = _matchesforjoin(available, track, on=on)
@@ -919,20 +1529,36 @@ def join(sequencers, on='name'):
 
             if match:
                 match.add_fromdict(track.notedict, offset=offset)
+                joined[track.name] = match
 
             else:
                 new = track.copy(with_notes=False, newseq=out)
                 new.add_fromdict(track.notedict, offset=offset)
+                joined[track.name] = new
 
+        for group in seq.groups():
+            if group.name not in groups:
+                groups[group.name] = (group, [])
+            groups[group.name][1].extend(joined[t.name]
+                                         for t in group.tracks())
 
         offset = seq.beats
+
+    for group, tracks in groups.values():
+        out.add_group(group.name, list(dict.fromkeys(tracks)), group.effects,
+                      group.volume, group.pan)
     return out
 
-def loop(sequencer, times=4, internal_overhang=0, end_overhang=0, overhang_type='beats'):
+def loop(sequencer, times=4, internal_overhang=0, end_overhang=0, overhang_type='beats',
+         quality='full', start=1, end=None):
     '''Calls `stitch()` on one Sequencer multiple times, to create a looped
-    AudioSegment.'''
-
-    return stitch([sequencer] * times,
-                  internal_overhang,
-                  end_overhang,
-                  overhang_type)
+    AudioSegment.  The Sequencer is only rendered once, and its audio is
+    tiled (with any internal overhang mixed across the loop boundaries).
+    Use `start` and `end` to loop only a window of the Sequencer
+    (see `Sequencer.render()`).'''
+
+    return _stitch([(sequencer, start, end)] * times,
+                   internal_overhang,
+                   end_overhang,
+                   overhang_type,
+                   quality)
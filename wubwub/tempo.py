@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tempo maps, for Sequencers whose tempo changes over time.
+
+By default a Sequencer plays at a single tempo (its `bpm`).  Tempo changes
+are added with `wubwub.sequencer.Sequencer.set_tempo()`, as breakpoints
+which either jump to a new tempo (`'step'`) or ramp to it from the previous
+breakpoint (`'linear'`).  The Sequencer then converts beats to time with a
+`TempoMap`, so notes, windows, and automation all follow the tempo changes,
+and the Sequencer is still rendered in a single pass.
+
+```python
+>>> import wubwub as wb
+
+>>> seq = wb.Sequencer(bpm=120, beats=16)
+
+# speed up to 140 BPM over the first 8 beats, then drop back to 120
+>>> seq.set_tempo([(9, 140, 'linear'), (13, 120)])
+>>> tempo = seq.tempo_map()
+>>> tempo.bpm_at([1, 5, 9, 13])
+array([120., 130., 140., 120.])
+```
+"""
+
+from bisect import bisect_right
+import math
+
+import numpy as np
+
+from wubwub.audio import _overhang_to_milli
+from wubwub.errors import WubWubError
+from wubwub.resources import MINUTE
+
+__all__ = ['TempoMap']
+
+CURVES = ['step', 'linear']
+"""Options for the curve of a tempo breakpoint."""
+
+def tempo_points(points):
+    '''Normalize tempo breakpoints into a tuple of `(beat, bpm, curve)`,
+    sorted by beat (breakpoints on the same beat keep their order).
+    `points` is a dict mapping beats to tempos (steps), or a list of
+    `(beat, bpm)` or `(beat, bpm, curve)`.'''
+    if isinstance(points, dict):
+        points = points.items()
+    normalized = []
+    for point in points:
+        beat, bpm, *curve = point
+        curve = curve[0] if curve else 'step'
+        if curve not in CURVES:
+            raise WubWubError(f'tempo curve must be one of {CURVES}, '
+                              f'not "{curve}"')
+        if beat < 1:
+            raise WubWubError('Tempo breakpoints must be on beat 1 or later.')
+        if bpm <= 0:
+            raise WubWubError('Tempos must be positive.')
+        normalized.append((float(beat), float(bpm), curve))
+    return tuple(sorted(normalized, key=lambda p: p[0]))
+
+class TempoMap:
+    '''
+    Conversion between beats and time (in milliseconds from beat 1) for a
+    tempo which changes over time.  The time at each breakpoint is
+    precomputed, so converting a beat only needs a binary search for its
+    section and a closed-form integral over it; arrays of beats are
+    converted at once.  Tempos before beat 1 and after the last breakpoint
+    are held constant.
+
+    Parameters
+    ----------
+    bpm : int or float
+        Tempo on beat 1.
+    points : dict or list-like, optional
+        Tempo breakpoints, as a dict mapping beats to tempos, or a list of
+        `(beat, bpm)` or `(beat, bpm, curve)`.  The `curve` is either
+        `'step'` (default), where the tempo jumps to `bpm` on `beat`, or
+        `'linear'`, where it ramps there from the previous breakpoint.
+
+    '''
+
+    def __init__(self, bpm, points=()):
+        self.bpm = bpm
+        self.points = tempo_points(points)
+        knots = [1.0]
+        tempos = [float(bpm)]
+        slopes = []
+        for beat, tempo, curve in self.points:
+            if beat == knots[-1]:
+                # a change on a breakpoint replaces the tempo from there;
+                # a ramp ending there keeps its slope, so ramping to a
+                # tempo and then stepping to another on the same beat
+                # plays both
+                tempos[-1] = tempo
+                continue
+            slopes.append((tempo - tempos[-1]) / (beat - knots[-1])
+                          if curve == 'linear' else 0.0)
+            knots.append(beat)
+            tempos.append(tempo)
+        slopes.append(0.0)
+        self._knots = knots
+        self._tempos = tempos
+        self._slopes = slopes
+        self._ms = [0.0]
+        for i in range(len(knots) - 1):
+            self._ms.append(self._ms[-1] + self._integral(
+                tempos[i], slopes[i], knots[i + 1] - knots[i]))
+        self._arrays = [np.array(a) for a in
+                        (knots, tempos, slopes, self._ms)]
+
+    def __repr__(self):
+        return f'TempoMap(bpm={self.bpm}, points={list(self.points)})'
+
+    def is_constant(self):
+        '''Return True when the tempo never changes.'''
+        return len(self._knots) == 1
+
+    @staticmethod
+    def _integral(tempo, slope, beats):
+        '''Time (ms) taken by `beats` beats, starting at `tempo` and
+        changing by `slope` BPM per beat.'''
+        if slope == 0:
+            return beats * ((1/tempo) * MINUTE)
+        return MINUTE / slope * math.log1p(slope * beats / tempo)
+
+    def _section(self, beats):
+        '''Return the section of each beat, and the offset into it.'''
+        knots = self._arrays[0]
+        i = np.maximum(np.searchsorted(knots, beats, 'right') - 1, 0)
+        return i, beats - knots[i]
+
+    def ms(self, beats):
+        '''
+        Convert beats into milliseconds (from the start of beat 1).
+
+        Parameters
+        ----------
+        beats : number or array-like
+            Beats to convert.
+
+        Returns
+        -------
+        float or numpy.ndarray
+            The time of each beat.
+
+        '''
+        if np.ndim(beats) == 0:
+            if self.is_constant():
+                return (beats - 1) * ((1/self.bpm) * MINUTE)
+            i = max(bisect_right(self._knots, beats) - 1, 0)
+            offset = beats - self._knots[i]
+            slope = self._slopes[i] if offset > 0 else 0
+            return self._ms[i] + self._integral(self._tempos[i], slope,
+                                                offset)
+        beats = np.asarray(beats, dtype=np.float64)
+        if self.is_constant():
+            return (beats - 1) * ((1/self.bpm) * MINUTE)
+        _, tempos, slopes, ms = self._arrays
+        i, offset = self._section(beats)
+        slope = np.where(offset > 0, slopes[i], 0)
+        tempo = tempos[i]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ramp = MINUTE / slope * np.log1p(slope * offset / tempo)
+        return ms[i] + np.where(slope == 0, offset * ((1/tempo) * MINUTE),
+                                ramp)
+
+    def beats(self, ms):
+        '''Convert milliseconds (from the start of beat 1) into beats; the
+        inverse of `TempoMap.ms()`.'''
+        ms = np.asarray(ms, dtype=np.float64)
+        knots, tempos, slopes, table = self._arrays
+        i = np.maximum(np.searchsorted(table, ms, 'right') - 1, 0)
+        offset = ms - table[i]
+        slope = np.where(offset > 0, slopes[i], 0)
+        tempo = tempos[i]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ramp = tempo / slope * np.expm1(slope * offset / MINUTE)
+        beats = knots[i] + np.where(slope == 0,
+                                    offset / ((1/tempo) * MINUTE), ramp)
+        return beats if beats.ndim else float(beats)
+
+    def bpm_at(self, beats):
+        '''Return the tempo on each of `beats`.'''
+        _, tempos, slopes, _ = self._arrays
+        i, offset = self._section(np.asarray(beats, dtype=np.float64))
+        tempo = tempos[i] + slopes[i] * np.maximum(offset, 0)
+        return tempo if tempo.ndim else float(tempo)
+
+    def ms_per_beat(self, beat):
+        '''Return the length of one beat (in milliseconds) at the tempo on
+        `beat`.'''
+        if self.is_constant():
+            return (1/self.bpm) * MINUTE
+        return (1/self.bpm_at(beat)) * MINUTE
+
+    def duration(self, beat, length):
+        '''Return the time (in milliseconds) taken by `length` beats from
+        `beat`.'''
+        if self.is_constant():
+            return length * ((1/self.bpm) * MINUTE)
+        return self.ms(beat + length) - self.ms(beat)
+
+    def window(self, start, end, overhang=0, overhang_type='beats'):
+        '''Return the span (in milliseconds) from beat `start` to beat
+        `end`, plus an overhang (in beats, at the tempo on `end`, or in
+        seconds).'''
+        overhang = _overhang_to_milli(overhang, overhang_type,
+                                      self.ms_per_beat(end))
+        return self.ms(start), self.ms(end) + overhang
@@ -9,7 +9,7 @@ Audio track classes for Sequencers in wubwub.
 
 from abc import ABCMeta, abstractmethod
 from collections.abc import Iterable
-from collections import defaultdict
+from collections import Counter, defaultdict, namedtuple
 import copy
 from fractions import Fraction
 import itertools
@@ -24,12 +24,22 @@ import numpy as np
 import pydub
 from sortedcontainers import SortedDict
 
-from wubwub.audio import add_note_to_audio, add_effects, play, _overhang_to_milli
+from wubwub.audio import add_effects, play
 from wubwub.errors import WubWubError, WubWubWarning
+from wubwub.intervals import IntervalIndex
 from wubwub.notes import ArpChord, Chord, Note, arpeggiate, _notetypes_
 from wubwub.plots import trackplot, pianoroll
-from wubwub.resources import random_choice_generator, MINUTE, SECOND
+from wubwub.render import (SHIFT_RATE, automation_curves, cut_overlaps,
+                           get_quality, iter_buffer_blocks, iter_voice_blocks,
+                           limit_voices, ms_to_frames, postprocess_buffer,
+                           render_bounds, render_voices, sample_loop,
+                           streamable, update_automation, uses_effects,
+                           voice_end, voice_from_note, with_fresh_effects)
+from wubwub.resources import random_choice_generator, SECOND
 
+# the last rendering of a Track; see Track._render_region()
+_BuildCache = namedtuple('_BuildCache', ['params', 'version', 'rendered',
+                                         'first', 'voices', 'channels'])
 
 
 class SliceableDict:
@@ -66,6 +76,11 @@ class Track(metaclass=ABCMeta):
     handle_outside_notes = 'skip'
 
     def __init__(self, name, sequencer,):
+        self._version = 0
+        self._build_cache = None
+        self._index_cache = None
+        self._dirty = None
+
         self.notedict = SortedDict()
         self.samplepath = None
 
@@ -73,6 +88,9 @@ class Track(metaclass=ABCMeta):
         self.volume = 0
         self.pan = 0
         self.postprocess_steps = ['effects', 'volume', 'pan']
+        self.automation = {}
+        self.sends = {}
+        self.groove = None
 
         self._name = None
         self._sample = None
@@ -82,6 +100,32 @@ class Track(metaclass=ABCMeta):
 
         self.plotting = {}
 
+    def __setattr__(self, name, value):
+        # any change to the Track invalidates its cached rendering
+        if name not in ('_version', '_build_cache', '_index_cache', '_dirty'):
+            self._touch()
+        object.__setattr__(self, name, value)
+
+    def _touch(self, lo=None, hi=None):
+        '''Mark the Track as changed (see `Track.version`).  When only the
+        notes from beat `lo` to `hi` were edited, the range is recorded so
+        that only that part of the Track is rendered again.'''
+        object.__setattr__(self, '_version', getattr(self, '_version', 0) + 1)
+        dirty = getattr(self, '_dirty', None)
+        if lo is None or dirty is None:
+            object.__setattr__(self, '_dirty', None)
+        else:
+            dirty.append((lo, hi))
+
+    @property
+    def version(self):
+        '''A stamp which changes whenever the Track is modified, through
+        setting attributes (samples, effects, volume, pan, etc.), editing
+        notes with Track methods, or changing the tempo/length of the
+        Sequencer.  Used to decide when the cached rendering of the Track
+        must be redone.'''
+        return self._version
+
     def __getitem__(self, beat):
         if isinstance(beat, Number):
             return self.notedict[beat]
@@ -152,6 +196,7 @@ class Track(metaclass=ABCMeta):
             raise WubWubError('Index wubwub.Track with [beat], '
                               '[start:stop], or boolean index, '
                               f'not {type(beat)}')
+        self._touch()
 
     @property
     def slice(self):
@@ -215,6 +260,7 @@ class Track(metaclass=ABCMeta):
         if existing and merge:
             element = existing + element
         self.notedict[beat] = element
+        self._touch(beat, beat)
 
     def add_fromdict(self, d, offset=0, outsiders=None, merge=False):
         for beat, element in d.items():
@@ -238,6 +284,8 @@ class Track(metaclass=ABCMeta):
                 setattr(new, k, newname)
             elif k == '_sequencer':
                 setattr(new, k, None)
+            elif k in ('_build_cache', '_index_cache'):
+                setattr(new, k, None)
             else:
                 setattr(new, k, copy.deepcopy(v))
         new.sequencer = newseq
@@ -279,6 +327,7 @@ class Track(metaclass=ABCMeta):
             closest = targets[argmin]
             if b != closest:
                 del self.notedict[b]
+                self._touch(b, b)
                 self.add(closest, note, merge=merge)
 
     def shift(self, beats, by, merge=False):
@@ -286,13 +335,127 @@ class Track(metaclass=ABCMeta):
         newkeys = [k + by if k in beats else k
                    for k in self.notedict.keys()]
         oldnotes = self.notedict.values()
-        self.delete_all_notes()
+        self.delete_all()
         for newbeat, note in zip(newkeys, oldnotes):
             self.add(newbeat, note, merge=merge)
 
     def get_bpm(self):
         return self.sequencer.bpm
 
+    def get_tempo(self):
+        '''Return the `wubwub.tempo.TempoMap` of the Sequencer, which
+        converts beats to time.'''
+        return self.sequencer.tempo_map()
+
+    def automate(self, parameter, points=None):
+        '''
+        Automate the volume or pan of the Track over time.  The value is
+        interpolated linearly between breakpoints (and held before the
+        first and after the last), and added to the `volume` (in dB) or
+        `pan` of the Track.  The automation is applied for every frame of
+        the rendering, in the `'volume'` and `'pan'` postprocessing steps.
+
+        Parameters
+        ----------
+        parameter : str -> 'volume' or 'pan'
+            Parameter to automate.
+        points : dict or list of pairs, optional
+            Breakpoints, mapping beats to values.  The default is None,
+            which removes the automation of `parameter`.
+
+        Examples
+        --------
+        ```python
+        >>> import wubwub as wb
+
+        >>> seq = wb.Sequencer(bpm=120, beats=16)
+        >>> synth = seq.add_sampler('my_synth.wav', name='synth')
+
+        # fade in over 4 beats, and sweep from left to right
+        >>> synth.automate('volume', {1: -60, 5: 0})
+        >>> synth.automate('pan', [(1, -1), (17, 1)])
+        ```
+
+        '''
+        self.automation = update_automation(self.automation, parameter, points)
+
+    def _automation_curves(self, frame_rate):
+        return automation_curves(self.automation, self.get_tempo(), frame_rate)
+
+    def get_groove(self):
+        '''Return the `wubwub.groove.Groove` applied to the Track when
+        rendering: its own `groove`, or else that of the Sequencer.'''
+        if self.groove is not None:
+            return self.groove
+        return self.sequencer.groove
+
+    def _apply_groove(self, voices):
+        '''Apply the groove of the Track (see `Track.get_groove()`) to
+        scheduled Voices.'''
+        groove = self.get_groove()
+        if groove is None:
+            return voices
+        return groove.apply(voices, self.get_tempo())
+
+    def _voice_index(self):
+        '''Return the `wubwub.intervals.IntervalIndex` of the scheduled
+        Voices (with the groove applied), over the time (in milliseconds)
+        each one sounds.  It is cached until the Track changes.'''
+        cache = self._index_cache
+        if cache is None or cache[0] != self._version:
+            voices = self.schedule()
+            index = IntervalIndex([v.position for v in voices],
+                                  [voice_end(v) for v in voices], voices)
+            self._index_cache = cache = (self._version, index)
+        return cache[1]
+
+    def sounding(self, beat, end=None):
+        '''
+        Return the Voices (see `wubwub.render.Voice`) of the Track which are
+        sounding at a beat, or within a range of beats.  This uses an
+        interval index of the scheduled notes, so it does not scan the
+        whole Track.
+
+        Parameters
+        ----------
+        beat : int or float
+            Beat to query.
+        end : int or float, optional
+            When given, return the Voices sounding at any point from `beat`
+            to `end` (exclusive). The default is None.
+
+        Returns
+        -------
+        list of wubwub.render.Voice
+            The Voices, in the order they are scheduled.
+
+        '''
+        tempo = self.get_tempo()
+        if end is None:
+            return self._voice_index().at(tempo.ms(beat))
+        return self._voice_index().overlapping(tempo.ms(beat), tempo.ms(end))
+
+    def send(self, bus, level=0):
+        '''
+        Send the (postprocessed) audio of the Track to a bus of its
+        Sequencer (see `wubwub.mixer`).  The Track is still mixed as usual;
+        the bus receives a copy.
+
+        Parameters
+        ----------
+        bus : str or wubwub.mixer.Bus
+            The bus, or its name.
+        level : int or float, optional
+            Level (in dB) of the audio sent. The default is 0.  Use None
+            to remove the send.
+
+        '''
+        name = getattr(bus, 'name', bus)
+        if level is None:
+            self.sends.pop(name, None)
+        else:
+            self.sends[name] = level
+
     def get_beats(self):
         return self.sequencer.beats
 
@@ -319,10 +482,12 @@ class Track(metaclass=ABCMeta):
         beats = self._handle_beats_dict_boolarray(beats)
         for beat in beats:
             del self.notedict[beat]
+            self._touch(beat, beat)
 
     def delete_fromrange(self, lo, hi):
-        self.notedict = SortedDict({b:note for b, note in self.notedict.items()
-                                    if not lo <= b < hi})
+        for b in list(self.notedict.irange(lo, hi, inclusive=(True, False))):
+            del self.notedict[b]
+        self._touch(lo, hi)
 
     def unpack_notes(self, start=0, stop=np.inf,):
         unpacked = []
@@ -337,9 +502,153 @@ class Track(metaclass=ABCMeta):
         return unpacked
 
     @abstractmethod
-    def build(self, overhang=0, overhang_type='beats'):
+    def schedule(self):
         pass
 
+    def _render_rate(self):
+        return SHIFT_RATE
+
+    def _render_region(self, stop, frame_rate, upmix=True, quality='full',
+                       start=0):
+        quality = get_quality(quality)
+        # the last rendering is reused until the Track changes
+        params = (tuple(self.postprocess_steps), stop, frame_rate, upmix,
+                  quality, start)
+        cache = self._build_cache
+        if cache is not None and cache.params == params:
+            if cache.version == self._version:
+                return cache.rendered, cache.first
+        voices = self._voice_index().overlapping(start, stop)
+        channels = 1 if quality.mono else max([v.sample.channels for v in voices],
+                                              default=1)
+        if (cache is not None and cache.params == params
+            and self._dirty is not None and not uses_effects(self, quality)
+            and self._splice_region(voices, channels)):
+            return cache.rendered, cache.first
+        first, last = render_bounds(voices) or (start, start)
+        if uses_effects(self, quality):
+            last = stop
+        first = max(first, start)
+        last = max(min(last, stop), first)
+        rendered = render_voices(voices, last - first, frame_rate=frame_rate,
+                                 origin=first, sparse=True, mono=quality.mono,
+                                 resample=quality.resample)
+        rendered = postprocess_buffer(self, rendered, upmix=upmix,
+                                      quality=quality,
+                                      start=ms_to_frames(first, frame_rate),
+                                      automation=self._automation_curves(frame_rate))
+        self._build_cache = _BuildCache(params, self._version, rendered, first,
+                                        voices, channels)
+        self._dirty = []
+        return rendered, first
+
+    def _splice_region(self, voices, channels):
+        '''Update the cached rendering after notes were edited, only
+        rendering again the time where the scheduled Voices changed (and
+        the beat ranges edited).  Returns False if the whole region
+        must be rendered instead.'''
+        cache = self._build_cache
+        _, stop, rate, upmix, quality, start = cache.params
+        rendered = cache.rendered
+        origin = ms_to_frames(cache.first, rate)
+        bounds = render_bounds(voices)
+        if channels != cache.channels:
+            return False
+        if bounds is not None:
+            lo = ms_to_frames(max(bounds[0], start), rate) - origin
+            hi = ms_to_frames(min(bounds[1], stop), rate) - origin
+            if lo < 0 or hi > len(rendered):
+                return False
+
+        # the schedules are compared as multisets, so identical Voices
+        # (e.g. a Note doubled in a Chord) are counted
+        def key(voice):
+            return voice._replace(sample=id(voice.sample))
+        old = {key(v): v for v in cache.voices}
+        new = {key(v): v for v in voices}
+        old_counts = Counter(key(v) for v in cache.voices)
+        new_counts = Counter(key(v) for v in voices)
+        changed = ([old[k] for k in (old_counts - new_counts).elements()] +
+                   [new[k] for k in (new_counts - old_counts).elements()])
+        tempo = self.get_tempo()
+        spans = [(v.position, voice_end(v)) for v in changed]
+        # edited beats are covered up to the end of the Voices there
+        for lo, hi in self._dirty:
+            a, z = tempo.ms(lo), tempo.ms(hi)
+            ends = [voice_end(v) for v in cache.voices + voices
+                    if a <= v.position <= z]
+            spans.append((a, max(ends + [z])))
+
+        # merge the changed spans into frame intervals of the region
+        intervals = []
+        for a, z in sorted(spans):
+            f0 = max(ms_to_frames(a, rate) - origin - 1, 0)
+            f1 = min(ms_to_frames(z, rate) - origin + 2, len(rendered))
+            if f1 <= f0:
+                continue
+            if intervals and f0 <= intervals[-1][1]:
+                intervals[-1][1] = max(intervals[-1][1], f1)
+            else:
+                intervals.append([f0, f1])
+
+        curves = self._automation_curves(rate)
+        for f0, f1 in intervals:
+            a = (origin + f0) * 1000 / rate
+            z = (origin + f1) * 1000 / rate
+            sounding = self._voice_index().overlapping(max(a, start),
+                                                       min(z, stop))
+            block = next(iter_voice_blocks(sounding, origin + f0, f1 - f0, rate,
+                                           channels=channels,
+                                           block_frames=f1 - f0,
+                                           resample=quality.resample))
+            block = postprocess_buffer(self, block, upmix=upmix,
+                                       quality=quality, start=origin + f0,
+                                       automation=curves)
+            rendered.write(block.data, f0)
+        self._build_cache = cache._replace(version=self._version,
+                                           voices=voices)
+        self._dirty = []
+        return True
+
+    def _iter_region(self, stop, frame_rate, block_frames, upmix=True,
+                     quality='full', start=0):
+        quality = get_quality(quality)
+        origin = ms_to_frames(start, frame_rate)
+        frames = ms_to_frames(stop, frame_rate) - origin
+        if not streamable(self, quality):
+            # effects need contiguous audio, so the region is rendered whole
+            rendered, first = self._render_region(stop, frame_rate,
+                                                  upmix=upmix, quality=quality,
+                                                  start=start)
+            offset = ms_to_frames(first, frame_rate) - origin
+            yield from iter_buffer_blocks(rendered, offset, frames,
+                                          block_frames)
+            return
+        voices = self._voice_index().overlapping(start, stop)
+        channels = 1 if quality.mono else max([v.sample.channels for v in voices],
+                                              default=1)
+        curves = self._automation_curves(frame_rate)
+        owner = with_fresh_effects(self)
+        pos = origin
+        for block in iter_voice_blocks(voices, origin, frames, frame_rate,
+                                       channels=channels,
+                                       block_frames=block_frames,
+                                       resample=quality.resample):
+            yield postprocess_buffer(owner, block, upmix=upmix, quality=quality,
+                                     start=pos, automation=curves, stream=True)
+            pos += len(block)
+
+    def build(self, overhang=0, overhang_type='beats', quality='full',
+              start=1, end=None):
+        end = self.get_beats() + 1 if end is None else end
+        lo, hi = self.get_tempo().window(start, end, overhang, overhang_type)
+        rate = get_quality(quality).frame_rate or self._render_rate()
+        rendered, first = self._render_region(hi, rate, quality=quality,
+                                              start=lo)
+        offset = ms_to_frames(first, rate) - ms_to_frames(lo, rate)
+        total = ms_to_frames(hi, rate) - ms_to_frames(lo, rate)
+        return rendered.to_audiosegment(start=offset, total=total)
+
     def postprocess(self, build):
         for step in self.postprocess_steps:
             if step == 'effects':
@@ -350,13 +659,13 @@ class Track(metaclass=ABCMeta):
                 build = build.pan(self.pan)
         return build
 
-    def play(self, start=1, end=None, overhang=0, overhang_type='beats'):
-        b = (1/self.get_bpm()) * MINUTE
-        start = (start-1) * b
+    def play(self, start=1, end=None, overhang=0, overhang_type='beats',
+             quality='full'):
         if end is not None:
-            end = (end-1) * b
-        build = self.build(overhang, overhang_type)
-        play(build[start:end])
+            overhang = 0
+        build = self.build(overhang, overhang_type, quality=quality,
+                           start=start, end=end)
+        play(build)
 
     @abstractmethod
     def soundtest(self, duration=None, postprocess=True,):
@@ -378,6 +687,18 @@ class Track(metaclass=ABCMeta):
 class SamplerLikeTrack(Track):
     def __init__(self, name, sequencer, **kwargs):
         super().__init__(name=name, sequencer=sequencer)
+        # polyphony limit, see wubwub.render.limit_voices()
+        self.max_voices = None
+        self.steal = 'oldest'
+
+    def _place_voices(self, voices):
+        '''Apply the groove to scheduled Voices, and then cut off
+        overlapping notes (when `overlap` is False) and limit the
+        polyphony, so both hold for the grooved positions.'''
+        voices = self._apply_groove(voices)
+        if not self.overlap:
+            voices = cut_overlaps(voices)
+        return limit_voices(voices, self.max_voices, self.steal)
 
     def make_notes(self, beats, pitches=0, lengths=1, volumes=0,
                    pitch_select='cycle', length_select='cycle',
@@ -413,7 +734,7 @@ class SamplerLikeTrack(Track):
                          start=1, end=None, pitch_select='cycle',
                          length_select='cycle', volume_select='cycle', merge=False,
                          attack=None, volume=1, attack_range=10, volume_range=10,
-                         skew=None, skew_dir=None,
+                         decay=None, sustain=None, skew=None, skew_dir=None,
                          vol_accent_freq=None, vol_accent_amount=4):
 
         freq = Fraction(freq).limit_denominator()
@@ -438,7 +759,7 @@ class SamplerLikeTrack(Track):
             d[pos] = Note(next(pitches), next(lengths),
                           volume_val, volume_range=volume_range,
                           attack=attack, attack_range=attack_range,
-                          skew=skew, skew_dir=skew_dir)
+                          decay=decay, sustain=sustain, skew=skew, skew_dir=skew_dir)
             b += freq
             count += 1
 
@@ -511,11 +832,44 @@ class SingleSampleTrack(Track):
             self._sample = sample
         else:
             raise WubWubError('sample must be a path or pydub.AudioSegment')
+        # loop points of the sample (see wubwub.render.SampleLoop), which
+        # do not carry over to a new sample
+        self.loop = None
+
+    def set_loop(self, start, end=None, crossfade=0):
+        '''
+        Set loop points on the sample of the Track, so notes longer than the
+        sample keep playing by repeating the region from `start` to `end`
+        (e.g. the sustained part of a pad).  The loop is played by indexing
+        into the sample, so it is never copied out.
+
+        Parameters
+        ----------
+        start : int or float
+            Start of the loop, in milliseconds of the sample.
+        end : int or float, optional
+            End of the loop, in milliseconds of the sample. The default is
+            None, meaning the end of the sample.
+        crossfade : int or float, optional
+            Length (in milliseconds) of the crossfade at the end of the
+            loop, into the audio before `start`. The default is 0.
+
+        Returns
+        -------
+        None.
+
+        '''
+        self.loop = sample_loop(self.sample, start, end, crossfade)
+
+    def clear_loop(self):
+        '''Remove the loop points of the sample.'''
+        self.loop = None
 
 class MultiSampleTrack(Track):
     def __init__(self, name, sequencer, **kwargs):
         super().__init__(name=name, sequencer=sequencer, **kwargs)
         self.samples = {}
+        self.loops = {}
 
 class Sampler(SingleSampleTrack, SamplerLikeTrack):
     def __init__(self, name, sample, sequencer, basepitch='C4', overlap=True, skew=None, skew_dir=None):
@@ -529,49 +883,40 @@ class Sampler(SingleSampleTrack, SamplerLikeTrack):
     def __repr__(self):
         return f'Sampler(name="{self.name}")'
 
-    def build(self, overhang=0, overhang_type='beats'):
-        overhang = 2
-        b = (1/self.get_bpm()) * MINUTE
-        overhang = _overhang_to_milli(overhang, overhang_type, b)
-        tracklength = self.get_beats() * b + overhang
-        audio = pydub.AudioSegment.silent(duration=tracklength)
+    def schedule(self):
+        tempo = self.get_tempo()
         sample = self.sample
         basepitch = self.basepitch
-        next_position = np.inf
+        voices = []
         for beat, value in sorted(self.notedict.items(), reverse=True):
 
-            position = (beat-1) * b
+            position = tempo.ms(beat)
 
             if isinstance(value, Note):
                 note = value
                 if note.skew and beat != 1:
                     position += note.skew
-                duration = note.length * b
-                if (position + duration) > next_position and not self.overlap:
-                    duration = next_position - position
-                next_position = position
-                audio = add_note_to_audio(note=note,
-                                          audio=audio,
-                                          sample=sample,
-                                          position=position,
-                                          duration=duration,
-                                          basepitch=basepitch)
+                duration = tempo.duration(beat, note.length)
+                voices.append(voice_from_note(note=note,
+                                              sample=sample,
+                                              position=position,
+                                              duration=duration,
+                                              basepitch=basepitch,
+                                              loop=self.loop))
 
             elif isinstance(value, Chord):
                 chord = value
                 for note in chord.notes:
-                    duration = note.length * b
-                    if (position + duration) > next_position and not self.overlap:
-                        duration = next_position - position
-                    audio = add_note_to_audio(note=note,
-                                              audio=audio,
-                                              sample=sample,
-                                              position=position,
-                                              duration=duration,
-                                              basepitch=basepitch)
-                next_position = position
+                    duration = tempo.duration(beat, note.length)
+                    voices.append(voice_from_note(note=note,
+                                                  sample=sample,
+                                                  position=position,
+                                                  duration=duration,
+                                                  basepitch=basepitch,
+                                                  loop=self.loop))
 
-        return self.postprocess(audio)
+        voices = [v for v in reversed(voices) if v is not None]
+        return self._place_voices(voices)
 
     def soundtest(self, duration=None, postprocess=True,):
         test = self.sample
@@ -592,41 +937,35 @@ class MultiSampler(MultiSampleTrack, SamplerLikeTrack):
     def __repr__(self):
         return f'MultiSampler(name="{self.name}")'
 
-    def build(self, overhang=0, overhang_type='beats'):
-        b = (1/self.get_bpm()) * MINUTE
-        overhang = _overhang_to_milli(overhang, overhang_type, b)
-        tracklength = self.get_beats() * b + overhang
-        audio = pydub.AudioSegment.silent(duration=tracklength)
-        next_position = np.inf
+    def _render_rate(self):
+        return max([s.frame_rate for s in self.samples.values()] + [11025])
+
+    def schedule(self):
+        tempo = self.get_tempo()
+        voices = []
         for beat, value in sorted(self.notedict.items(), reverse=True):
-            position = (beat-1) * b
+            position = tempo.ms(beat)
             if isinstance(value, Note):
                 note = value
-                duration = note.length * b
-                if (position + duration) > next_position and not self.overlap:
-                    duration = next_position - position
-                next_position = position
-                audio = add_note_to_audio(note=note,
-                                          audio=audio,
-                                          sample=self.get_sample(note.pitch),
-                                          position=position,
-                                          duration=duration,
-                                          shift=False)
-            elif isinstance(value, Chord):
-                chord = value
-                for note in chord.notes:
-                    duration = note.length * b
-                    if (position + duration) > next_position and not self.overlap:
-                        duration = next_position - position
-                    audio = add_note_to_audio(note=note,
-                                              audio=audio,
+                duration = tempo.duration(beat, note.length)
+                voices.append(voice_from_note(note=note,
                                               sample=self.get_sample(note.pitch),
                                               position=position,
                                               duration=duration,
-                                              shift=False)
-                next_position = position
+                                              shift=False,
+                                              loop=self.loops.get(note.pitch)))
+            elif isinstance(value, Chord):
+                chord = value
+                for note in chord.notes:
+                    duration = tempo.duration(beat, note.length)
+                    voices.append(voice_from_note(note=note,
+                                                  sample=self.get_sample(note.pitch),
+                                                  position=position,
+                                                  duration=duration,
+                                                  shift=False,
+                                                  loop=self.loops.get(note.pitch)))
 
-        return self.postprocess(audio)
+        return self._place_voices(voices[::-1])
 
     def soundtest(self, duration=None, postprocess=True,):
         for k, v in self.samples.items():
@@ -649,10 +988,25 @@ class MultiSampler(MultiSampleTrack, SamplerLikeTrack):
             self.samples[key] = sample
         else:
             raise WubWubError('sample must be a path or pydub.AudioSegment')
+        self.loops.pop(key, None)
+        self._touch()
 
     def get_sample(self, key):
         return self.samples.get(key, self.default_sample)
 
+    def set_loop(self, key, start, end=None, crossfade=0):
+        '''Set loop points (in milliseconds) on the sample for `key`; see
+        `wubwub.tracks.SingleSampleTrack.set_loop()`.'''
+        if key not in self.samples:
+            raise WubWubError(f'No sample for key "{key}".')
+        self.loops[key] = sample_loop(self.samples[key], start, end, crossfade)
+        self._touch()
+
+    def clear_loop(self, key):
+        '''Remove the loop points of the sample for `key`.'''
+        self.loops.pop(key, None)
+        self._touch()
+
 class Arpeggiator(SingleSampleTrack):
     def __init__(self, name, sample, sequencer, basepitch='C4', freq=.5,
                  method='up'):
@@ -683,13 +1037,11 @@ class Arpeggiator(SingleSampleTrack):
             b += freq
         self.add_fromdict(d, merge=merge)
 
-    def build(self, overhang=0, overhang_type='beats'):
-        b = (1/self.get_bpm()) * MINUTE
-        overhang = _overhang_to_milli(overhang, overhang_type, b)
-        tracklength = self.get_beats() * b + overhang
-        audio = pydub.AudioSegment.silent(duration=tracklength)
+    def schedule(self):
+        tempo = self.get_tempo()
         sample = self.sample
         basepitch = self.basepitch
+        voices = []
         next_beat = np.inf
         for beat, chord in sorted(self.notedict.items(), reverse=True):
             try:
@@ -701,17 +1053,18 @@ class Arpeggiator(SingleSampleTrack):
             next_beat = beat
             arpeggiated = arpeggiate(chord, beat=beat, length=length,
                                      freq=self.freq, method=self.method)
-            for arpbeat, note in arpeggiated.items():
-                position = (arpbeat-1) * b
-                duration = note.length * b
-                audio = add_note_to_audio(note=note,
-                                          audio=audio,
-                                          sample=sample,
-                                          position=position,
-                                          duration=duration,
-                                          basepitch=basepitch)
-
-        return self.postprocess(audio)
+            for arpbeat, note in reversed(arpeggiated.items()):
+                position = tempo.ms(arpbeat)
+                duration = tempo.duration(arpbeat, note.length)
+                voices.append(voice_from_note(note=note,
+                                              sample=sample,
+                                              position=position,
+                                              duration=duration,
+                                              basepitch=basepitch,
+                                              loop=self.loop))
+
+        return self._apply_groove([v for v in reversed(voices)
+                                   if v is not None])
 
     def soundtest(self, duration=None, postprocess=True,):
         test = self.sample